@@ -1,12 +1,23 @@
 from django.contrib import admin
 from .models import Subject, ClassGroup, Teacher, Timetable, Week, LessonRecord
+from django.contrib import messages
 from django.contrib.admin import AdminSite
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.exceptions import ValidationError
 from django import forms
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.admin import UserAdmin, GroupAdmin
 from django.urls import path
+from django.http import HttpResponseRedirect
 from django.shortcuts import render
-from .models import Student, StudentPayment
+from django.db.models import Count, OuterRef, Subquery, Sum
+from .models import ClassTermFee, PayrollBatch, Student, StudentPayment, StudentTermBalance, Term
+from .availability import SlotTaken, available_timetables, schedule_lesson
+from .fees import PAYMENTS_PAGE_SIZE, filter_payments, paginate_payments
+from .generation import generate_week_lessons
+from .payroll import apply_transition
+from .reference import cached_choices_for, get_class_groups, get_terms, model_choices, reference_objects
+from .replicas import reporting_reads
 
 
 
@@ -16,13 +27,42 @@ class MyAdminSite(AdminSite):
     index_title = "Welcome to the Admin Dashboard"  # Dashboard title
 
 
+# ----------------------------
+# Cached reference-data dropdowns
+# ----------------------------
+class ReferenceChoicesMixin:
+    """
+    Fill reference-data selects from the cache. Autocomplete fields are left
+    alone: their widget only renders the selected rows and searches the rest.
+    """
+
+    def _cached_objects(self, db_field, request):
+        if db_field.name in self.get_autocomplete_fields(request):
+            return None
+        return cached_choices_for(db_field.related_model)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        objects = self._cached_objects(db_field, request)
+        if formfield is not None and objects is not None:
+            formfield.choices = model_choices(objects, formfield.empty_label)
+        return formfield
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_manytomany(db_field, request, **kwargs)
+        objects = self._cached_objects(db_field, request)
+        if formfield is not None and objects is not None:
+            formfield.choices = model_choices(objects, empty_label=None)
+        return formfield
+
+
 # ----------------------------
 # Subject Admin
 # ----------------------------
 @admin.register(Subject)
 class SubjectAdmin(admin.ModelAdmin):
     list_display = ('id', 'name')
-    search_fields = ('name',)
+    search_fields = ('^name',)
 
 
 # ----------------------------
@@ -32,8 +72,9 @@ class SubjectAdmin(admin.ModelAdmin):
 @admin.register(ClassGroup)
 class ClassGroupAdmin(admin.ModelAdmin):
     list_display = ("id", "name", "class_teacher")  # Show class teacher in the list
-    search_fields = ("name", "class_teacher__user__username", "class_teacher__user__first_name", "class_teacher__user__last_name")
+    search_fields = ("^name", "^class_teacher__user__username", "^class_teacher__user__first_name", "^class_teacher__user__last_name")
     change_list_template = "admin/lessons/classgroup/change_list.html"
+    payments_page_size = PAYMENTS_PAGE_SIZE
 
     def get_urls(self):
         urls = super().get_urls()
@@ -46,13 +87,24 @@ class ClassGroupAdmin(admin.ModelAdmin):
         ]
         return custom_urls + urls
 
+    @reporting_reads()
     def payments_dashboard(self, request):
-        students = Student.objects.all()
-        payments = StudentPayment.objects.all()
+        payments, filters = filter_payments(request.GET)
+        totals = payments.aggregate(payment_count=Count("id"), total_amount=Sum("amount", default=0))
+        page, next_cursor = paginate_payments(payments, request.GET.get("cursor"), self.payments_page_size)
+
+        next_params = request.GET.copy()
+        next_params["cursor"] = next_cursor or ""
 
         return render(request, "admin/lessons/payments_dashboard.html", {
-            "students": students,
-            "payments": payments,
+            **self.admin_site.each_context(request),
+            "title": "Payments Dashboard",
+            "payments": page,
+            "next_query": next_params.urlencode() if next_cursor else "",
+            "filters": filters,
+            "class_groups": get_class_groups(),
+            "terms": get_terms(),
+            **totals,
         })
 
 
@@ -62,11 +114,17 @@ class ClassGroupAdmin(admin.ModelAdmin):
 # Teacher Admin
 # ----------------------------
 @admin.register(Teacher)
-class TeacherAdmin(admin.ModelAdmin):
+class TeacherAdmin(ReferenceChoicesMixin, admin.ModelAdmin):
     list_display = ('id', 'user', 'get_subjects', 'is_class_teacher')  # show is_class_teacher
     list_editable = ('is_class_teacher',)  # allow inline editing in list view
-    filter_horizontal = ('subjects', 'class_groups')
-    search_fields = ('user__first_name', 'user__last_name', 'subjects__name', 'class_groups__name')
+    autocomplete_fields = ('user', 'subjects', 'class_groups')
+    # Prefix searches on the user only: also matching subjects/classes needs
+    # many-to-many joins plus DISTINCT on every autocomplete keystroke
+    search_fields = ('^user__username', '^user__first_name', '^user__last_name')
+
+    def get_queryset(self, request):
+        # str(teacher) is the user's name, for the changelist and autocomplete results
+        return super().get_queryset(request).select_related('user').prefetch_related('subjects')
 
     def get_subjects(self, obj):
         return ", ".join([s.name for s in obj.subjects.all()])
@@ -76,11 +134,14 @@ class TeacherAdmin(admin.ModelAdmin):
 # Timetable Admin
 # ----------------------------
 @admin.register(Timetable)
-class TimetableAdmin(admin.ModelAdmin):
+class TimetableAdmin(ReferenceChoicesMixin, admin.ModelAdmin):
     list_display = ('id', 'subject_fk', 'teacher', 'day', 'start_time', 'end_time')
-    filter_horizontal = ('class_groups',)
+    autocomplete_fields = ('teacher', 'subject_fk', 'class_groups')
     list_filter = ('day', 'teacher',)
-    search_fields = ('subject_fk__name', 'teacher__user__first_name', 'teacher__user__last_name', 'class_groups__name')
+    search_fields = ('^subject_fk__name', '^teacher__user__first_name', '^teacher__user__last_name')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('subject_fk', 'teacher__user')
 
     def get_classes(self, obj):
         return ", ".join([c.name for c in obj.class_groups.all()])
@@ -93,26 +154,67 @@ class TimetableAdmin(admin.ModelAdmin):
 @admin.register(Week)
 class WeekAdmin(admin.ModelAdmin):
     list_display = ('id', 'number', 'start_date', 'end_date', 'created_at')
-    search_fields = ('number',)
+    search_fields = ('=number',)
+    actions = ['generate_lessons']
+
+    @admin.action(description="Generate pending lessons from the timetable")
+    def generate_lessons(self, request, queryset):
+        for week in queryset:
+            created, skipped = generate_week_lessons(week)
+            self.message_user(
+                request,
+                f"{week}: created {created} lessons, skipped {skipped} already scheduled.",
+                messages.SUCCESS,
+            )
 
 
 # ----------------------------
 # Custom filter for class in LessonRecord
 # ----------------------------
-class ClassGroupFilter(admin.SimpleListFilter):
-    title = 'Class'
-    parameter_name = 'class_group'
+class CachedRelatedFilter(admin.SimpleListFilter):
+    """
+    Filter on a related object whose choices come from the reference-data
+    cache, so rendering the changelist sidebar costs no queries.
+    """
+    reference = None   # key of reference.REFERENCE_MODELS
+    field_path = None  # lookup from the changelist model to the related object
 
     def lookups(self, request, model_admin):
-        classes = ClassGroup.objects.all()
-        return [(c.id, c.name) for c in classes]
+        return [(obj.pk, str(obj)) for obj in reference_objects(self.reference)]
 
     def queryset(self, request, queryset):
         if self.value():
-            return queryset.filter(timetable__class_groups__id=self.value())
+            # As FieldListFilter does: the admin answers a bad value with ?e=1
+            try:
+                return queryset.filter(**{f"{self.field_path}__id": self.value()})
+            except (ValueError, ValidationError) as exc:
+                raise IncorrectLookupParameters(exc)
         return queryset
 
 
+class ClassGroupFilter(CachedRelatedFilter):
+    title = 'Class'
+    parameter_name = 'class_group'
+    reference = 'class_group'
+    field_path = 'timetable__class_groups'
+
+
+# Parameter names match payroll.LESSON_FILTERS, so a changelist URL's filters
+# can be posted as they are to the staff transition endpoint
+class WeekFilter(CachedRelatedFilter):
+    title = 'week'
+    parameter_name = 'week'
+    reference = 'week'
+    field_path = 'week'
+
+
+class TimetableTeacherFilter(CachedRelatedFilter):
+    title = 'teacher'
+    parameter_name = 'teacher'
+    reference = 'teacher'
+    field_path = 'timetable__teacher'
+
+
 # ----------------------------
 # LessonRecord form
 # ----------------------------
@@ -131,7 +233,9 @@ class LessonRecordForm(forms.ModelForm):
         if 'created_by' in self.data:
             try:
                 teacher_id = int(self.data.get('created_by'))
-                self.fields['timetable'].queryset = Timetable.objects.filter(teacher_id=teacher_id)
+                self.fields['timetable'].queryset = available_timetables(
+                    teacher_id, self.data.get('week') or None, ignore_lesson_id=self.instance.pk
+                )
             except (ValueError, TypeError):
                 pass
         elif self.instance.pk and self.instance.timetable:
@@ -144,10 +248,18 @@ class LessonRecordForm(forms.ModelForm):
 # LessonRecord admin
 # ----------------------------
 @admin.register(LessonRecord)
-class LessonRecordAdmin(admin.ModelAdmin):
+class LessonRecordAdmin(ReferenceChoicesMixin, admin.ModelAdmin):
     form = LessonRecordForm
+    # The timetable stays a plain select: lessonrecord.js fills it with the
+    # chosen teacher's free slots for the chosen week
+    autocomplete_fields = ('created_by', 'week')
     list_display = ('id', 'get_teacher', 'timetable', 'week', 'status', 'payment_status', 'amount')
-    list_filter = ('week', 'timetable__teacher', 'status', 'payment_status')
+    list_filter = (WeekFilter, TimetableTeacherFilter, 'status', 'payment_status')
+    # Everything get_teacher, Timetable.__str__ and Week.__str__ touch, in the page query
+    list_select_related = ('created_by__user', 'timetable__subject_fk', 'timetable__teacher__user', 'week')
+    # Skip the second, unfiltered COUNT(*) over the whole table
+    show_full_result_count = False
+    actions = ['mark_attended', 'mark_not_attended', 'mark_paid', 'mark_unpaid']
 
     class Media:
         js = ('lessons/js/lessonrecord.js',)
@@ -164,7 +276,43 @@ class LessonRecordAdmin(admin.ModelAdmin):
             obj.created_by = teacher_from_form
         elif obj.timetable and not obj.created_by:
             obj.created_by = obj.timetable.teacher
-        super().save_model(request, obj, form, change)
+        # Same single-write path as the teacher view; the form has already
+        # rejected used slots, so SlotTaken here means a concurrent submit won.
+        schedule_lesson(obj)
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        try:
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        except SlotTaken as exc:
+            # Raised from save_model; the admin's transaction has rolled back
+            self.message_user(request, str(exc), messages.ERROR)
+            return HttpResponseRedirect(request.get_full_path())
+
+    def _transition(self, request, queryset, field, value):
+        # The changelist filters need not match what was ticked, so record the lessons
+        filters = {'ids': sorted(queryset.values_list('pk', flat=True))}
+        batch = apply_transition(queryset, field, value, user=request.user, filters=filters)
+        self.message_user(
+            request,
+            f"{batch.row_count} lessons set to {value} (total {batch.total_amount}).",
+            messages.SUCCESS,
+        )
+
+    @admin.action(description="Mark selected lessons Attended")
+    def mark_attended(self, request, queryset):
+        self._transition(request, queryset, 'status', 'Attended')
+
+    @admin.action(description="Mark selected lessons Not Attended")
+    def mark_not_attended(self, request, queryset):
+        self._transition(request, queryset, 'status', 'Not Attended')
+
+    @admin.action(description="Mark selected lessons Paid")
+    def mark_paid(self, request, queryset):
+        self._transition(request, queryset, 'payment_status', 'Paid')
+
+    @admin.action(description="Mark selected lessons Unpaid")
+    def mark_unpaid(self, request, queryset):
+        self._transition(request, queryset, 'payment_status', 'Unpaid')
 
     def get_teacher(self, obj):
         if obj.created_by:
@@ -175,6 +323,119 @@ class LessonRecordAdmin(admin.ModelAdmin):
     get_teacher.short_description = "Teacher"
 
 
+# ----------------------------
+# Student admin: debt is judged per term from StudentTermBalance.balance, a
+# stored generated column, so debt filters and sorting run in SQL
+# ----------------------------
+class DebtFilter(admin.SimpleListFilter):
+    title = 'Debt'
+    parameter_name = 'debt'
+    # Path from the filtered model to the balance judged, and any lookups
+    # that pick which term's balance that is
+    balance_path = 'balance'
+    term_lookups = {}
+
+    def lookups(self, request, model_admin):
+        return [('owing', 'Owing'), ('cleared', 'Fully paid')]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'owing':
+            return queryset.filter(**{f'{self.balance_path}__gt': 0}, **self.term_lookups)
+        if self.value() == 'cleared':
+            return queryset.filter(**{f'{self.balance_path}__lte': 0}, **self.term_lookups)
+        return queryset
+
+
+class CurrentTermDebtFilter(DebtFilter):
+    title = 'Debt this term'
+    balance_path = 'term_balances__balance'
+    term_lookups = {'term_balances__term__is_current': True}
+
+
+@admin.register(Student)
+class StudentAdmin(admin.ModelAdmin):
+    list_display = (
+        'admission_number', 'first_name', 'last_name', 'class_group', 'term_fee', 'amount_paid', 'current_balance',
+    )
+    list_filter = (CurrentTermDebtFilter, 'class_group')
+    list_select_related = ('class_group',)
+    search_fields = ('admission_number', 'first_name', 'last_name')
+    readonly_fields = ('amount_paid',)
+
+    # Most owing first. Not ``ordering``, which may only name model fields:
+    # the annotation has to exist before the queryset is ordered by it
+    default_ordering = ('-current_balance', 'admission_number')
+
+    def get_queryset(self, request):
+        current = StudentTermBalance.objects.filter(student=OuterRef('pk'), term__is_current=True)
+        return (
+            self.model._default_manager.annotate(current_balance=Subquery(current.values('balance')[:1]))
+            .order_by(*self.default_ordering)
+        )
+
+    def get_ordering(self, request):
+        return self.default_ordering
+
+    @admin.display(description='Balance this term', ordering='current_balance')
+    def current_balance(self, obj):
+        return obj.current_balance
+
+
+@admin.register(StudentPayment)
+class StudentPaymentAdmin(ReferenceChoicesMixin, admin.ModelAdmin):
+    list_display = ('student', 'amount', 'term', 'date_paid', 'recorded_by')
+    list_filter = ('term',)
+    list_select_related = ('student', 'recorded_by__user', 'term')
+    search_fields = ('student__admission_number', 'student__first_name', 'student__last_name')
+    raw_id_fields = ('student',)
+
+
+# ----------------------------
+# Terms, fee schedule and per-term balances
+# ----------------------------
+class ClassTermFeeInline(ReferenceChoicesMixin, admin.TabularInline):
+    model = ClassTermFee
+    extra = 0
+
+
+@admin.register(Term)
+class TermAdmin(admin.ModelAdmin):
+    list_display = ('name', 'start_date', 'end_date', 'is_current')
+    inlines = [ClassTermFeeInline]
+
+
+@admin.register(StudentTermBalance)
+class StudentTermBalanceAdmin(admin.ModelAdmin):
+    """Read-only: rows are maintained from StudentPayment and ClassTermFee writes."""
+    list_display = ('student', 'term', 'fee', 'paid', 'balance')
+    list_filter = ('term', DebtFilter, 'student__class_group')
+    list_select_related = ('student', 'term')
+    search_fields = ('student__admission_number', 'student__first_name', 'student__last_name')
+    ordering = ('-balance',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+# ----------------------------
+# PayrollBatch admin (read-only audit trail)
+# ----------------------------
+@admin.register(PayrollBatch)
+class PayrollBatchAdmin(admin.ModelAdmin):
+    list_display = ('id', 'created_at', 'created_by', 'field', 'new_value', 'row_count', 'total_amount')
+    list_filter = ('field', 'new_value')
+    readonly_fields = ('field', 'new_value', 'filters', 'row_count', 'total_amount', 'created_by', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 # ----------------------------
 # Custom Admin Site
 # ----------------------------
@@ -185,5 +446,10 @@ admin_site.register(Teacher, TeacherAdmin)
 admin_site.register(Timetable, TimetableAdmin)
 admin_site.register(Week, WeekAdmin)
 admin_site.register(LessonRecord, LessonRecordAdmin)
+admin_site.register(PayrollBatch, PayrollBatchAdmin)
+admin_site.register(Student, StudentAdmin)
+admin_site.register(StudentPayment, StudentPaymentAdmin)
+admin_site.register(Term, TermAdmin)
+admin_site.register(StudentTermBalance, StudentTermBalanceAdmin)
 admin_site.register(User, UserAdmin)
 admin_site.register(Group, GroupAdmin)
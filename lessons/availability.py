@@ -0,0 +1,56 @@
+# lessons/availability.py
+"""
+Which of a teacher's timetable slots are still free in a given week.
+
+Every view and form that offers a timetable dropdown asks this module, so
+the "already scheduled" rule lives in one place and is always answered by
+a single NOT EXISTS anti-join instead of a subquery plus a follow-up
+exists() check. Saving goes through ``schedule_lesson``, which relies on
+the (timetable, week) unique constraint rather than a read-then-write.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+
+from .models import LessonRecord, Timetable
+
+
+def available_timetables(teacher_id, week_id=None, ignore_lesson_id=None):
+    """
+    Timetables of ``teacher_id`` with no LessonRecord in ``week_id``.
+
+    Without a week every timetable of the teacher is returned. Pass
+    ``ignore_lesson_id`` when editing a lesson so its own slot stays listed.
+    """
+    timetables = Timetable.objects.filter(teacher_id=teacher_id)
+    if not week_id:
+        return timetables
+
+    used = LessonRecord.objects.filter(timetable=OuterRef("pk"), week_id=week_id)
+    if ignore_lesson_id:
+        used = used.exclude(pk=ignore_lesson_id)
+    return timetables.filter(~Exists(used))
+
+
+class SlotTaken(Exception):
+    """The timetable slot already has a lesson in that week."""
+
+    message = "This lesson has already been scheduled for this week."
+
+
+def schedule_lesson(lesson):
+    """
+    Insert (or update) ``lesson`` in a single write.
+
+    A concurrent submit for the same timetable and week loses on the
+    unique constraint and gets ``SlotTaken`` instead of creating a duplicate.
+    """
+    try:
+        with transaction.atomic():
+            lesson.save()
+    except IntegrityError as exc:
+        if LessonRecord.objects.filter(timetable_id=lesson.timetable_id, week_id=lesson.week_id).exclude(
+            pk=lesson.pk
+        ).exists():
+            raise SlotTaken(SlotTaken.message) from exc
+        raise
+    return lesson
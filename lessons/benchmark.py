@@ -0,0 +1,199 @@
+# lessons/benchmark.py
+"""
+Seed a large synthetic dataset and time the hot dashboard and AJAX queries.
+
+Every case calls the same helpers the views use, so the SQL measured is the
+SQL served. Each captured statement is run again under the backend's
+EXPLAIN prefix (``EXPLAIN QUERY PLAN`` on SQLite) so that a query that
+stops using its index shows up as a changed plan, not only as a slower
+time. ``manage.py benchmark_queries`` runs this in a throwaway database.
+"""
+import datetime
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models.functions import Mod
+from django.test.utils import CaptureQueriesContext
+
+from .availability import available_timetables
+from .fees import paginate_payments
+from .models import (
+    ClassGroup,
+    LessonRecord,
+    Student,
+    StudentPayment,
+    Subject,
+    Teacher,
+    Term,
+    Timetable,
+    Week,
+)
+from .payroll import payroll_rows
+from .summaries import rebuild_summaries, summary_statistics
+
+
+SEED_BATCH_SIZE = 2000
+
+
+def seed(teachers=200, weeks=40, slots=5, students=5000, payments=3, rng=None):
+    """
+    Bulk-insert a synthetic school: ``teachers`` with ``slots`` timetable
+    rows each, a lesson for every slot in each of ``weeks``, and
+    ``students`` with ``payments`` payments apiece. Signals are bypassed,
+    so summaries are rebuilt once at the end.
+    """
+    rng = rng or random.Random(0)
+    days = [day for day, _ in Timetable.DAYS]
+    statuses = [value for value, _ in LessonRecord._meta.get_field("status").choices]
+    payment_statuses = [value for value, _ in LessonRecord._meta.get_field("payment_status").choices]
+
+    with transaction.atomic():
+        subjects = Subject.objects.bulk_create(Subject(name=f"Subject {n}") for n in range(12))
+        classes = ClassGroup.objects.bulk_create(ClassGroup(name=f"Class {n}") for n in range(40))
+        first_monday = datetime.date(2025, 1, 6)
+        week_rows = Week.objects.bulk_create(
+            Week(
+                number=n + 1,
+                start_date=first_monday + datetime.timedelta(weeks=n),
+                end_date=first_monday + datetime.timedelta(weeks=n, days=4),
+            )
+            for n in range(weeks)
+        )
+        users = User.objects.bulk_create(
+            (User(username=f"bench{n}", first_name="Bench", last_name=f"Teacher{n}") for n in range(teachers)),
+            batch_size=SEED_BATCH_SIZE,
+        )
+        teacher_rows = Teacher.objects.bulk_create(
+            (Teacher(user=user) for user in users), batch_size=SEED_BATCH_SIZE
+        )
+
+        timetables = Timetable.objects.bulk_create(
+            (
+                Timetable(
+                    teacher=teacher,
+                    subject_fk=rng.choice(subjects),
+                    day=days[slot % len(days)],
+                    start_time=datetime.time(8 + slot),
+                    end_time=datetime.time(9 + slot),
+                )
+                for teacher in teacher_rows
+                for slot in range(slots)
+            ),
+            batch_size=SEED_BATCH_SIZE,
+        )
+        Timetable.class_groups.through.objects.bulk_create(
+            (
+                Timetable.class_groups.through(timetable_id=timetable.id, classgroup_id=rng.choice(classes).id)
+                for timetable in timetables
+            ),
+            batch_size=SEED_BATCH_SIZE,
+        )
+        LessonRecord.objects.bulk_create(
+            (
+                LessonRecord(
+                    timetable=timetable,
+                    week=week,
+                    created_by_id=timetable.teacher_id,
+                    status=rng.choice(statuses),
+                    payment_status=rng.choice(payment_statuses),
+                )
+                for week in week_rows
+                for timetable in timetables
+            ),
+            batch_size=SEED_BATCH_SIZE,
+        )
+
+        term = Term.objects.create(name="Bench term")
+        student_rows = Student.objects.bulk_create(
+            (
+                Student(
+                    first_name="Bench",
+                    last_name=f"Student{n}",
+                    admission_number=f"B{n:07d}",
+                    class_group=rng.choice(classes),
+                )
+                for n in range(students)
+            ),
+            batch_size=SEED_BATCH_SIZE,
+        )
+        StudentPayment.objects.bulk_create(
+            (
+                StudentPayment(student=student, term=term, amount=Decimal(rng.randint(1, 50) * 10))
+                for student in student_rows
+                for _ in range(payments)
+            ),
+            batch_size=SEED_BATCH_SIZE,
+        )
+        # date_paid is auto_now_add, so spread the history out afterwards
+        spread = StudentPayment.objects.annotate(slot=Mod("id", 30))
+        for slot in range(30):
+            spread.filter(slot=slot).update(date_paid=datetime.date(2025, 1, 1) + datetime.timedelta(days=slot * 3))
+
+    rebuild_summaries()
+
+
+def cases():
+    """``[(name, callable), ...]`` mirroring the views' hot queries."""
+    # Imported here: the views module pulls in forms, templates and URLs
+    from .views import lesson_statistics, paginate_lessons
+
+    teacher = Teacher.objects.order_by("id")[Teacher.objects.count() // 2]
+    week = Week.objects.order_by("-number").first()
+    student = Student.objects.order_by("id").last()
+    lessons = LessonRecord.objects.filter(timetable__teacher=teacher)
+
+    return [
+        ("dashboard: lesson page", lambda: paginate_lessons(lessons)),
+        ("dashboard: lesson page, one week", lambda: paginate_lessons(lessons.filter(week=week))),
+        ("dashboard: summary statistics", lambda: summary_statistics(teacher, week.id, None, None)),
+        ("dashboard: live statistics", lambda: lesson_statistics(lessons)),
+        ("dashboard: lessons by status", lambda: lessons.filter(status="Attended", payment_status="Unpaid").count()),
+        ("ajax: free timetables", lambda: list(available_timetables(teacher.id, week.id))),
+        ("ajax: teacher timetables by day", lambda: list(Timetable.objects.filter(teacher=teacher, day="Mon"))),
+        ("week: lessons of a week", lambda: LessonRecord.objects.filter(week=week).count()),
+        ("payroll: by recording teacher", lambda: list(payroll_rows("created_by"))),
+        (
+            "payroll: one teacher's unpaid lessons",
+            lambda: LessonRecord.objects.filter(created_by=teacher, status="Attended", payment_status="Unpaid").count(),
+        ),
+        ("payments: student history", lambda: list(StudentPayment.objects.filter(student=student)[:20])),
+        ("payments: admin history page", lambda: paginate_payments(StudentPayment.objects.all())),
+    ]
+
+
+def explain(sql):
+    """The plan of ``sql`` as a list of lines, without SQLite's node ids."""
+    prefix = connection.ops.explain_query_prefix()
+    with connection.cursor() as cursor:
+        cursor.execute(f"{prefix} {sql}")
+        return [str(row[-1]) for row in cursor.fetchall()]
+
+
+def run_cases(repeat=5):
+    """
+    Time every case ``repeat`` times and explain each statement it runs.
+
+    Returns ``{name: {"median_ms": float, "queries": [{"sql", "plan"}]}}``.
+    """
+    results = {}
+    for name, case in cases():
+        with CaptureQueriesContext(connection) as ctx:
+            case()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            case()
+            timings.append((time.perf_counter() - start) * 1000)
+        results[name] = {
+            "median_ms": round(statistics.median(timings), 3),
+            "queries": [
+                {"sql": query["sql"], "plan": explain(query["sql"])}
+                for query in ctx.captured_queries
+                if query["sql"].lstrip().upper().startswith("SELECT")
+            ],
+        }
+    return results
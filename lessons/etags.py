@@ -0,0 +1,89 @@
+# lessons/etags.py
+"""
+ETags for the timetable JSON endpoints, and cache keys for the teacher
+dashboard.
+
+A response only depends on the requested teachers' timetables and lessons
+plus the subject and class names, so its ETag is built from per-teacher
+version counters (bumped by ``lessons.signals``) and the reference-data
+versions. Django's ``condition`` decorator compares it with If-None-Match
+and answers 304 before the view runs any of its queries. The dashboard's
+rendered page is cached under a key built from the same counters.
+
+The counters are only trustworthy when every worker shares the cache, so
+without ``settings.SHARED_CACHE`` no ETag is sent and no dashboard is
+cached. Counters are bumped again once the writing transaction commits
+(see ``reference.bump_cache_version``), so a page rendered by another
+worker from the pre-commit rows does not outlive the write.
+"""
+import hashlib
+
+from django.conf import settings
+
+from .models import Teacher
+from .reference import bump_cache_version, cache_version, reference_version
+
+
+def _teacher_key(teacher_id):
+    return f"teacher:{teacher_id}:version"
+
+
+def teacher_version(teacher_id):
+    return cache_version(_teacher_key(teacher_id))
+
+
+def bump_teacher_versions(teacher_ids):
+    for teacher_id in set(teacher_ids):
+        if teacher_id is not None:
+            bump_cache_version(_teacher_key(teacher_id))
+
+
+def _requested_teacher_ids(request):
+    value = request.GET.get("teacher", "")
+    return [int(value)] if value.isdigit() else []
+
+
+def _etag(request, teacher_ids):
+    parts = [request.get_full_path(), reference_version("subject"), reference_version("class_group")]
+    parts.extend(f"{teacher_id}={teacher_version(teacher_id)}" for teacher_id in teacher_ids)
+    return hashlib.md5("|".join(map(str, parts)).encode(), usedforsecurity=False).hexdigest()
+
+
+def timetables_etag(request, *args, **kwargs):
+    """ETag for endpoints that take a ``?teacher=`` id."""
+    if not getattr(settings, "SHARED_CACHE", False):
+        return None
+    return _etag(request, _requested_teacher_ids(request))
+
+
+def own_timetables_etag(request, *args, **kwargs):
+    """ETag for endpoints that list the logged-in teacher's own timetables."""
+    if not getattr(settings, "SHARED_CACHE", False):
+        return None
+    teacher_id = Teacher.objects.filter(user=request.user).values_list("id", flat=True).first()
+    return _etag(request, [teacher_id] if teacher_id else [])
+
+
+# GET parameters that change what the dashboard shows
+DASHBOARD_PARAMS = ("week", "class_group", "subject", "cursor")
+
+
+def dashboard_cache_key(request, teacher_id):
+    """
+    Cache key for ``teacher_id``'s rendered dashboard, or None if the page
+    must not be cached.
+
+    The page embeds CSRF tokens, so the key includes the browser's CSRF
+    secret. Before the browser has that cookie nothing is cached, and
+    nothing is cached at all without ``settings.SHARED_CACHE``.
+    """
+    if not getattr(settings, "SHARED_CACHE", False):
+        return None
+    csrf_secret = request.META.get("CSRF_COOKIE")
+    if not csrf_secret:
+        return None
+    parts = [teacher_id, teacher_version(teacher_id), csrf_secret]
+    parts.extend(request.GET.get(name, "") for name in DASHBOARD_PARAMS)
+    parts.extend(reference_version(name) for name in ("week", "class_group", "subject", "teacher"))
+    digest = hashlib.md5("|".join(map(str, parts)).encode(), usedforsecurity=False).hexdigest()
+    return f"dashboard:{teacher_id}:{digest}"
@@ -0,0 +1,397 @@
+# lessons/fees.py
+"""
+Recording student fee payments, per-term balances, and fee statistics.
+
+StudentPayment rows are the ledger. Two running totals are kept from it,
+both only ever moved by F() increments in the same transaction as the
+payment write (here for bulk paths, in ``lessons.signals`` for single
+saves and deletes): ``Student.amount_paid`` across all terms, and
+``StudentTermBalance.paid`` per (student, term). ``reconcile_balances``
+checks and repairs both. Debt is always judged per term, from
+StudentTermBalance: ``amount_paid`` spans every term, so it cannot be
+compared with one term's fee.
+
+A StudentTermBalance is opened for every student in the current term and
+in every term their class has a ClassTermFee for; its fee comes from that
+schedule, or from ``Student.term_fee`` when the class has none. Rows are
+opened and re-priced by writes only (the signals, the CSV import and
+payment recording), never while a page is being read.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, Exists, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_date
+
+from .models import ClassGroup, ClassTermFee, Student, StudentPayment, StudentTermBalance, Term
+
+
+def parse_payment_amounts(data, prefix="amount_"):
+    """
+    Pull ``{student_id: Decimal}`` out of posted ``amount_<id>`` fields,
+    ignoring blanks, junk and anything that is not a positive amount.
+    """
+    amounts = {}
+    for key, raw in data.items():
+        if not key.startswith(prefix) or not raw:
+            continue
+        student_id = key[len(prefix):]
+        if not student_id.isdigit():
+            continue
+        try:
+            amount = Decimal(raw)
+        except (InvalidOperation, ValueError):
+            continue
+        if amount.is_finite() and amount > 0:
+            amounts[int(student_id)] = amount
+    return amounts
+
+
+def _increments(amounts, field="student_id"):
+    """``CASE student_id WHEN ... THEN amount END`` for one set-based UPDATE."""
+    return Case(
+        *(When(**{field: key}, then=Value(amount)) for key, amount in amounts.items()),
+        output_field=DecimalField(max_digits=8, decimal_places=2),
+    )
+
+
+def record_class_payments(class_group, amounts, recorded_by=None, term=None):
+    """
+    Record one payment per student in ``amounts`` against ``term``.
+
+    ``term`` defaults to the current term, read from the database rather
+    than the reference cache; ValueError is raised if there is none. Runs as one transaction with a fixed number of statements however
+    many students are posted: an id check against ``class_group``, a bulk
+    INSERT of the payments, one UPDATE of ``amount_paid``, opening any
+    missing term balances and one UPDATE of their ``paid``. Returns the
+    created payments.
+    """
+    term = term or Term.current()
+    if term is None:
+        raise ValueError("No current term is set.")
+
+    student_ids = list(
+        Student.objects.filter(class_group=class_group, id__in=amounts).values_list("id", flat=True)
+    )
+    if not student_ids:
+        return []
+    amounts = {student_id: amounts[student_id] for student_id in student_ids}
+
+    with transaction.atomic():
+        payments = StudentPayment.objects.bulk_create([
+            StudentPayment(student_id=student_id, amount=amount, recorded_by=recorded_by, term=term)
+            for student_id, amount in amounts.items()
+        ])
+
+        # F() keeps the increments atomic against concurrent submits; the
+        # CASE folds every student's amount into a single UPDATE.
+        Student.objects.filter(id__in=student_ids).update(amount_paid=F("amount_paid") + _increments(amounts, "id"))
+        open_term_balances(term, Student.objects.filter(id__in=student_ids))
+        StudentTermBalance.objects.filter(term=term, student_id__in=student_ids).update(
+            paid=F("paid") + _increments(amounts)
+        )
+
+    return payments
+
+
+def student_fee_statistics(balances, fee="fee", paid="paid"):
+    """
+    Totals and payment-status buckets for one term's ``balances`` in one query.
+
+    Each StudentTermBalance is compared with its own fee, so classes with
+    different fees are counted correctly.
+    """
+    stats = balances.aggregate(
+        total_students=Count("id"),
+        total_fees=Sum(fee, default=0),
+        total_paid=Sum(paid, default=0),
+        fully_paid=Count("id", filter=Q(**{f"{paid}__gte": F(fee)})),
+        partial_paid=Count("id", filter=Q(**{f"{paid}__gt": 0, f"{paid}__lt": F(fee)})),
+        unpaid=Count("id", filter=Q(**{f"{paid}__lte": 0})),
+    )
+    stats["total_unpaid"] = stats["total_fees"] - stats["total_paid"]
+    return stats
+
+
+def class_fee_statistics(term, class_groups=None):
+    """
+    Per-class student counts and fee totals for ``term`` as one grouped query.
+
+    Classes without balances in the term are included with zero totals.
+    """
+    class_groups = ClassGroup.objects.all() if class_groups is None else class_groups
+    in_term = Q(students__term_balances__term=term)
+    return class_groups.annotate(
+        total_students=Count("students__term_balances", filter=in_term),
+        total_fees=Sum("students__term_balances__fee", filter=in_term, default=0),
+        total_paid=Sum("students__term_balances__paid", filter=in_term, default=0),
+        total_unpaid=Sum("students__term_balances__balance", filter=in_term, default=0),
+    ).order_by("name")
+
+
+# ?sort= values accepted by the bursar's student table; "-" reverses.
+STUDENT_SORTS = {
+    "name": ("student__last_name", "student__first_name"),
+    "admission": ("student__admission_number",),
+    "class": ("student__class_group__name",),
+    "term_fee": ("fee",),
+    "paid": ("paid",),
+    "balance": ("balance",),
+}
+
+
+def sort_students(balances, sort):
+    """
+    Order one term's ``balances`` by a ``STUDENT_SORTS`` key, falling back to name.
+
+    Returns ``(queryset, sort)`` with the sort actually applied. The student
+    id is always the last ordering so pages are stable between requests.
+    """
+    key = (sort or "").lstrip("-")
+    if key not in STUDENT_SORTS:
+        sort = key = "name"
+    prefix = "-" if sort.startswith("-") else ""
+    ordering = [prefix + field for field in STUDENT_SORTS[key]]
+    return balances.order_by(*ordering, prefix + "student_id"), sort
+
+
+# ---------- Payment history ----------
+
+PAYMENTS_PAGE_SIZE = 50
+
+PAYMENT_FILTERS = {
+    "class_group": "student__class_group_id",
+    "term": "term_id",
+    "date_from": "date_paid__gte",
+    "date_to": "date_paid__lte",
+}
+
+
+def filter_payments(params, payments=None):
+    """
+    Narrow ``payments`` by the known keys in ``params`` (e.g. request.GET).
+
+    Returns ``(queryset, applied)``; values that do not parse (a non-numeric
+    class or term id, a bad date) are ignored rather than raising.
+    """
+    payments = StudentPayment.objects.all() if payments is None else payments
+    applied = {}
+    for key, lookup in PAYMENT_FILTERS.items():
+        value = (params.get(key) or "").strip()
+        if not value:
+            continue
+        if key in ("class_group", "term") and not value.isdigit():
+            continue
+        if key.startswith("date_"):
+            try:
+                if parse_date(value) is None:
+                    continue
+            except ValueError:
+                continue
+        payments = payments.filter(**{lookup: value})
+        applied[key] = value
+    return payments, applied
+
+
+def paginate_payments(payments, cursor=None, page_size=PAYMENTS_PAGE_SIZE):
+    """
+    Return ``(page, next_cursor)`` for ``payments``, newest first.
+
+    The cursor is ``"<date_paid>:<id>"`` of the last row already shown, so a
+    deep page costs the same as the first one. Students, their classes and
+    the recording teacher come in the same query.
+    """
+    payments = payments.select_related(
+        "student__class_group", "recorded_by__user", "term"
+    ).order_by("-date_paid", "-id")
+
+    if cursor:
+        date_part, _, id_part = cursor.partition(":")
+        try:
+            date_paid = parse_date(date_part)
+        except ValueError:
+            date_paid = None
+        if date_paid is not None and id_part.isdigit():
+            payments = payments.filter(
+                Q(date_paid__lt=date_paid) | Q(date_paid=date_paid, id__lt=int(id_part))
+            )
+
+    page = list(payments[:page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        last = page[-1]
+        next_cursor = f"{last.date_paid.isoformat()}:{last.id}"
+    return page, next_cursor
+
+
+# ---------- Term balances ----------
+
+def open_term_balances(term, students=None, batch_size=500):
+    """
+    Create the missing StudentTermBalance rows of ``students`` for ``term``.
+
+    Only students the term applies to get one: everyone for the current
+    term, otherwise those whose class has a fee scheduled for it. Costs one
+    read when nothing is missing, else a fee lookup and batched INSERTs.
+    """
+    students = Student.objects.all() if students is None else students
+    if not term.is_current:
+        students = students.filter(class_group__term_fees__term=term)
+    missing = list(students.filter(
+        ~Exists(StudentTermBalance.objects.filter(student=OuterRef("pk"), term=term))
+    ).values_list("id", "class_group_id", "term_fee"))
+    if not missing:
+        return
+
+    schedule = dict(ClassTermFee.objects.filter(term=term).values_list("class_group_id", "amount"))
+    StudentTermBalance.objects.bulk_create(
+        [
+            StudentTermBalance(student_id=student_id, term=term, fee=schedule.get(class_group_id, term_fee))
+            for student_id, class_group_id, term_fee in missing
+        ],
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+
+
+def open_student_balances(students):
+    """Open ``students``' balances for the current term and their classes' scheduled terms."""
+    terms = Term.objects.filter(
+        Q(is_current=True) | Q(class_fees__class_group__in=students.values("class_group"))
+    ).distinct()
+    for term in terms:
+        open_term_balances(term, students)
+
+
+def apply_class_fee(class_fee):
+    """Open and re-price the term balances of a class after its fee is set."""
+    students = Student.objects.filter(class_group_id=class_fee.class_group_id)
+    open_term_balances(class_fee.term, students)
+    StudentTermBalance.objects.filter(term_id=class_fee.term_id, student__in=students).update(fee=class_fee.amount)
+
+
+def reprice_student_balances(student):
+    """
+    Re-price ``student``'s current-term balance after their class or own
+    ``term_fee`` changes. The class's fee schedule still wins; earlier
+    terms keep the fee they were charged.
+    """
+    scheduled = ClassTermFee.objects.filter(term=OuterRef("term_id"), class_group_id=student.class_group_id)
+    StudentTermBalance.objects.filter(student=student, term__is_current=True).update(
+        fee=Coalesce(
+            Subquery(scheduled.values("amount")[:1]),
+            Value(student.term_fee, output_field=DecimalField(max_digits=8, decimal_places=2)),
+        )
+    )
+
+
+def remove_class_fee(class_fee):
+    """Fall back to each student's own ``term_fee`` once a class fee is deleted."""
+    StudentTermBalance.objects.filter(
+        term_id=class_fee.term_id, student__class_group_id=class_fee.class_group_id
+    ).update(fee=Subquery(Student.objects.filter(pk=OuterRef("student_id")).values("term_fee")))
+
+
+def term_debtors(term):
+    """Balances still owing for ``term``, largest first (served by the (term, balance) index)."""
+    return (
+        StudentTermBalance.objects.filter(term=term, balance__gt=0)
+        .select_related("student__class_group")
+        .order_by("-balance")
+    )
+
+
+# ---------- Running totals ----------
+
+def adjust_amount_paid(student_id, delta):
+    """Atomically add ``delta`` (may be negative) to a student's running total."""
+    Student.objects.filter(pk=student_id).update(amount_paid=F("amount_paid") + Value(delta))
+
+
+def adjust_term_paid(student_id, term_id, delta, open_missing=True):
+    """
+    Atomically add ``delta`` to a student's total for one term, opening the
+    row if needed. Pass ``open_missing=False`` when taking a payment back:
+    a cascading delete of the student removes their balances before the
+    payments, and a row opened then would point at a deleted student.
+    """
+    balances = StudentTermBalance.objects.filter(student_id=student_id, term_id=term_id)
+    if not balances.update(paid=F("paid") + Value(delta)) and open_missing:
+        fee = ClassTermFee.objects.filter(
+            term_id=term_id, class_group__students=student_id
+        ).values_list("amount", flat=True).first()
+        if fee is None:
+            fee = Student.objects.filter(pk=student_id).values_list("term_fee", flat=True).first()
+        StudentTermBalance.objects.bulk_create(
+            [StudentTermBalance(student_id=student_id, term_id=term_id, fee=fee)], ignore_conflicts=True
+        )
+        balances.update(paid=F("paid") + Value(delta))
+
+
+def _ledger_total(**outer):
+    """Sum of the payments matching ``outer`` (field -> OuterRef name), or 0."""
+    outer = outer or {"student": "pk"}
+    zero = Value(Decimal("0"), output_field=DecimalField(max_digits=8, decimal_places=2))
+    payments = (
+        StudentPayment.objects.filter(**{field: OuterRef(ref) for field, ref in outer.items()})
+        .order_by()
+        .values(*outer)
+        .annotate(total=Sum("amount"))
+        .values("total")
+    )
+    return Coalesce(Subquery(payments), zero)
+
+
+def _term_ledger_total():
+    return _ledger_total(student="student_id", term="term_id")
+
+
+def reconcile_balances(fix=False):
+    """
+    Compare every student's ``amount_paid`` with the sum of their payments.
+
+    Returns ``[(student_id, stored, ledger), ...]`` for the students that
+    disagree. With ``fix=True`` all of them are corrected by one UPDATE.
+    """
+    drifted = list(
+        Student.objects.annotate(ledger=_ledger_total())
+        .exclude(amount_paid=F("ledger"))
+        .values_list("id", "amount_paid", "ledger")
+        .order_by("id")
+    )
+    if fix and drifted:
+        with transaction.atomic():
+            Student.objects.filter(id__in=[row[0] for row in drifted]).update(amount_paid=_ledger_total())
+    return drifted
+
+
+def reconcile_term_balances(fix=False):
+    """
+    Compare every term balance's ``paid`` with the sum of that term's payments.
+
+    Returns ``[(student_id, term_id, stored, ledger), ...]`` for the rows that
+    disagree; ``stored`` is None where payments exist but no row does. With
+    ``fix=True`` missing rows are opened and every drifted one is corrected
+    by one UPDATE.
+    """
+    has_balance = StudentTermBalance.objects.filter(student=OuterRef("student_id"), term=OuterRef("term_id"))
+    missing = [
+        (row["student_id"], row["term_id"], None, row["total"])
+        for row in StudentPayment.objects.filter(~Exists(has_balance))
+        .order_by()
+        .values("student_id", "term_id")
+        .annotate(total=Sum("amount"))
+    ]
+    drifted = StudentTermBalance.objects.annotate(ledger=_term_ledger_total()).exclude(paid=F("ledger"))
+    report = sorted(
+        missing + list(drifted.values_list("student_id", "term_id", "paid", "ledger")),
+        key=lambda row: row[:2],
+    )
+    if fix and report:
+        with transaction.atomic():
+            for student_id, term_id, _, ledger in missing:
+                adjust_term_paid(student_id, term_id, ledger)
+            StudentTermBalance.objects.filter(id__in=drifted.values("id")).update(paid=_term_ledger_total())
+    return report
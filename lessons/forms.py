@@ -1,10 +1,10 @@
 # lessons/forms.py
 from django import forms
+from django.core.exceptions import NON_FIELD_ERRORS
 from .models import LessonRecord, Timetable, Teacher, Week
-
-# lessons/forms.py
-from django import forms
-from .models import LessonRecord, Timetable, Teacher, Week
+from .availability import SlotTaken, available_timetables
+from .reference import get_weeks, model_choices
+from .students import read_student_csv
 
 class LessonRecordForm(forms.ModelForm):
     # extra non-model field shown to admin: pick the 'teacher'
@@ -18,9 +18,12 @@ class LessonRecordForm(forms.ModelForm):
         model = LessonRecord
         # show teacher first, then week, then timetable (you said week first — adjust order here)
         fields = ['week', 'teacher', 'timetable', 'status', 'payment_status', 'amount']
+        # The (timetable, week) constraint's validation error
+        error_messages = {NON_FIELD_ERRORS: {'unique_together': SlotTaken.message}}
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.fields['week'].choices = model_choices(get_weeks())
 
         # Keep timetable empty until teacher (and optionally week) are selected
         self.fields['timetable'].queryset = Timetable.objects.none()
@@ -30,15 +33,11 @@ class LessonRecordForm(forms.ModelForm):
             try:
                 teacher_id = int(self.data.get('teacher'))
                 week_id = self.data.get('week')  # may be '' or None
-                qs = Timetable.objects.filter(teacher_id=teacher_id)
 
-                # Optionally exclude timetables already used in that week
-                if week_id:
-                    used_ids = LessonRecord.objects.filter(
-                        week_id=week_id,
-                        timetable__in=qs
-                    ).values_list('timetable_id', flat=True)
-                    qs = qs.exclude(id__in=used_ids)
+                # Only timetables not already used in that week
+                qs = available_timetables(
+                    teacher_id, week_id, ignore_lesson_id=self.instance.pk
+                )
 
                 self.fields['timetable'].queryset = qs
             except (ValueError, TypeError):
@@ -58,6 +57,27 @@ class LessonRecordForm(forms.ModelForm):
                 self.fields['timetable'].queryset = Timetable.objects.filter(teacher=teacher_obj)
 
 
+class AvailableTimetableField(forms.ModelChoiceField):
+    """
+    Timetable choice limited to free slots. A rejected id that is one of
+    ``teacher_timetables`` gets the "already scheduled" message; any other
+    (unknown, or another teacher's) keeps the generic invalid choice.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.teacher_timetables = Timetable.objects.none()
+
+    def to_python(self, value):
+        try:
+            return super().to_python(value)
+        except forms.ValidationError as exc:
+            # Only the rejected path pays for this lookup
+            if exc.code == 'invalid_choice' and str(value).isdigit() and self.teacher_timetables.filter(pk=value).exists():
+                raise forms.ValidationError(SlotTaken.message, code='slot_taken') from exc
+            raise
+
+
 class TeacherLessonForm(forms.ModelForm):
     """
     Teacher-side form: teachers only choose week + timetable.
@@ -67,10 +87,34 @@ class TeacherLessonForm(forms.ModelForm):
     class Meta:
         model = LessonRecord
         fields = ['week', 'timetable']
+        field_classes = {'timetable': AvailableTimetableField}
+        error_messages = {NON_FIELD_ERRORS: {'unique_together': SlotTaken.message}}
 
     def __init__(self, *args, **kwargs):
         teacher = kwargs.pop('teacher', None)
         super().__init__(*args, **kwargs)
+        self.fields['week'].choices = model_choices(get_weeks())
         self.fields['timetable'].queryset = Timetable.objects.none()
         if teacher:
-            self.fields['timetable'].queryset = Timetable.objects.filter(teacher=teacher)
+            # On submit the week is known, so a slot already used that week
+            # fails validation here instead of needing a separate exists() check.
+            week_id = self.data.get('week')
+            self.fields['timetable'].queryset = available_timetables(
+                teacher.pk, week_id if str(week_id).isdigit() else None
+            )
+            self.fields['timetable'].teacher_timetables = Timetable.objects.filter(teacher=teacher)
+
+
+class StudentImportForm(forms.Form):
+    """Upload of a student CSV; the parsed rows end up in ``cleaned_data['rows']``."""
+    csv_file = forms.FileField(label="CSV file")
+
+    def clean_csv_file(self):
+        upload = self.cleaned_data['csv_file']
+        try:
+            self.cleaned_data['rows'] = read_student_csv(upload)
+        except ValueError as exc:
+            raise forms.ValidationError(str(exc))
+        if not self.cleaned_data['rows']:
+            raise forms.ValidationError("The file has no student rows.")
+        return upload
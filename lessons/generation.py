@@ -0,0 +1,53 @@
+# lessons/generation.py
+"""
+Bulk creation of a week's Pending lessons from the timetable.
+"""
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from .etags import bump_teacher_versions
+from .models import LessonRecord, Timetable
+from .summaries import refresh_summaries
+
+
+GENERATE_BATCH_SIZE = 2000
+
+
+def generate_week_lessons(week, batch_size=GENERATE_BATCH_SIZE):
+    """
+    Create one Pending, Unpaid LessonRecord per Timetable row for ``week``.
+
+    Slots that already have a lesson that week are skipped, so running it
+    twice is harmless. Returns ``(created, skipped)``.
+    """
+    with transaction.atomic():
+        total = Timetable.objects.count()
+        missing = list(
+            Timetable.objects.filter(
+                ~Exists(LessonRecord.objects.filter(timetable=OuterRef("pk"), week=week))
+            ).values_list("id", "teacher_id")
+        )
+
+        before = LessonRecord.objects.filter(week=week).count()
+        LessonRecord.objects.bulk_create(
+            [
+                LessonRecord(
+                    timetable_id=timetable_id,
+                    week=week,
+                    created_by_id=teacher_id,
+                    status="Pending",
+                    payment_status="Unpaid",
+                )
+                for timetable_id, teacher_id in missing
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        created = LessonRecord.objects.filter(week=week).count() - before
+
+        # bulk_create sends no signals, so keep the rollup and ETags current here.
+        teacher_ids = {teacher_id for _, teacher_id in missing}
+        refresh_summaries((teacher_id, week.pk) for teacher_id in teacher_ids)
+        bump_teacher_versions(teacher_ids)
+
+    return created, total - created
@@ -0,0 +1,60 @@
+import json
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from lessons.benchmark import run_cases, seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database with a large synthetic school and compare the "
+        "query plans and timings of the hot lesson and payment queries before and "
+        "after the given lessons migration."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--baseline",
+            default="0019_admin_search_indexes",
+            help="lessons migration to measure 'before' at (default: %(default)s).",
+        )
+        parser.add_argument("--teachers", type=int, default=200)
+        parser.add_argument("--weeks", type=int, default=40)
+        parser.add_argument("--students", type=int, default=5000)
+        parser.add_argument("--repeat", type=int, default=5, help="Timed runs per query.")
+        parser.add_argument("--output", help="Also write the full report, with SQL and plans, as JSON.")
+
+    def handle(self, *args, **options):
+        # The benchmark never touches the configured database or cache
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                                                   "LOCATION": "benchmark"}}):
+            old_name = connection.settings_dict["NAME"]
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                report = self.benchmark(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for name, before in report["before"].items():
+            after = report["after"][name]
+            self.stdout.write(f"{name}: {before['median_ms']:.2f} ms -> {after['median_ms']:.2f} ms")
+            for old, new in zip(before["queries"], after["queries"]):
+                if old["plan"] != new["plan"]:
+                    self.stdout.write("    before: " + "; ".join(old["plan"]))
+                    self.stdout.write("    after:  " + "; ".join(new["plan"]))
+
+        if options["output"]:
+            with open(options["output"], "w") as out:
+                json.dump(report, out, indent=2)
+
+    def benchmark(self, options):
+        call_command("migrate", "lessons", options["baseline"], verbosity=0)
+        seed(teachers=options["teachers"], weeks=options["weeks"], students=options["students"])
+        before = run_cases(repeat=options["repeat"])
+
+        call_command("migrate", "lessons", verbosity=0)
+        after = run_cases(repeat=options["repeat"])
+        return {"baseline": options["baseline"], "before": before, "after": after}
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from lessons.generation import generate_week_lessons
+from lessons.models import Week
+
+
+class Command(BaseCommand):
+    help = "Create every Pending LessonRecord implied by the timetable for a week."
+
+    def add_arguments(self, parser):
+        parser.add_argument("week", type=int, help="Week id (or week number with --number).")
+        parser.add_argument(
+            "--number",
+            action="store_true",
+            help="Treat the argument as the week number instead of its id.",
+        )
+
+    def handle(self, *args, **options):
+        lookup = {"number": options["week"]} if options["number"] else {"pk": options["week"]}
+        weeks = list(Week.objects.filter(**lookup)[:2])
+        if len(weeks) != 1:
+            raise CommandError(f"Expected exactly one week matching {lookup}, found {len(weeks) or 'none'}.")
+
+        created, skipped = generate_week_lessons(weeks[0])
+        self.stdout.write(self.style.SUCCESS(
+            f"{weeks[0]}: created {created} lessons, skipped {skipped} already scheduled."
+        ))
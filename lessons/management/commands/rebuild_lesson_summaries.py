@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from lessons.summaries import rebuild_summaries, verify_summaries
+
+
+class Command(BaseCommand):
+    help = "Rebuild the TeacherWeekSummary rollup from LessonRecord rows and verify it."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only verify the stored rollup; do not rebuild it.",
+        )
+
+    def handle(self, *args, **options):
+        if not options["check"]:
+            count = rebuild_summaries()
+            self.stdout.write(f"Rebuilt {count} summary rows.")
+
+        stale = verify_summaries()
+        if stale:
+            for teacher_id, week_id, class_group_id, subject_id in stale:
+                self.stderr.write(
+                    f"Mismatch: teacher={teacher_id} week={week_id} "
+                    f"class={class_group_id} subject={subject_id}"
+                )
+            raise CommandError(f"{len(stale)} summary rows are out of date.")
+        self.stdout.write(self.style.SUCCESS("Lesson summaries are up to date."))
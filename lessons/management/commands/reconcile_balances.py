@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from lessons.fees import reconcile_balances, reconcile_term_balances
+
+
+class Command(BaseCommand):
+    help = (
+        "Check every Student.amount_paid and StudentTermBalance.paid against the "
+        "StudentPayment rows, optionally repairing them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Reset drifted totals to the sum of the matching payments.",
+        )
+
+    def handle(self, *args, **options):
+        drifted = reconcile_balances(fix=options["fix"])
+        for student_id, stored, ledger in drifted:
+            self.stdout.write(f"Student {student_id}: amount_paid {stored} != payments {ledger}")
+
+        term_drifted = reconcile_term_balances(fix=options["fix"])
+        for student_id, term_id, stored, ledger in term_drifted:
+            stored = "missing" if stored is None else stored
+            self.stdout.write(f"Student {student_id}, term {term_id}: paid {stored} != payments {ledger}")
+
+        count = len(drifted) + len(term_drifted)
+        if not count:
+            self.stdout.write(self.style.SUCCESS("All student balances match their payments."))
+        elif options["fix"]:
+            self.stdout.write(self.style.SUCCESS(f"Repaired {count} student balances."))
+        else:
+            raise CommandError(f"{count} student balances drifted; rerun with --fix to repair.")
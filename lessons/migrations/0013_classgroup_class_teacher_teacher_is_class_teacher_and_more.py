@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0012_alter_lessonrecord_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classgroup',
+            name='class_teacher',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='main_class', to='lessons.teacher'),
+        ),
+        migrations.AddField(
+            model_name='teacher',
+            name='is_class_teacher',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='Student',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_name', models.CharField(max_length=50)),
+                ('last_name', models.CharField(max_length=50)),
+                ('admission_number', models.CharField(max_length=20, unique=True)),
+                ('term_fee', models.DecimalField(decimal_places=2, default=1500, max_digits=8)),
+                ('amount_paid', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('class_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='students', to='lessons.classgroup')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StudentPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('date_paid', models.DateField(auto_now_add=True)),
+                ('term', models.CharField(max_length=20)),
+                ('recorded_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='lessons.teacher')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='lessons.student')),
+            ],
+            options={
+                'ordering': ['-date_paid'],
+            },
+        ),
+    ]
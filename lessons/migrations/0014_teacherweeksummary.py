@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0013_classgroup_class_teacher_teacher_is_class_teacher_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeacherWeekSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_lessons', models.PositiveIntegerField(default=0)),
+                ('attended', models.PositiveIntegerField(default=0)),
+                ('not_attended', models.PositiveIntegerField(default=0)),
+                ('pending', models.PositiveIntegerField(default=0)),
+                ('paid', models.PositiveIntegerField(default=0)),
+                ('unpaid', models.PositiveIntegerField(default=0)),
+                ('total_paid_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_unpaid_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('class_group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='lessons.classgroup')),
+                ('subject', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='lessons.subject')),
+                ('teacher', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='week_summaries', to='lessons.teacher')),
+                ('week', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='teacher_summaries', to='lessons.week')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['teacher', 'week'], name='lessons_tea_teacher_ace508_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:47
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_lessons(apps, schema_editor):
+    """
+    Keep one LessonRecord per (timetable, week) before the constraint exists.
+
+    The survivor is the most advanced row: Paid beats Unpaid, then Attended
+    beats any other status, then the oldest row wins. 0021 re-sums the
+    rollup afterwards so it forgets the removed rows.
+    """
+    LessonRecord = apps.get_model('lessons', 'LessonRecord')
+
+    duplicates = (
+        LessonRecord.objects.values('timetable_id', 'week_id')
+        .annotate(rows=Count('id'))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    for group in list(duplicates):
+        rows = list(LessonRecord.objects.filter(
+            timetable_id=group['timetable_id'], week_id=group['week_id']
+        ))
+        keep = max(rows, key=lambda r: (r.payment_status == 'Paid', r.status == 'Attended', -r.id))
+        LessonRecord.objects.filter(id__in=[r.id for r in rows if r.id != keep.id]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0014_teacherweeksummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lessons, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='lessonrecord',
+            constraint=models.UniqueConstraint(fields=('timetable', 'week'), name='unique_lesson_per_timetable_week'),
+        ),
+    ]
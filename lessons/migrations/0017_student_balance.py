@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:52
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0016_payrollbatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='balance',
+            field=models.GeneratedField(db_index=True, db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('term_fee'), '-', models.F('amount_paid')), output_field=models.DecimalField(decimal_places=2, max_digits=9)),
+        ),
+    ]
@@ -0,0 +1,118 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:59
+
+import django.db.models.deletion
+import django.db.models.expressions
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def terms_from_payment_labels(apps, schema_editor):
+    """
+    Turn the free-text ``StudentPayment.term`` labels into Term rows and
+    open a StudentTermBalance for every (student, term) already paid into.
+
+    The term with the latest payment becomes current, so recording payments
+    keeps working; with no payments at all no term is created and one must
+    be set up in the admin. Existing balances are charged the student's own
+    ``term_fee``.
+    """
+    Term = apps.get_model('lessons', 'Term')
+    Student = apps.get_model('lessons', 'Student')
+    StudentPayment = apps.get_model('lessons', 'StudentPayment')
+    StudentTermBalance = apps.get_model('lessons', 'StudentTermBalance')
+
+    terms = {}
+    for label in StudentPayment.objects.order_by().values_list('term', flat=True).distinct():
+        name = (label or '').strip()[:20] or 'Term 1'
+        if name not in terms:
+            terms[name] = Term.objects.create(name=name)
+        StudentPayment.objects.filter(term=label).update(term_ref=terms[name])
+
+    latest = StudentPayment.objects.order_by('-date_paid', '-id').values_list('term_ref', flat=True).first()
+    if latest:
+        Term.objects.filter(pk=latest).update(is_current=True)
+
+    fees = dict(Student.objects.values_list('id', 'term_fee'))
+    totals = (
+        StudentPayment.objects.order_by()
+        .values('student_id', 'term_ref_id')
+        .annotate(paid=Sum('amount'))
+    )
+    StudentTermBalance.objects.bulk_create([
+        StudentTermBalance(
+            student_id=row['student_id'], term_id=row['term_ref_id'],
+            fee=fees[row['student_id']], paid=row['paid'],
+        )
+        for row in totals
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0017_student_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Term',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20, unique=True)),
+                ('start_date', models.DateField(blank=True, null=True)),
+                ('end_date', models.DateField(blank=True, null=True)),
+                ('is_current', models.BooleanField(default=False)),
+            ],
+            options={
+                'ordering': ['start_date', 'name'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('is_current', True)), fields=('is_current',), name='one_current_term')],
+            },
+        ),
+        migrations.AddField(
+            model_name='studentpayment',
+            name='term_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='lessons.term'),
+        ),
+        migrations.CreateModel(
+            name='StudentTermBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fee', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('balance', models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('fee'), '-', models.F('paid')), output_field=models.DecimalField(decimal_places=2, max_digits=9))),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='term_balances', to='lessons.student')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='student_balances', to='lessons.term')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'balance'], name='lessons_stu_term_id_858b6a_idx')],
+                'constraints': [models.UniqueConstraint(fields=('student', 'term'), name='unique_balance_per_student_term')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ClassTermFee',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('class_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='term_fees', to='lessons.classgroup')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='class_fees', to='lessons.term')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('class_group', 'term'), name='unique_fee_per_class_term')],
+            },
+        ),
+        migrations.RunPython(terms_from_payment_labels, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='studentpayment',
+            name='term',
+        ),
+        migrations.RenameField(
+            model_name='studentpayment',
+            old_name='term_ref',
+            new_name='term',
+        ),
+        migrations.AlterField(
+            model_name='studentpayment',
+            name='term',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='payments', to='lessons.term'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0018_term_fee_schedule'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='classgroup',
+            name='name',
+            field=models.CharField(db_index=True, max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='subject',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='week',
+            name='number',
+            field=models.PositiveIntegerField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0019_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lessonrecord',
+            index=models.Index(fields=['week', 'timetable'], name='lessons_les_week_id_1df4cc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lessonrecord',
+            index=models.Index(fields=['timetable', 'status', 'payment_status'], name='lessons_les_timetab_b8cbbf_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lessonrecord',
+            index=models.Index(fields=['created_by', 'status', 'payment_status'], name='lessons_les_created_33a960_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentpayment',
+            index=models.Index(fields=['student', '-date_paid'], name='lessons_stu_student_c8e801_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentpayment',
+            index=models.Index(fields=['-date_paid', '-id'], name='lessons_stu_date_pa_8013cf_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timetable',
+            index=models.Index(fields=['teacher', 'day'], name='lessons_tim_teacher_77fcf3_idx'),
+        ),
+    ]
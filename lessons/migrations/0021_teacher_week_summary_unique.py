@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:23
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+from django.db.models import Count, F, Q, Sum
+
+
+def rebuild_teacher_week_summaries(apps, schema_editor):
+    """
+    Recompute the whole rollup from LessonRecord.
+
+    Installs that came through 0014 never had it filled, and 0015's merge
+    removed duplicate lessons without re-summing. Starting from scratch also
+    clears any duplicate buckets before the constraint below is added.
+    Mirrors ``lessons.summaries.summary_rows`` on the historical models.
+    """
+    LessonRecord = apps.get_model('lessons', 'LessonRecord')
+    TeacherWeekSummary = apps.get_model('lessons', 'TeacherWeekSummary')
+
+    paid = Q(payment_status__iexact='Paid')
+    unpaid = Q(payment_status__iexact='Unpaid')
+    aggregates = {
+        'total_lessons': Count('id'),
+        'attended': Count('id', filter=Q(status__iexact='Attended')),
+        'not_attended': Count('id', filter=Q(status__iexact='Not Attended')),
+        'pending': Count('id', filter=Q(status__iexact='Pending')),
+        'paid': Count('id', filter=paid),
+        'unpaid': Count('id', filter=unpaid),
+        'total_paid_amount': Sum('amount', filter=paid),
+        'total_unpaid_amount': Sum('amount', filter=unpaid),
+    }
+    keys = {
+        'teacher_id': F('timetable__teacher_id'),
+        'week_key': F('week_id'),
+        'subject_id': F('timetable__subject_fk_id'),
+    }
+    lessons = LessonRecord.objects.all()
+    all_classes = lessons.values(**keys).annotate(**aggregates).order_by()
+    per_class = lessons.filter(timetable__class_groups__isnull=False).values(
+        class_group_id=F('timetable__class_groups'), **keys
+    ).annotate(**aggregates).order_by()
+
+    rows = []
+    for group in list(all_classes) + list(per_class):
+        group['week_id'] = group.pop('week_key')
+        group['total_paid_amount'] = group['total_paid_amount'] or 0
+        group['total_unpaid_amount'] = group['total_unpaid_amount'] or 0
+        rows.append(TeacherWeekSummary(**group))
+
+    TeacherWeekSummary.objects.all().delete()
+    TeacherWeekSummary.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0020_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_teacher_week_summaries, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='teacherweeksummary',
+            constraint=models.UniqueConstraint(models.F('teacher'), models.F('week'), django.db.models.functions.comparison.Coalesce('class_group', models.Value(0)), django.db.models.functions.comparison.Coalesce('subject', models.Value(0)), name='unique_teacher_week_summary'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:32
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def reconcile_payment_totals(apps, schema_editor):
+    """
+    Reset ``Student.amount_paid`` and ``StudentTermBalance.paid`` to the sum
+    of the matching StudentPayment rows, opening any missing term balance.
+
+    Totals kept before 0017 could drift from the ledger, and nothing since
+    has corrected them. Mirrors ``lessons.fees.reconcile_balances`` and
+    ``reconcile_term_balances`` on the historical models.
+    """
+    Student = apps.get_model('lessons', 'Student')
+    StudentPayment = apps.get_model('lessons', 'StudentPayment')
+    StudentTermBalance = apps.get_model('lessons', 'StudentTermBalance')
+    ClassTermFee = apps.get_model('lessons', 'ClassTermFee')
+
+    zero = Value(Decimal('0'), output_field=models.DecimalField(max_digits=8, decimal_places=2))
+
+    def ledger_total(**outer):
+        payments = (
+            StudentPayment.objects.filter(**{field: OuterRef(ref) for field, ref in outer.items()})
+            .order_by()
+            .values(*outer)
+            .annotate(total=Sum('amount'))
+            .values('total')
+        )
+        return Coalesce(Subquery(payments), zero)
+
+    Student.objects.update(amount_paid=ledger_total(student='pk'))
+
+    has_balance = StudentTermBalance.objects.filter(student=OuterRef('student_id'), term=OuterRef('term_id'))
+    missing = list(
+        StudentPayment.objects.filter(~Exists(has_balance))
+        .order_by()
+        .values_list('student_id', 'term_id')
+        .distinct()
+    )
+    if missing:
+        schedule = {
+            (class_group_id, term_id): amount
+            for class_group_id, term_id, amount in ClassTermFee.objects.values_list('class_group_id', 'term_id', 'amount')
+        }
+        students = {
+            student_id: (class_group_id, term_fee)
+            for student_id, class_group_id, term_fee in Student.objects.filter(
+                id__in={student_id for student_id, _ in missing}
+            ).values_list('id', 'class_group_id', 'term_fee')
+        }
+        StudentTermBalance.objects.bulk_create([
+            StudentTermBalance(
+                student_id=student_id, term_id=term_id,
+                fee=schedule.get((students[student_id][0], term_id), students[student_id][1]),
+            )
+            for student_id, term_id in missing
+        ], batch_size=500)
+
+    StudentTermBalance.objects.update(paid=ledger_total(student='student_id', term='term_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0021_teacher_week_summary_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(reconcile_payment_totals, migrations.RunPython.noop),
+    ]
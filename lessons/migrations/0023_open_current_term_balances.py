@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:35
+
+from django.db import migrations
+from django.db.models import Exists, OuterRef
+
+
+def open_current_term_balances(apps, schema_editor):
+    """
+    Open a current-term StudentTermBalance for every student without one.
+
+    0018 only opened balances for terms a student had already paid into,
+    and the payments sheet no longer opens them while it is being read.
+    Mirrors ``lessons.fees.open_term_balances`` on the historical models.
+    """
+    Term = apps.get_model('lessons', 'Term')
+    Student = apps.get_model('lessons', 'Student')
+    StudentTermBalance = apps.get_model('lessons', 'StudentTermBalance')
+    ClassTermFee = apps.get_model('lessons', 'ClassTermFee')
+
+    term = Term.objects.filter(is_current=True).first()
+    if term is None:
+        return
+    missing = Student.objects.filter(
+        ~Exists(StudentTermBalance.objects.filter(student=OuterRef('pk'), term=term))
+    ).values_list('id', 'class_group_id', 'term_fee')
+    schedule = dict(ClassTermFee.objects.filter(term=term).values_list('class_group_id', 'amount'))
+    StudentTermBalance.objects.bulk_create([
+        StudentTermBalance(student_id=student_id, term=term, fee=schedule.get(class_group_id, term_fee))
+        for student_id, class_group_id, term_fee in missing
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0022_reconcile_payment_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(open_current_term_balances, migrations.RunPython.noop),
+        # Debt is per term (StudentTermBalance.balance); term_fee - amount_paid
+        # compared one term's fee with payments from every term
+        migrations.RemoveField(
+            model_name='student',
+            name='balance',
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0023_open_current_term_balances'),
+    ]
+
+    operations = [
+        # The admin searches these with ^name (istartswith, i.e. UPPER/LIKE),
+        # which a plain b-tree index on the column cannot serve
+        migrations.AlterField(
+            model_name='classgroup',
+            name='name',
+            field=models.CharField(max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='subject',
+            name='name',
+            field=models.CharField(max_length=100),
+        ),
+    ]
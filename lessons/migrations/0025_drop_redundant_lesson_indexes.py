@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:56
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0024_drop_unusable_name_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='lessonrecord',
+            name='lessons_les_week_id_1df4cc_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='teacherweeksummary',
+            name='lessons_tea_teacher_ace508_idx',
+        ),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.db import models
@@ -65,6 +67,11 @@ class Timetable(models.Model):
     start_time = models.TimeField()
     end_time = models.TimeField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["teacher", "day"]),
+        ]
+
     def __str__(self):
         if self.subject_fk:
             return f"{self.subject_fk.name} - {self.get_day_display()} {self.start_time.strftime('%H:%M')}"
@@ -74,7 +81,7 @@ class Timetable(models.Model):
 # Week model
 # ----------------------------
 class Week(models.Model):
-    number = models.PositiveIntegerField()  # Week 1, Week 2...
+    number = models.PositiveIntegerField(db_index=True)  # Week 1, Week 2...
     start_date = models.DateField()
     end_date = models.DateField()
     created_at = models.DateTimeField(auto_now_add=True)
@@ -149,11 +156,64 @@ class LessonRecord(models.Model):
 
     amount = models.DecimalField(max_digits=10, decimal_places=2, default=400)
 
+    class Meta:
+        constraints = [
+            # Also the index for lookups by timetable, or timetable and week
+            models.UniqueConstraint(fields=["timetable", "week"], name="unique_lesson_per_timetable_week"),
+        ]
+        indexes = [
+            # A teacher's lessons by status: the teacher is reached through
+            # their timetables, so the index leads with the timetable
+            models.Index(fields=["timetable", "status", "payment_status"]),
+            # Payroll grouped by the recording teacher
+            models.Index(fields=["created_by", "status", "payment_status"]),
+        ]
+
     def save(self, *args, **kwargs):
         if self.amount is None:  # only replace if it's not set
             self.amount = 400
-        super().save(*args, **kwargs)
+        # The signals in lessons.signals refresh the TeacherWeekSummary
+        # rollup; keep that in the same transaction as the lesson row
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
         
+# ----------------------------
+# Term model
+# ----------------------------
+class Term(models.Model):
+    name = models.CharField(max_length=20, unique=True)  # "Term 1", "2025 Term 2"...
+    start_date = models.DateField(null=True, blank=True)
+    end_date = models.DateField(null=True, blank=True)
+    # The term new payments are recorded against; at most one at a time
+    is_current = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['start_date', 'name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=["is_current"], condition=models.Q(is_current=True), name="one_current_term"
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    def save(self, *args, **kwargs):
+        # Making this term current retires the previous one in the same transaction
+        with transaction.atomic():
+            if self.is_current:
+                Term.objects.filter(is_current=True).exclude(pk=self.pk).update(is_current=False)
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def current(cls):
+        return cls.objects.filter(is_current=True).first()
+
+
 class Student(models.Model):
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
@@ -161,13 +221,12 @@ class Student(models.Model):
     class_group = models.ForeignKey(ClassGroup, on_delete=models.CASCADE, related_name='students')
     
     # Payment info
-    term_fee = models.DecimalField(max_digits=8, decimal_places=2, default=1500)  # Default per term
+    # Fee for a term whose class has no ClassTermFee; the schedule wins otherwise
+    term_fee = models.DecimalField(max_digits=8, decimal_places=2, default=1500)
+    # Running total of this student's StudentPayment rows across every term
+    # (the source of truth); only ever changed by F() increments, see
+    # lessons.fees and lessons.signals. Debt is per term: StudentTermBalance.
     amount_paid = models.DecimalField(max_digits=8, decimal_places=2, default=0)
-    
-    # Optional: to track debt
-    @property
-    def balance(self):
-        return self.term_fee - self.amount_paid
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.admission_number})"
@@ -176,11 +235,139 @@ class StudentPayment(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='payments')
     amount = models.DecimalField(max_digits=8, decimal_places=2)
     date_paid = models.DateField(auto_now_add=True)  # Defaults to today
-    term = models.CharField(max_length=20)  # Optional: "Term 1", "Term 2", etc.
+    term = models.ForeignKey(Term, on_delete=models.PROTECT, related_name='payments')
     recorded_by = models.ForeignKey(Teacher, on_delete=models.SET_NULL, null=True, blank=True)  # Who collected the payment
 
     def __str__(self):
         return f"{self.student} - Paid {self.amount} on {self.date_paid}"
+
+    def save(self, *args, **kwargs):
+        # The signals in lessons.signals move the running totals; keep those
+        # increments in the same transaction as the payment row
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
     
     class Meta:
         ordering = ['-date_paid']  # Latest payments first
+        indexes = [
+            models.Index(fields=["student", "-date_paid"]),  # a student's history
+            models.Index(fields=["-date_paid", "-id"]),  # the admin keyset pages
+        ]
+
+
+# ----------------------------
+# Fee schedule and per-term balances
+# ----------------------------
+class ClassTermFee(models.Model):
+    """What every student in ``class_group`` is charged for ``term``."""
+    class_group = models.ForeignKey(ClassGroup, on_delete=models.CASCADE, related_name='term_fees')
+    term = models.ForeignKey(Term, on_delete=models.CASCADE, related_name='class_fees')
+    amount = models.DecimalField(max_digits=8, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["class_group", "term"], name="unique_fee_per_class_term"),
+        ]
+
+    def __str__(self):
+        return f"{self.class_group} - {self.term}: {self.amount}"
+
+
+class StudentTermBalance(models.Model):
+    """
+    A student's fee and payments for one term.
+
+    ``paid`` is a running total of the student's payments for the term,
+    moved by F() increments alongside every StudentPayment write; see
+    ``lessons.fees``. Never edit rows by hand.
+    """
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='term_balances')
+    term = models.ForeignKey(Term, on_delete=models.CASCADE, related_name='student_balances')
+    fee = models.DecimalField(max_digits=8, decimal_places=2)
+    paid = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    balance = models.GeneratedField(
+        expression=F("fee") - F("paid"),
+        output_field=models.DecimalField(max_digits=9, decimal_places=2),
+        db_persist=True,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["student", "term"], name="unique_balance_per_student_term"),
+        ]
+        indexes = [
+            # "who owes for Term 2": WHERE term_id = ? AND balance > 0
+            models.Index(fields=["term", "balance"]),
+        ]
+
+    def __str__(self):
+        return f"{self.student} - {self.term}: {self.balance}"
+
+
+# ----------------------------
+# TeacherWeekSummary model
+# ----------------------------
+class TeacherWeekSummary(models.Model):
+    """
+    Pre-summed lesson counters per (teacher, week, class, subject).
+
+    Rows with ``class_group`` set to NULL hold the totals across all classes,
+    so a lesson taught to several classes is only counted once there.
+    Maintained by ``lessons.summaries``; never edit rows by hand.
+    """
+    teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE, related_name="week_summaries")
+    week = models.ForeignKey(Week, on_delete=models.CASCADE, related_name="teacher_summaries")
+    class_group = models.ForeignKey(ClassGroup, on_delete=models.CASCADE, null=True, blank=True)
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, null=True, blank=True)
+
+    total_lessons = models.PositiveIntegerField(default=0)
+    attended = models.PositiveIntegerField(default=0)
+    not_attended = models.PositiveIntegerField(default=0)
+    pending = models.PositiveIntegerField(default=0)
+    paid = models.PositiveIntegerField(default=0)
+    unpaid = models.PositiveIntegerField(default=0)
+    total_paid_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_unpaid_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            # One row per bucket; Coalesce so the NULL "all classes" and
+            # "no subject" rows are covered too. Its index also serves the
+            # dashboard's (teacher, week) lookups
+            models.UniqueConstraint(
+                F("teacher"), F("week"), Coalesce("class_group", Value(0)), Coalesce("subject", Value(0)),
+                name="unique_teacher_week_summary",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.teacher} - Week {self.week_id} ({self.total_lessons} lessons)"
+
+
+# ----------------------------
+# PayrollBatch model
+# ----------------------------
+class PayrollBatch(models.Model):
+    """Audit record of one set-based status or payment transition."""
+    FIELDS = [
+        ("status", "Status"),
+        ("payment_status", "Payment status"),
+    ]
+
+    field = models.CharField(max_length=20, choices=FIELDS)
+    new_value = models.CharField(max_length=20)
+    filters = models.JSONField(default=dict, blank=True)
+    row_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_field_display()} → {self.new_value}: {self.row_count} lessons ({self.total_amount})"
@@ -0,0 +1,145 @@
+# lessons/payroll.py
+"""
+Set-based lesson status and payment transitions, and the payroll report.
+
+A transition changes every matching LessonRecord with one UPDATE inside a
+transaction and leaves a PayrollBatch row recording how many lessons moved
+and for how much. The report groups lessons per teacher in the database so
+it can be streamed row by row.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from .etags import bump_teacher_versions
+from .models import LessonRecord, PayrollBatch
+from .summaries import refresh_summaries, summary_pairs
+
+
+TRANSITION_VALUES = {
+    "status": {value for value, _ in LessonRecord._meta.get_field("status").choices},
+    "payment_status": {value for value, _ in LessonRecord._meta.get_field("payment_status").choices},
+}
+
+LESSON_FILTERS = {
+    "week": "week_id",
+    "teacher": "timetable__teacher_id",
+    "created_by": "created_by_id",
+    "class_group": "timetable__class_groups__id",
+    "subject": "timetable__subject_fk_id",
+    "status": "status",
+    "payment_status": "payment_status",
+}
+# Filters whose values are primary keys
+ID_FILTERS = {"week", "teacher", "created_by", "class_group", "subject"}
+
+
+def filter_lessons(params, lessons=None):
+    """
+    Narrow ``lessons`` by the known keys in ``params`` (e.g. request.GET).
+
+    Returns ``(queryset, applied)`` where ``applied`` holds the filters used,
+    ready to be stored on a PayrollBatch. Raises ValueError for an id
+    filter that is not a number.
+    """
+    lessons = LessonRecord.objects.all() if lessons is None else lessons
+    applied = {}
+    for key, lookup in LESSON_FILTERS.items():
+        value = params.get(key)
+        if value:
+            if key in ID_FILTERS and not value.isdigit():
+                raise ValueError(f"{key} must be a number, not {value!r}.")
+            lessons = lessons.filter(**{lookup: value})
+            applied[key] = value
+    return lessons, applied
+
+
+def apply_transition(lessons, field, value, user=None, filters=None):
+    """
+    Set ``field`` to ``value`` on every lesson in ``lessons`` with one UPDATE.
+
+    Lessons already at ``value`` are left alone and not counted. Returns the
+    PayrollBatch written for the run.
+    """
+    if value not in TRANSITION_VALUES.get(field, ()):
+        raise ValueError(f"Cannot set {field!r} to {value!r}.")
+
+    with transaction.atomic():
+        # Re-select by id so joins in the caller's filters (class groups)
+        # cannot duplicate rows in the totals or the UPDATE.
+        targets = LessonRecord.objects.filter(
+            id__in=lessons.exclude(**{field: value}).values("id")
+        )
+        pairs = summary_pairs(targets)
+        totals = targets.aggregate(row_count=Count("id"), total_amount=Sum("amount"))
+        targets.update(**{field: value})
+
+        refresh_summaries(pairs)
+        bump_teacher_versions(teacher_id for teacher_id, _ in pairs)
+
+        return PayrollBatch.objects.create(
+            field=field,
+            new_value=value,
+            filters=filters or {},
+            row_count=totals["row_count"],
+            total_amount=totals["total_amount"] or 0,
+            created_by=user if user is not None and user.is_authenticated else None,
+        )
+
+
+# ---------- Payroll report ----------
+
+PAYROLL_GROUPINGS = {
+    "created_by": "created_by",
+    "teacher": "timetable__teacher",
+}
+
+PAYROLL_COLUMNS = [
+    ("teacher_id", "Teacher ID"),
+    ("username", "Username"),
+    ("first_name", "First name"),
+    ("last_name", "Last name"),
+    ("lessons", "Lessons"),
+    ("attended", "Attended"),
+    ("attended_amount", "Attended amount"),
+    ("paid", "Paid"),
+    ("paid_amount", "Paid amount"),
+    ("unpaid", "Unpaid"),
+    ("unpaid_amount", "Unpaid amount"),
+    ("owed_amount", "Attended but unpaid amount"),
+]
+
+
+def payroll_rows(by="created_by", date_from=None, date_to=None):
+    """
+    One dict per teacher with lesson counts and amounts, aggregated in SQL.
+
+    ``by`` picks whose lessons they are: the teacher who recorded them
+    (``created_by``) or the timetable's teacher (``teacher``). ``date_from``
+    and ``date_to`` are inclusive bounds on the start date of each lesson's
+    week; week numbers restart every term, so they cannot bound a range.
+    """
+    prefix = PAYROLL_GROUPINGS[by]
+    lessons = LessonRecord.objects.all()
+    if date_from:
+        lessons = lessons.filter(week__start_date__gte=date_from)
+    if date_to:
+        lessons = lessons.filter(week__start_date__lte=date_to)
+
+    attended = Q(status="Attended")
+    paid = Q(payment_status="Paid")
+    unpaid = Q(payment_status="Unpaid")
+    return lessons.values(
+        teacher_id=F(f"{prefix}_id"),
+        username=F(f"{prefix}__user__username"),
+        first_name=F(f"{prefix}__user__first_name"),
+        last_name=F(f"{prefix}__user__last_name"),
+    ).annotate(
+        lessons=Count("id"),
+        attended=Count("id", filter=attended),
+        attended_amount=Sum("amount", filter=attended, default=0),
+        paid=Count("id", filter=paid),
+        paid_amount=Sum("amount", filter=paid, default=0),
+        unpaid=Count("id", filter=unpaid),
+        unpaid_amount=Sum("amount", filter=unpaid, default=0),
+        owed_amount=Sum("amount", filter=attended & unpaid, default=0),
+    ).order_by("last_name", "first_name", "teacher_id")
@@ -0,0 +1,134 @@
+# lessons/reference.py
+"""
+Cached reference data (weeks, classes, subjects, terms, teachers) for
+dropdowns and filters.
+
+Each table has a version number in the cache. Rows are cached under a key
+that embeds the current version, and the save/delete signals in
+``lessons.signals`` bump the version, so an admin edit is visible on the
+very next request while every other request costs no queries at all.
+That needs a cache shared by every worker (``settings.SHARED_CACHE``);
+on a per-process cache rows expire after REFERENCE_CACHE_TIMEOUT instead.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .models import ClassGroup, Subject, Teacher, Term, Week
+
+
+REFERENCE_MODELS = {
+    "week": Week,
+    "class_group": ClassGroup,
+    "subject": Subject,
+    "term": Term,
+    "teacher": Teacher,
+}
+
+# Relations loaded with the cached rows so that str() needs no queries
+REFERENCE_RELATED = {
+    "teacher": ("user",),
+}
+
+
+def _cache():
+    return caches[getattr(settings, "REFERENCE_CACHE_ALIAS", "default")]
+
+
+def cache_version(key):
+    """
+    Current value of the version counter ``key``.
+
+    Counters start from the clock rather than 1, so a counter that was
+    evicted never comes back with a value an older key or ETag already used.
+    """
+    return _cache().get_or_set(key, time.time_ns, timeout=None)
+
+
+def _bump(key):
+    cache = _cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def bump_cache_version(key):
+    """
+    Move the counter ``key`` on now, and again once the transaction commits.
+
+    The first bump keeps this transaction's own later reads fresh. The
+    second one invalidates anything another worker cached from the
+    pre-commit rows in between. Outside a transaction both run at once.
+    """
+    _bump(key)
+    transaction.on_commit(lambda: _bump(key), robust=True)
+
+
+def _version_key(name):
+    return f"refdata:{name}:version"
+
+
+def reference_version(name):
+    return cache_version(_version_key(name))
+
+
+def bump_reference_version(name):
+    bump_cache_version(_version_key(name))
+
+
+def reference_objects(name):
+    """All rows of the reference table ``name`` as a cached list."""
+    cache = _cache()
+    key = f"refdata:{name}:v{reference_version(name)}"
+    objects = cache.get(key)
+    if objects is None:
+        # Always from the primary: rows read from a lagging replica would be
+        # cached under the new version and outlive the edit that bumped it
+        objects = list(
+            REFERENCE_MODELS[name].objects.using(DEFAULT_DB_ALIAS).select_related(*REFERENCE_RELATED.get(name, ()))
+        )
+        cache.set(key, objects, timeout=getattr(settings, "REFERENCE_CACHE_TIMEOUT", None))
+    return objects
+
+
+def get_weeks():
+    return reference_objects("week")
+
+
+def get_class_groups():
+    return reference_objects("class_group")
+
+
+def get_subjects():
+    return reference_objects("subject")
+
+
+def get_terms():
+    return reference_objects("term")
+
+
+def get_teachers():
+    return reference_objects("teacher")
+
+
+def get_current_term():
+    """The current term for display; code that records against it uses ``Term.current()``."""
+    return next((term for term in get_terms() if term.is_current), None)
+
+
+def model_choices(objects, empty_label="---------"):
+    """Choices for a ModelChoiceField built from cached instances."""
+    choices = [] if empty_label is None else [("", empty_label)]
+    choices.extend((obj.pk, str(obj)) for obj in objects)
+    return choices
+
+
+def cached_choices_for(model):
+    """Return the cached rows for ``model`` or None if it is not reference data."""
+    for name, reference_model in REFERENCE_MODELS.items():
+        if model is reference_model:
+            return reference_objects(name)
+    return None
@@ -0,0 +1,70 @@
+# lessons/replicas.py
+"""
+Send the read-heavy reporting pages to a read replica.
+
+Only code running inside ``reporting_reads()`` is routed: the admin
+payments pages and the teacher dashboard statistics. Everything else,
+and every write, stays on the primary. Replicas lag, so a browser that
+has just written something is pinned to the primary for
+``REPLICA_PIN_SECONDS`` by a signed cookie, and reads later in the same
+request as a write stay on the primary too. Without
+``REPORTING_DATABASE`` configured the router routes nothing.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+PIN_COOKIE = "db_primary"
+
+_reporting = ContextVar("reporting_reads", default=False)
+_pinned = ContextVar("pinned_to_primary", default=False)  # by the cookie
+_wrote = ContextVar("wrote_to_primary", default=False)  # in this request
+
+
+@contextmanager
+def reporting_reads():
+    """Route reads inside the block (or decorated view) to the replica."""
+    token = _reporting.set(True)
+    try:
+        yield
+    finally:
+        _reporting.reset(token)
+
+
+def pin_to_primary():
+    """Keep this request's reads, and the browser's next few, on the primary."""
+    _wrote.set(True)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = getattr(settings, "REPORTING_DATABASE", None)
+        if alias and _reporting.get() and not (_pinned.get() or _wrote.get()):
+            return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return None
+
+
+class ReadYourWritesMiddleware:
+    """Carry the primary pin between requests in a short-lived cookie."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pin_seconds = getattr(settings, "REPLICA_PIN_SECONDS", 10)
+        pinned = request.get_signed_cookie(PIN_COOKIE, default=None, max_age=pin_seconds) is not None
+        pinned_token, wrote_token = _pinned.set(pinned), _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if _wrote.get():
+                response.set_signed_cookie(PIN_COOKIE, "1", max_age=pin_seconds, httponly=True, samesite="Lax")
+        finally:
+            _pinned.reset(pinned_token)
+            _wrote.reset(wrote_token)
+        return response
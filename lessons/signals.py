@@ -0,0 +1,238 @@
+# lessons/signals.py
+from contextvars import ContextVar
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.contrib.auth.models import User
+from django.dispatch import receiver
+
+from .fees import (
+    adjust_amount_paid,
+    adjust_term_paid,
+    apply_class_fee,
+    open_student_balances,
+    open_term_balances,
+    remove_class_fee,
+    reprice_student_balances,
+)
+from .models import ClassGroup, ClassTermFee, LessonRecord, Student, StudentPayment, Subject, Teacher, Term, Timetable, Week
+from .etags import bump_teacher_versions
+from .reference import REFERENCE_MODELS, bump_reference_version
+from .summaries import refresh_summaries
+
+
+# ---------- LessonRecord -> TeacherWeekSummary ----------
+
+def _lesson_pair(lesson):
+    if LessonRecord.timetable.is_cached(lesson):
+        return (lesson.timetable.teacher_id, lesson.week_id)
+    teacher_id = Timetable.objects.filter(id=lesson.timetable_id).values_list("teacher_id", flat=True).first()
+    return (teacher_id, lesson.week_id)
+
+
+@receiver(pre_save, sender=LessonRecord)
+def remember_lesson_pair(sender, instance, raw=False, **kwargs):
+    # An edit can move a lesson to another week or timetable, so the bucket
+    # it leaves must be refreshed as well as the one it lands in.
+    instance._summary_old_pair = None
+    if instance.pk and not raw:
+        instance._summary_old_pair = (
+            LessonRecord.objects.filter(pk=instance.pk)
+            .values_list("timetable__teacher_id", "week_id")
+            .first()
+        )
+
+
+@receiver(post_save, sender=LessonRecord)
+def refresh_lesson_summary(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    pairs = {_lesson_pair(instance)}
+    if getattr(instance, "_summary_old_pair", None):
+        pairs.add(instance._summary_old_pair)
+    refresh_summaries(pairs)
+    bump_teacher_versions(teacher_id for teacher_id, _ in pairs)
+
+
+# Buckets with a lesson delete under way in this thread or task. A delete()
+# sends every pre_delete before removing any row and every post_delete
+# after, so the first post_delete of a bucket re-sums it for the whole
+# batch and takes it off the set; the rest of the batch skip it.
+_pending_delete_pairs = ContextVar("pending_lesson_delete_pairs", default=None)
+
+
+@receiver(pre_delete, sender=LessonRecord)
+def remember_deleted_lesson_pair(sender, instance, **kwargs):
+    # Looked up now: a timetable delete cascading here removes it next
+    instance._summary_pair = _lesson_pair(instance)
+    pending = _pending_delete_pairs.get()
+    if pending is None:
+        pending = set()
+        _pending_delete_pairs.set(pending)
+    pending.add(instance._summary_pair)
+
+
+@receiver(post_delete, sender=LessonRecord)
+def refresh_deleted_lesson_summary(sender, instance, **kwargs):
+    pair = getattr(instance, "_summary_pair", None) or _lesson_pair(instance)
+    pending = _pending_delete_pairs.get() or set()
+    if pair not in pending:
+        return
+    pending.discard(pair)
+    refresh_summaries({pair})
+    bump_teacher_versions([pair[0]])
+
+
+# ---------- Timetable changes move every lesson they own ----------
+
+def _timetable_pairs(timetable_ids, teacher_ids):
+    weeks = set(
+        LessonRecord.objects.filter(timetable_id__in=timetable_ids).values_list("week_id", flat=True)
+    )
+    return {(teacher_id, week_id) for teacher_id in teacher_ids for week_id in weeks}
+
+
+@receiver(pre_save, sender=Timetable)
+def remember_timetable_teacher(sender, instance, raw=False, **kwargs):
+    instance._summary_old_teacher_id = None
+    if instance.pk and not raw:
+        instance._summary_old_teacher_id = (
+            Timetable.objects.filter(pk=instance.pk).values_list("teacher_id", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Timetable)
+def refresh_timetable_summaries(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    teacher_ids = {instance.teacher_id, getattr(instance, "_summary_old_teacher_id", None)} - {None}
+    bump_teacher_versions(teacher_ids)
+    if not created:
+        refresh_summaries(_timetable_pairs([instance.pk], teacher_ids))
+
+
+@receiver(post_delete, sender=Timetable)
+def bump_deleted_timetable_teacher(sender, instance, **kwargs):
+    bump_teacher_versions([instance.teacher_id])
+
+
+@receiver(m2m_changed, sender=Timetable.class_groups.through)
+def refresh_class_group_summaries(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear", "pre_clear"):
+        return
+
+    if reverse:
+        # ClassGroup side: pk_set holds timetable ids (None on clear).
+        if action == "pre_clear":
+            instance._summary_timetable_ids = list(instance.timetable_set.values_list("id", flat=True))
+            return
+        timetable_ids = pk_set if pk_set is not None else getattr(instance, "_summary_timetable_ids", [])
+    else:
+        if action == "pre_clear":
+            return
+        timetable_ids = [instance.pk]
+
+    teacher_ids = set(
+        Timetable.objects.filter(id__in=timetable_ids).values_list("teacher_id", flat=True)
+    )
+    refresh_summaries(_timetable_pairs(timetable_ids, teacher_ids))
+    bump_teacher_versions(teacher_ids)
+
+
+# ---------- Teacher profile -> dashboard cache ----------
+
+@receiver(post_save, sender=Teacher)
+def bump_saved_teacher(sender, instance, raw=False, **kwargs):
+    # The dashboard shows the teacher's picture and class-teacher card
+    if not raw:
+        bump_teacher_versions([instance.pk])
+
+
+# ---------- Reference data cache versions ----------
+
+def _bump_reference(sender, **kwargs):
+    for name, model in REFERENCE_MODELS.items():
+        if sender is model:
+            bump_reference_version(name)
+
+
+for _model in (Week, ClassGroup, Subject, Term, Teacher):
+    post_save.connect(_bump_reference, sender=_model, dispatch_uid=f"refdata-save-{_model.__name__}")
+    post_delete.connect(_bump_reference, sender=_model, dispatch_uid=f"refdata-delete-{_model.__name__}")
+
+
+@receiver(post_save, sender=User)
+def bump_teacher_names(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Cached teachers carry their user's name; logins only touch last_login
+    if raw or (update_fields and set(update_fields) <= {"last_login"}):
+        return
+    bump_reference_version("teacher")
+
+
+# ---------- StudentPayment ledger -> Student.amount_paid, StudentTermBalance.paid ----------
+
+@receiver(pre_save, sender=StudentPayment)
+def remember_payment(sender, instance, raw=False, **kwargs):
+    instance._ledger_old = None
+    if instance.pk and not raw:
+        instance._ledger_old = (
+            StudentPayment.objects.filter(pk=instance.pk).values_list("student_id", "term_id", "amount").first()
+        )
+
+
+@receiver(post_save, sender=StudentPayment)
+def apply_payment(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, "_ledger_old", None)
+    if old:
+        student_id, term_id, amount = old
+        adjust_amount_paid(student_id, -amount)
+        adjust_term_paid(student_id, term_id, -amount, open_missing=False)
+    adjust_amount_paid(instance.student_id, instance.amount)
+    adjust_term_paid(instance.student_id, instance.term_id, instance.amount)
+
+
+@receiver(post_delete, sender=StudentPayment)
+def revert_payment(sender, instance, **kwargs):
+    adjust_amount_paid(instance.student_id, -instance.amount)
+    adjust_term_paid(instance.student_id, instance.term_id, -instance.amount, open_missing=False)
+
+
+# ---------- Opening and pricing term balances ----------
+
+@receiver(post_save, sender=Term)
+def open_current_term(sender, instance, raw=False, **kwargs):
+    if instance.is_current and not raw:
+        open_term_balances(instance)
+
+
+@receiver(post_save, sender=ClassTermFee)
+def apply_saved_class_fee(sender, instance, raw=False, **kwargs):
+    if not raw:
+        apply_class_fee(instance)
+
+
+@receiver(post_delete, sender=ClassTermFee)
+def revert_deleted_class_fee(sender, instance, **kwargs):
+    remove_class_fee(instance)
+
+
+@receiver(pre_save, sender=Student)
+def remember_student_fee(sender, instance, raw=False, **kwargs):
+    # The class and own fee together decide what each term balance charges
+    instance._fee_basis_old = None
+    if instance.pk and not raw:
+        instance._fee_basis_old = (
+            Student.objects.filter(pk=instance.pk).values_list("class_group_id", "term_fee").first()
+        )
+
+
+@receiver(post_save, sender=Student)
+def open_new_student_balances(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, "_fee_basis_old", None)
+    if created or old is None or instance.class_group_id != old[0]:
+        open_student_balances(Student.objects.filter(pk=instance.pk))
+    if not created and old is not None and (instance.class_group_id, instance.term_fee) != old:
+        reprice_student_balances(instance)
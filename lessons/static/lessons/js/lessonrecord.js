@@ -3,6 +3,54 @@ document.addEventListener("DOMContentLoaded", function () {
     const weekField = document.querySelector("#id_week");
     const timetableField = document.querySelector("#id_timetable");
 
+    if (!teacherField || !weekField || !timetableField) {
+        return;
+    }
+
+    // "teacher:week" -> list of free timetables. Pairs seen once are never fetched again.
+    const timetableCache = {};
+    // On a change form (".../lessonrecord/<id>/change/") the lesson's own slot counts as free.
+    const editedLesson = window.location.pathname.match(/\/(\d+)\/change\/$/);
+
+    function cacheKey(teacherId, weekId) {
+        return `${teacherId}:${weekId || ""}`;
+    }
+
+    function renderTimetables(timetables) {
+        const selected = timetableField.value;
+        timetableField.innerHTML = '<option value="">---------</option>';
+        timetables.forEach(item => {
+            const option = document.createElement("option");
+            option.value = item.id;
+            option.textContent = item.class_groups.length
+                ? `${item.name} (${item.class_groups.join(", ")})`
+                : item.name;
+            option.selected = String(item.id) === selected;
+            timetableField.appendChild(option);
+        });
+    }
+
+    function fetchTimetables(teacherId, weekId) {
+        const params = new URLSearchParams();
+        params.set("teacher", teacherId);
+        if (weekId) {
+            params.set("week", weekId);
+        }
+        if (editedLesson) {
+            params.set("ignore_lesson", editedLesson[1]);
+        }
+        return fetch(`/lessons/ajax/load-timetables/?${params}`)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => {
+                timetableCache[cacheKey(teacherId, weekId)] = data;
+            });
+    }
+
     function loadTimetables() {
         const teacherId = teacherField.value;
         const weekId = weekField.value;
@@ -12,21 +60,29 @@ document.addEventListener("DOMContentLoaded", function () {
             return;
         }
 
-        // ✅ Correct fetch syntax with /lessons/ prefix
-        fetch(`/lessons/ajax/load-timetables/?teacher=${teacherId}&week=${weekId}`)
-            .then(response => response.json())
-            .then(data => {
-                timetableField.innerHTML = '<option value="">---------</option>';
-                data.forEach(item => {
-                    const option = document.createElement("option");
-                    option.value = item.id;
-                    option.textContent = item.name;
-                    timetableField.appendChild(option);
-                });
+        const key = cacheKey(teacherId, weekId);
+        if (key in timetableCache) {
+            renderTimetables(timetableCache[key]);
+            return;
+        }
+
+        fetchTimetables(teacherId, weekId)
+            .then(() => {
+                // Ignore responses for a selection the user has already moved away from.
+                if (cacheKey(teacherField.value, weekField.value) === key) {
+                    renderTimetables(timetableCache[key] || []);
+                }
             })
             .catch(error => console.error("Error loading timetables:", error));
     }
 
-    teacherField.addEventListener("change", loadTimetables);
-    weekField.addEventListener("change", loadTimetables);
+    // Teacher and week are admin autocomplete (select2) widgets, which announce
+    // a new selection with a jQuery "change" event rather than a native one.
+    if (window.django && window.django.jQuery) {
+        window.django.jQuery(teacherField).on("change", loadTimetables);
+        window.django.jQuery(weekField).on("change", loadTimetables);
+    } else {
+        teacherField.addEventListener("change", loadTimetables);
+        weekField.addEventListener("change", loadTimetables);
+    }
 });
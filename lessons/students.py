@@ -0,0 +1,171 @@
+# lessons/students.py
+"""
+Bulk student import from CSV.
+
+A whole file is checked with a fixed number of queries: class names are
+resolved from the cached class list and admission numbers are checked
+against one set of the numbers already taken. Rows are then written with
+batched ``bulk_create`` calls inside one transaction. If any row is bad,
+nothing is saved and every problem is reported against its line number.
+"""
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+
+from .fees import open_student_balances
+from .models import Student
+from .reference import get_class_groups
+
+
+IMPORT_BATCH_SIZE = 500
+
+REQUIRED_COLUMNS = ("admission_number", "first_name", "last_name")
+OPTIONAL_COLUMNS = ("class_group", "term_fee")
+
+# Student.term_fee is DecimalField(max_digits=8, decimal_places=2)
+MAX_TERM_FEE = Decimal("1000000")
+
+
+def read_student_csv(file):
+    """
+    Parse an uploaded CSV into ``[(line_number, row_dict), ...]``.
+
+    Headers are matched case-insensitively and may use spaces ("First
+    Name"). Raises ValueError if the file is not UTF-8 text or a required
+    column is missing.
+    """
+    try:
+        text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+        reader = csv.reader(text)
+        header = next(reader, None)
+    except UnicodeDecodeError as exc:
+        raise ValueError("The file is not UTF-8 encoded CSV.") from exc
+    if not header:
+        raise ValueError("The file is empty.")
+
+    columns = [name.strip().lower().replace(" ", "_") for name in header]
+    missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}.")
+
+    rows = []
+    try:
+        for values in reader:
+            if not any(value.strip() for value in values):
+                continue
+            row = {name: value.strip() for name, value in zip(columns, values)}
+            rows.append((reader.line_num, row))
+    except (UnicodeDecodeError, csv.Error) as exc:
+        raise ValueError(f"Line {reader.line_num}: {exc}") from exc
+    return rows
+
+
+def _taken_admission_numbers(numbers, batch_size):
+    numbers = list(numbers)
+    taken = set()
+    # Chunked only to stay under the database's bound-parameter limit.
+    for start in range(0, len(numbers), batch_size):
+        taken.update(
+            Student.objects.filter(admission_number__in=numbers[start:start + batch_size])
+            .values_list("admission_number", flat=True)
+        )
+    return taken
+
+
+def _field_limit(name):
+    return Student._meta.get_field(name).max_length
+
+
+def import_students(rows, class_group=None, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Validate ``rows`` from ``read_student_csv`` and create the students.
+
+    With ``class_group`` (a class teacher's upload) every row goes into that
+    class and a ``class_group`` column may only repeat its name; otherwise
+    each row must name its class. Returns ``(created, errors)`` where
+    ``errors`` is ``[(line_number, message), ...]``; ``created`` is 0
+    whenever there are errors.
+    """
+    classes_by_name = {}
+    for group in get_class_groups():
+        classes_by_name.setdefault(group.name.strip().lower(), []).append(group)
+
+    errors = []
+    seen = {}
+    students = []
+    for line, row in rows:
+        problems = []
+        number = row.get("admission_number", "")
+        for name in REQUIRED_COLUMNS:
+            value = row.get(name, "")
+            if not value:
+                problems.append(f"{name} is required")
+            elif len(value) > _field_limit(name):
+                problems.append(f"{name} is longer than {_field_limit(name)} characters")
+
+        if number in seen:
+            problems.append(f"admission number {number} is repeated (first on line {seen[number]})")
+        elif number:
+            seen[number] = line
+
+        group = class_group
+        class_name = row.get("class_group", "")
+        if class_name:
+            matches = classes_by_name.get(class_name.lower(), [])
+            if class_group is not None:
+                if class_group not in matches:
+                    problems.append(f"class {class_name!r} is not your class")
+            elif not matches:
+                problems.append(f"unknown class {class_name!r}")
+            elif len(matches) > 1:
+                problems.append(f"class name {class_name!r} matches more than one class")
+            else:
+                group = matches[0]
+        elif group is None:
+            problems.append("class_group is required")
+
+        fields = {}
+        fee = row.get("term_fee", "")
+        if fee:
+            try:
+                fields["term_fee"] = Decimal(fee)
+                if not (fields["term_fee"].is_finite() and 0 <= fields["term_fee"] < MAX_TERM_FEE):
+                    raise InvalidOperation
+            except (InvalidOperation, ValueError):
+                problems.append(f"term_fee {fee!r} is not a valid amount")
+
+        if problems:
+            errors.extend((line, problem) for problem in problems)
+            continue
+        students.append((line, Student(
+            admission_number=number,
+            first_name=row["first_name"],
+            last_name=row["last_name"],
+            class_group=group,
+            **fields,
+        )))
+
+    taken = _taken_admission_numbers(seen, batch_size)
+    errors.extend(
+        (line, f"admission number {student.admission_number} already exists")
+        for line, student in students
+        if student.admission_number in taken
+    )
+    if errors:
+        return 0, sorted(errors)
+
+    try:
+        with transaction.atomic():
+            created = Student.objects.bulk_create(
+                [student for _, student in students], batch_size=batch_size
+            )
+            # bulk_create skips the signal that opens new students' term balances
+            open_student_balances(
+                Student.objects.filter(class_group__in={student.class_group_id for _, student in students})
+            )
+    except IntegrityError:
+        # Someone else enrolled one of these numbers since the check above.
+        return 0, [(None, "An admission number was taken while importing; please upload again.")]
+    return len(created), []
@@ -0,0 +1,155 @@
+# lessons/summaries.py
+"""
+Maintenance of the TeacherWeekSummary rollup.
+
+Every write path that touches LessonRecord rows ends up calling
+``refresh_summaries`` with the (teacher_id, week_id) pairs it affected.
+Each pair is re-summed from the raw lessons inside one transaction, so the
+rollup can never drift from the rows it describes.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from .etags import bump_teacher_versions
+from .models import LessonRecord, Teacher, TeacherWeekSummary
+
+
+COUNTER_FIELDS = ("total_lessons", "attended", "not_attended", "pending", "paid", "unpaid")
+AMOUNT_FIELDS = ("total_paid_amount", "total_unpaid_amount")
+
+
+def lesson_aggregates():
+    """Aggregate expressions shared by the dashboard and the rollup."""
+    paid = Q(payment_status__iexact="Paid")
+    unpaid = Q(payment_status__iexact="Unpaid")
+    return {
+        "total_lessons": Count("id"),
+        "attended": Count("id", filter=Q(status__iexact="Attended")),
+        "not_attended": Count("id", filter=Q(status__iexact="Not Attended")),
+        "pending": Count("id", filter=Q(status__iexact="Pending")),
+        "paid": Count("id", filter=paid),
+        "unpaid": Count("id", filter=unpaid),
+        "total_paid_amount": Sum("amount", filter=paid),
+        "total_unpaid_amount": Sum("amount", filter=unpaid),
+    }
+
+
+def summary_rows(lessons):
+    """
+    Build unsaved TeacherWeekSummary rows for ``lessons``: one all-classes row
+    per (teacher, week, subject) plus one row per class the lesson is taught to.
+    """
+    keys = {
+        "teacher_id": F("timetable__teacher_id"),
+        "week_key": F("week_id"),
+        "subject_id": F("timetable__subject_fk_id"),
+    }
+    aggregates = lesson_aggregates()
+
+    all_classes = lessons.values(**keys).annotate(**aggregates).order_by()
+    per_class = lessons.filter(timetable__class_groups__isnull=False).values(
+        class_group_id=F("timetable__class_groups"), **keys
+    ).annotate(**aggregates).order_by()
+
+    rows = []
+    for group in list(all_classes) + list(per_class):
+        group["week_id"] = group.pop("week_key")
+        for field in AMOUNT_FIELDS:
+            group[field] = group[field] or 0
+        rows.append(TeacherWeekSummary(**group))
+    return rows
+
+
+def summary_pairs(lessons):
+    """The distinct (teacher_id, week_id) pairs covered by ``lessons``."""
+    return set(
+        lessons.values_list("timetable__teacher_id", "week_id").distinct().order_by()
+    )
+
+
+def _pair_filter(pairs):
+    condition = Q()
+    for teacher_id, week_id in pairs:
+        condition |= Q(teacher_id=teacher_id, week_id=week_id)
+    return condition
+
+
+def refresh_summaries(pairs):
+    """Re-sum the rollup rows for each (teacher_id, week_id) in ``pairs``."""
+    pairs = {(t, w) for t, w in pairs if t is not None and w is not None}
+    if not pairs:
+        return
+
+    lesson_filter = Q()
+    for teacher_id, week_id in pairs:
+        lesson_filter |= Q(timetable__teacher_id=teacher_id, week_id=week_id)
+
+    with transaction.atomic():
+        # Serialise refreshes per teacher: two concurrent delete-then-insert
+        # runs would otherwise both insert the same buckets
+        list(
+            Teacher.objects.select_for_update()
+            .filter(id__in={teacher_id for teacher_id, _ in pairs})
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        TeacherWeekSummary.objects.filter(_pair_filter(pairs)).delete()
+        TeacherWeekSummary.objects.bulk_create(
+            summary_rows(LessonRecord.objects.filter(lesson_filter))
+        )
+
+
+def rebuild_summaries():
+    """
+    Throw away and recompute the whole rollup. Returns the row count.
+
+    Every teacher's dashboard version is bumped, since cached pages may
+    show the statistics the rebuild has just corrected.
+    """
+    with transaction.atomic():
+        TeacherWeekSummary.objects.all().delete()
+        rows = TeacherWeekSummary.objects.bulk_create(summary_rows(LessonRecord.objects.all()))
+        bump_teacher_versions(Teacher.objects.values_list("id", flat=True))
+    return len(rows)
+
+
+def _summary_key(row):
+    return (row.teacher_id, row.week_id, row.class_group_id, row.subject_id)
+
+
+def _summary_values(row):
+    return tuple(getattr(row, field) for field in COUNTER_FIELDS + AMOUNT_FIELDS)
+
+
+def verify_summaries():
+    """
+    Compare the stored rollup with a fresh computation.
+
+    Returns the list of keys ``(teacher_id, week_id, class_group_id, subject_id)``
+    whose stored counters are missing, stale or unexpected.
+    """
+    expected = {_summary_key(row): _summary_values(row) for row in summary_rows(LessonRecord.objects.all())}
+    stored = {_summary_key(row): _summary_values(row) for row in TeacherWeekSummary.objects.all()}
+    return sorted(
+        (key for key in expected.keys() | stored.keys() if expected.get(key) != stored.get(key)),
+        key=lambda key: tuple(-1 if part is None else part for part in key),
+    )
+
+
+def summary_statistics(teacher, week_id=None, class_group_id=None, subject_id=None):
+    """
+    Dashboard statistics for ``teacher`` read from the rollup, in the same
+    shape as ``lesson_statistics``.
+    """
+    rows = TeacherWeekSummary.objects.filter(teacher=teacher)
+    if class_group_id:
+        rows = rows.filter(class_group_id=class_group_id)
+    else:
+        rows = rows.filter(class_group__isnull=True)
+    if week_id:
+        rows = rows.filter(week_id=week_id)
+    if subject_id:
+        rows = rows.filter(subject_id=subject_id)
+
+    stats = rows.aggregate(**{field: Sum(field) for field in COUNTER_FIELDS + AMOUNT_FIELDS})
+    return {field: value or 0 for field, value in stats.items()}
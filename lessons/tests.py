@@ -1,3 +1,1580 @@
-from django.test import TestCase
+import contextlib
+import contextvars
+import csv
+import datetime
+import importlib
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, IntegrityError, connection, connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import (
+    ClassGroup,
+    ClassTermFee,
+    LessonRecord,
+    PayrollBatch,
+    Student,
+    StudentPayment,
+    StudentTermBalance,
+    Subject,
+    Teacher,
+    TeacherWeekSummary,
+    Term,
+    Timetable,
+    Week,
+)
+from .admin import ClassGroupAdmin
+from .availability import SlotTaken, available_timetables, schedule_lesson
+from .benchmark import run_cases, seed
+from .etags import bump_teacher_versions, teacher_version
+from .fees import (
+    open_term_balances,
+    reconcile_balances,
+    reconcile_term_balances,
+    record_class_payments,
+    student_fee_statistics,
+    term_debtors,
+)
+from .forms import TeacherLessonForm
+from .payroll import apply_transition
+from .reference import get_class_groups, get_subjects, get_teachers, get_terms, get_weeks
+from .replicas import PIN_COOKIE, ReplicaRouter, reporting_reads
+from .summaries import summary_statistics, verify_summaries
+from .views import LESSONS_PAGE_SIZE, lesson_statistics
+
+
+class LessonFixturesMixin:
+    """Small school: one teacher, two classes, two subjects, two weeks."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("teacher", password="pass", first_name="Ann", last_name="Teach")
+        cls.teacher = Teacher.objects.create(user=cls.user)
+        cls.math = Subject.objects.create(name="Math")
+        cls.english = Subject.objects.create(name="English")
+        cls.form1 = ClassGroup.objects.create(name="Form 1")
+        cls.form2 = ClassGroup.objects.create(name="Form 2")
+        cls.week1 = Week.objects.create(
+            number=1, start_date=datetime.date(2025, 1, 6), end_date=datetime.date(2025, 1, 10)
+        )
+        cls.week2 = Week.objects.create(
+            number=2, start_date=datetime.date(2025, 1, 13), end_date=datetime.date(2025, 1, 17)
+        )
+        cls.math_tt = cls.make_timetable(cls.math, "Mon", cls.form1)
+        cls.english_tt = cls.make_timetable(cls.english, "Tue", cls.form2)
+
+    @classmethod
+    def make_timetable(cls, subject, day, *class_groups, teacher=None):
+        timetable = Timetable.objects.create(
+            subject_fk=subject,
+            teacher=teacher or cls.teacher,
+            day=day,
+            start_time=datetime.time(16, 0),
+            end_time=datetime.time(17, 0),
+        )
+        timetable.class_groups.set(class_groups)
+        return timetable
+
+    def setUp(self):
+        super().setUp()
+        # Test rollbacks do not fire delete signals, so start from a cold cache.
+        cache.clear()
+
+    def make_lesson(self, timetable, week, status="Pending", payment_status="Unpaid", amount=400):
+        return LessonRecord.objects.create(
+            timetable=timetable,
+            week=week,
+            created_by=timetable.teacher,
+            status=status,
+            payment_status=payment_status,
+            amount=amount,
+        )
+
+
+class LessonStatisticsTests(LessonFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.make_lesson(self.math_tt, self.week1, "Attended", "Paid", 400)
+        self.make_lesson(self.english_tt, self.week1, "Not Attended", "Unpaid", 300)
+        self.make_lesson(self.math_tt, self.week2, "Pending", "Unpaid", 250)
+
+    def test_statistics_use_one_query(self):
+        lessons = LessonRecord.objects.filter(timetable__teacher=self.teacher)
+        with self.assertNumQueries(1):
+            stats = lesson_statistics(lessons)
+        self.assertEqual(stats, {
+            "total_lessons": 3,
+            "attended": 1,
+            "not_attended": 1,
+            "pending": 1,
+            "paid": 1,
+            "unpaid": 2,
+            "total_paid_amount": Decimal("400"),
+            "total_unpaid_amount": Decimal("550"),
+        })
+
+    def test_statistics_empty_queryset_totals_are_zero(self):
+        stats = lesson_statistics(LessonRecord.objects.none())
+        self.assertEqual(stats["total_lessons"], 0)
+        self.assertEqual(stats["total_paid_amount"], 0)
+        self.assertEqual(stats["total_unpaid_amount"], 0)
+
+    def test_dashboard_statistics_respect_filters(self):
+        self.client.force_login(self.user)
+        url = reverse("teacher_dashboard")
+
+        response = self.client.get(url, {"week": self.week1.id})
+        self.assertEqual(response.context["total_lessons"], 2)
+
+        response = self.client.get(url, {"class_group": self.form2.id})
+        self.assertEqual(response.context["total_lessons"], 1)
+        self.assertEqual(response.context["not_attended"], 1)
+
+        response = self.client.get(url, {"subject": self.math.id})
+        self.assertEqual(response.context["total_lessons"], 2)
+        self.assertEqual(response.context["total_paid_amount"], Decimal("400"))
+        self.assertEqual(response.context["total_unpaid_amount"], Decimal("250"))
+
+
+class TeacherDashboardQueryTests(LessonFixturesMixin, TestCase):
+    def make_weeks(self, count):
+        return [
+            Week.objects.create(
+                number=10 + n,
+                start_date=datetime.date(2025, 3, 3) + datetime.timedelta(weeks=n),
+                end_date=datetime.date(2025, 3, 7) + datetime.timedelta(weeks=n),
+            )
+            for n in range(count)
+        ]
+
+    def dashboard_queries(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse("teacher_dashboard"))  # warm the reference cache
+        bump_teacher_versions([self.teacher.id])  # render again rather than serve the cached page
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("teacher_dashboard"))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_lessons(self):
+        self.make_lesson(self.math_tt, self.week1)
+        baseline = self.dashboard_queries()
+        # session, user, teacher, lesson page, class groups prefetch, statistics
+        self.assertEqual(baseline, 6)
+
+        for week in self.make_weeks(LESSONS_PAGE_SIZE + 5):
+            self.make_lesson(self.math_tt, week)
+            self.make_lesson(self.english_tt, week)
+        self.assertEqual(self.dashboard_queries(), baseline)
+
+    def test_load_more_walks_every_lesson_once(self):
+        expected = set()
+        for week in self.make_weeks(LESSONS_PAGE_SIZE):
+            expected.add(self.make_lesson(self.math_tt, week).id)
+            expected.add(self.make_lesson(self.english_tt, week).id)
+
+        self.client.force_login(self.user)
+        url = reverse("teacher_dashboard")
+        response = self.client.get(url)
+        seen = [lesson.id for lesson in response.context["lessons"]]
+        cursor = response.context["next_cursor"]
+        self.assertEqual(len(seen), LESSONS_PAGE_SIZE)
+
+        while cursor:
+            response = self.client.get(
+                url, {"cursor": cursor}, headers={"x-requested-with": "XMLHttpRequest"}
+            )
+            data = response.json()
+            self.assertEqual(response.status_code, 200)
+            seen.extend(int(pk) for pk in re.findall(r"mark_attended/(\d+)/", data["html"]))
+            cursor = data["next_cursor"]
+
+        self.assertEqual(len(seen), len(expected))
+        self.assertEqual(set(seen), expected)
+
+
+@override_settings(SHARED_CACHE=True)
+class DashboardCacheTests(LessonFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.make_lesson(self.math_tt, self.week1, "Attended")
+        self.client.force_login(self.user)
+
+    def visit(self, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("teacher_dashboard"), params)
+        self.assertEqual(response.status_code, 200)
+        lesson_queries = [q["sql"] for q in ctx.captured_queries if "lessons_" in q["sql"]]
+        return response.content.decode(), lesson_queries
+
+    def assert_cached(self, **params):
+        content, queries = self.visit(**params)
+        self.assertEqual(queries, [])  # only the session and user lookups
+        return content
+
+    def assert_rendered(self, **params):
+        content, queries = self.visit(**params)
+        self.assertTrue(queries)
+        return content
+
+    def test_repeat_visit_does_no_lesson_queries(self):
+        first = self.assert_rendered()  # also sets the CSRF cookie
+        second = self.assert_rendered()
+        self.assertEqual(self.assert_cached(), second)
+        self.assertIn("Math", first)
+
+    def test_filters_are_cached_separately(self):
+        self.assert_rendered()
+        self.assert_rendered()
+        self.assert_rendered(week=self.week2.id)
+        self.assert_cached(week=self.week2.id)
+        self.assert_cached()
+
+    def test_own_lessons_timetables_and_picture_invalidate(self):
+        self.assert_rendered()
+        self.assert_rendered()
+
+        self.make_lesson(self.english_tt, self.week1)
+        self.assert_rendered()
+        self.assert_cached()
+
+        self.math_tt.day = "Wed"
+        self.math_tt.save()
+        self.assert_rendered()
+        self.assert_cached()
+
+        self.teacher.profile_picture = "profile_pics/ann.png"
+        self.teacher.save()
+        self.assertIn("profile_pics/ann.png", self.assert_rendered())
+
+    def test_other_teachers_changes_keep_the_cache(self):
+        other = Teacher.objects.create(user=User.objects.create_user("other"))
+        self.assert_rendered()
+        self.assert_rendered()
+        other_tt = self.make_timetable(self.math, "Fri", self.form1, teacher=other)
+        self.make_lesson(other_tt, self.week1)
+        self.assert_cached()
+
+    def test_rebuilding_the_rollup_invalidates(self):
+        self.assert_rendered()
+        self.assert_rendered()
+        call_command("rebuild_lesson_summaries", stdout=io.StringIO())
+        self.assert_rendered()
+
+    def test_versions_move_again_on_commit(self):
+        self.assert_rendered()
+        self.assert_rendered()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.make_lesson(self.english_tt, self.week1)
+        self.assert_rendered()
+        self.assert_cached()  # e.g. another worker rendering before the commit
+        for callback in callbacks:
+            callback()
+        self.assert_rendered()
+
+    @override_settings(REPORTING_DATABASE="default")  # stands in for the replica alias
+    def test_a_page_that_will_be_cached_reads_the_primary(self):
+        routed = []
+        original = ReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            alias = original(router, model, **hints)
+            routed.append(alias)
+            return alias
+
+        with mock.patch.object(ReplicaRouter, "db_for_read", spy):
+            self.assert_rendered()  # no CSRF cookie yet: not cached, so the replica may serve it
+            self.assertIn("default", routed)
+            routed.clear()
+            self.assert_rendered()
+        self.assertNotIn("default", routed)
+        self.assert_cached()
+
+    @override_settings(SHARED_CACHE=False)
+    def test_nothing_is_cached_without_a_shared_cache(self):
+        self.assert_rendered()
+        self.assert_rendered()
+        self.assert_rendered()
+
+
+class TeacherWeekSummaryTests(LessonFixturesMixin, TestCase):
+    def stats(self, **filters):
+        return summary_statistics(self.teacher, **filters)
+
+    def test_create_update_delete_keep_rollup_in_sync(self):
+        lesson = self.make_lesson(self.math_tt, self.week1, "Attended", "Paid", 400)
+        self.make_lesson(self.english_tt, self.week1)
+        self.assertEqual(self.stats()["total_lessons"], 2)
+        self.assertEqual(self.stats()["total_paid_amount"], Decimal("400"))
+
+        lesson.week = self.week2
+        lesson.payment_status = "Unpaid"
+        lesson.save()
+        self.assertEqual(self.stats(week_id=self.week1.id)["total_lessons"], 1)
+        self.assertEqual(self.stats(week_id=self.week2.id)["total_unpaid_amount"], Decimal("400"))
+
+        lesson.delete()
+        self.assertEqual(self.stats(week_id=self.week2.id)["total_lessons"], 0)
+        self.assertEqual(verify_summaries(), [])
+
+    def test_lesson_for_two_classes_counted_once_overall(self):
+        shared = self.make_timetable(self.math, "Wed", self.form1, self.form2)
+        self.make_lesson(shared, self.week1)
+        self.assertEqual(self.stats()["total_lessons"], 1)
+        self.assertEqual(self.stats(class_group_id=self.form1.id)["total_lessons"], 1)
+        self.assertEqual(self.stats(class_group_id=self.form2.id)["total_lessons"], 1)
+
+        shared.class_groups.remove(self.form2)
+        self.assertEqual(self.stats(class_group_id=self.form2.id)["total_lessons"], 0)
+        self.assertEqual(verify_summaries(), [])
+
+    def test_queryset_delete_and_timetable_reassignment(self):
+        other = Teacher.objects.create(user=User.objects.create_user("other"))
+        self.make_lesson(self.math_tt, self.week1)
+        self.make_lesson(self.math_tt, self.week2)
+
+        self.math_tt.teacher = other
+        self.math_tt.save()
+        self.assertEqual(self.stats()["total_lessons"], 0)
+        self.assertEqual(summary_statistics(other)["total_lessons"], 2)
+
+        LessonRecord.objects.all().delete()
+        self.assertFalse(TeacherWeekSummary.objects.exists())
+
+    def test_lesson_and_rollup_commit_together(self):
+        with mock.patch("lessons.signals.refresh_summaries", side_effect=DatabaseError("lost")):
+            with self.assertRaises(DatabaseError):
+                self.make_lesson(self.math_tt, self.week1)
+        self.assertFalse(LessonRecord.objects.exists())
+
+        lesson = self.make_lesson(self.math_tt, self.week1)
+        with mock.patch("lessons.signals.refresh_summaries", side_effect=DatabaseError("lost")):
+            with self.assertRaises(DatabaseError):
+                lesson.delete()
+        self.assertTrue(LessonRecord.objects.filter(pk=lesson.pk).exists())
+        self.assertEqual(verify_summaries(), [])
+
+    def test_deleting_the_same_queryset_twice(self):
+        week1 = LessonRecord.objects.filter(week=self.week1)
+        self.make_lesson(self.math_tt, self.week1)
+        self.make_lesson(self.english_tt, self.week1)
+        week1.delete()
+        self.make_lesson(self.math_tt, self.week1)
+        week1.delete()
+        self.assertEqual(verify_summaries(), [])
+        self.assertEqual(self.stats()["total_lessons"], 0)
+
+    def test_timetable_delete_cascades_into_the_rollup(self):
+        self.make_lesson(self.math_tt, self.week1)
+        self.make_lesson(self.english_tt, self.week1)
+        self.math_tt.delete()
+        self.assertEqual(verify_summaries(), [])
+        self.assertEqual(self.stats()["total_lessons"], 1)
+
+    def test_rebuild_command_repairs_drift(self):
+        self.make_lesson(self.math_tt, self.week1)
+        TeacherWeekSummary.objects.update(total_lessons=99)
+
+        with self.assertRaises(CommandError):
+            call_command("rebuild_lesson_summaries", "--check", stdout=io.StringIO(), stderr=io.StringIO())
+
+        call_command("rebuild_lesson_summaries", stdout=io.StringIO())
+        self.assertEqual(verify_summaries(), [])
+        self.assertEqual(self.stats()["total_lessons"], 1)
+
+    def test_migration_fills_an_empty_rollup(self):
+        shared = self.make_timetable(self.math, "Wed", self.form1, self.form2)
+        self.make_lesson(shared, self.week1, "Attended", "Paid", 300)
+        self.make_lesson(self.english_tt, self.week2)
+        TeacherWeekSummary.objects.all().delete()
+
+        migration = importlib.import_module("lessons.migrations.0021_teacher_week_summary_unique")
+        migration.rebuild_teacher_week_summaries(django_apps, None)
+        self.assertEqual(verify_summaries(), [])
+        self.assertEqual(self.stats()["total_paid_amount"], Decimal("300"))
+
+    def test_one_row_per_bucket(self):
+        self.make_lesson(self.math_tt, self.week1)
+        row = TeacherWeekSummary.objects.get(teacher=self.teacher, week=self.week1, class_group=None)
+        row.pk = None
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            row.save()
+
+
+class ReferenceCacheTests(LessonFixturesMixin, TestCase):
+    def test_reference_lists_cost_no_queries_once_warm(self):
+        get_weeks(), get_class_groups(), get_subjects()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_weeks()), 2)
+            self.assertEqual(len(get_class_groups()), 2)
+            self.assertEqual(len(get_subjects()), 2)
+            TeacherLessonForm(teacher=None).as_p()
+
+    def test_admin_edit_refreshes_cached_rows(self):
+        self.assertEqual([w.number for w in get_weeks()], [1, 2])
+        self.week2.number = 3
+        self.week2.save()
+        self.assertEqual([w.number for w in get_weeks()], [1, 3])
+
+        Subject.objects.create(name="Science")
+        self.assertIn("Science", [s.name for s in get_subjects()])
+
+        self.form2.delete()
+        self.assertEqual([c.name for c in get_class_groups()], ["Form 1"])
+
+
+class AvailabilityTests(LessonFixturesMixin, TestCase):
+    def test_used_slots_are_excluded_in_one_query(self):
+        lesson = self.make_lesson(self.math_tt, self.week1)
+        with self.assertNumQueries(1):
+            free = list(available_timetables(self.teacher.id, self.week1.id))
+        self.assertEqual(free, [self.english_tt])
+        self.assertEqual(
+            set(available_timetables(self.teacher.id, self.week2.id)), {self.math_tt, self.english_tt}
+        )
+        self.assertIn(
+            self.math_tt, available_timetables(self.teacher.id, self.week1.id, ignore_lesson_id=lesson.id)
+        )
+
+    def test_add_lesson_rejects_used_slot(self):
+        self.make_lesson(self.math_tt, self.week1)
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse("add_lesson"), {"week": self.week1.id, "timetable": self.math_tt.id}
+        )
+        self.assertContains(response, "already been scheduled")
+        self.assertEqual(LessonRecord.objects.count(), 1)
+
+        response = self.client.post(
+            reverse("add_lesson"), {"week": self.week2.id, "timetable": self.math_tt.id}
+        )
+        self.assertRedirects(response, reverse("teacher_dashboard"), fetch_redirect_response=False)
+        self.assertEqual(LessonRecord.objects.count(), 2)
+
+    def test_timetable_endpoints_hide_used_slots(self):
+        self.make_lesson(self.math_tt, self.week1)
+        self.client.force_login(self.user)
+        params = {"teacher": self.teacher.id, "week": self.week1.id}
+
+        data = self.client.get(reverse("filter_timetables"), params).json()
+        self.assertEqual([t["id"] for t in data["timetables"]], [self.english_tt.id])
+        self.assertIn("English", data["timetables"][0]["display"])
+
+        data = self.client.get(reverse("ajax_load_timetables"), params).json()
+        self.assertEqual([t["id"] for t in data], [self.english_tt.id])
+
+    def test_timetable_endpoints_reject_non_numeric_ids(self):
+        self.client.force_login(self.user)
+        for name in ("filter_timetables", "ajax_load_timetables"):
+            response = self.client.get(reverse(name), {"teacher": self.teacher.id, "week": "abc"})
+            self.assertEqual(response.status_code, 400)
+
+    def test_only_a_used_slot_is_reported_as_scheduled(self):
+        other = Teacher.objects.create(user=User.objects.create_user("other"))
+        other_tt = self.make_timetable(self.math, "Fri", self.form1, teacher=other)
+        self.client.force_login(self.user)
+        for timetable_id in (other_tt.id, 999999):
+            response = self.client.post(reverse("add_lesson"), {"week": self.week1.id, "timetable": timetable_id})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotContains(response, "already been scheduled")
+            self.assertContains(response, "Select a valid choice")
+        self.assertFalse(LessonRecord.objects.exists())
+
+
+class LoadTimetablesEndpointTests(LessonFixturesMixin, TestCase):
+    def test_lists_class_groups_for_the_option_label(self):
+        self.math_tt.class_groups.add(self.form2)
+        self.client.force_login(self.user)
+        with self.assertNumQueries(4):  # session, user, timetables, their class groups
+            data = self.client.get(reverse("ajax_load_timetables"), {"teacher": self.teacher.id}).json()
+        self.assertEqual(data[0]["name"], str(self.math_tt))
+        self.assertEqual(data[0]["class_groups"], ["Form 1", "Form 2"])
+
+    def test_lists_the_edited_lessons_own_slot(self):
+        lesson = self.make_lesson(self.math_tt, self.week1)
+        self.client.force_login(self.user)
+        url = reverse("ajax_load_timetables")
+        params = {"teacher": self.teacher.id, "week": self.week1.id}
+
+        data = self.client.get(url, {**params, "ignore_lesson": lesson.id}).json()
+        self.assertEqual([t["id"] for t in data], [self.math_tt.id, self.english_tt.id])
+        self.assertEqual(self.client.get(url, {**params, "ignore_lesson": "x"}).status_code, 400)
+
+
+@override_settings(SHARED_CACHE=True)
+class ConditionalGetTests(LessonFixturesMixin, TestCase):
+    def get(self, url, params, etag=None):
+        headers = {"if-none-match": etag} if etag else {}
+        return self.client.get(url, params, headers=headers)
+
+    def test_unchanged_timetables_answer_304_without_queries(self):
+        self.client.force_login(self.user)
+        url = reverse("ajax_load_timetables")
+        params = {"teacher": self.teacher.id, "week": self.week1.id}
+
+        first = self.get(url, params)
+        self.assertEqual(first.status_code, 200)
+        etag = first["ETag"]
+
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.get(url, params, etag)
+        self.assertEqual(second.status_code, 304)
+        tables = " ".join(q["sql"] for q in ctx.captured_queries)
+        self.assertNotIn("lessons_timetable", tables)
+
+        self.make_lesson(self.math_tt, self.week1)
+        third = self.get(url, params, etag)
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third["ETag"], etag)
+        self.assertEqual([t["id"] for t in third.json()], [self.english_tt.id])
+
+    def test_subject_rename_changes_etag(self):
+        self.client.force_login(self.user)
+        url = reverse("ajax_teacher_subjects")
+        etag = self.get(url, {})["ETag"]
+        self.assertEqual(self.get(url, {}, etag).status_code, 304)
+
+        self.math.name = "Mathematics"
+        self.math.save()
+        response = self.get(url, {}, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Mathematics", [t["subject"] for t in response.json()["subjects"]])
+
+    def test_other_teachers_changes_keep_etag(self):
+        other = Teacher.objects.create(user=User.objects.create_user("other"))
+        self.client.force_login(self.user)
+        url = reverse("filter_timetables")
+        params = {"teacher": self.teacher.id}
+        etag = self.get(url, params)["ETag"]
+
+        self.make_timetable(self.math, "Fri", self.form1, teacher=other)
+        self.assertEqual(self.get(url, params, etag).status_code, 304)
+
+        self.make_timetable(self.math, "Thu", self.form1)
+        self.assertEqual(self.get(url, params, etag).status_code, 200)
+
+    def test_no_etag_without_a_shared_cache(self):
+        self.client.force_login(self.user)
+        with self.settings(SHARED_CACHE=False):
+            response = self.get(reverse("ajax_load_timetables"), {"teacher": self.teacher.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("ETag"))
+
+    def test_versions_move_again_on_commit(self):
+        before = teacher_version(self.teacher.id)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.make_timetable(self.math, "Thu", self.form1)
+        during = teacher_version(self.teacher.id)
+        self.assertNotEqual(during, before)
+        self.assertTrue(callbacks)
+
+        # A worker that cached pre-commit rows under ``during`` is invalidated
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(teacher_version(self.teacher.id), during)
+
+
+class GenerateWeekLessonsTests(LessonFixturesMixin, TestCase):
+    def test_command_is_idempotent_and_updates_rollup(self):
+        self.make_lesson(self.math_tt, self.week1, "Attended")
+        out = io.StringIO()
+        call_command("generate_week_lessons", str(self.week1.id), stdout=out)
+        self.assertIn("created 1 lessons, skipped 1", out.getvalue())
+
+        call_command("generate_week_lessons", "1", "--number", stdout=out)
+        self.assertIn("created 0 lessons, skipped 2", out.getvalue())
+
+        lesson = LessonRecord.objects.get(timetable=self.english_tt, week=self.week1)
+        self.assertEqual((lesson.status, lesson.payment_status, lesson.amount), ("Pending", "Unpaid", 400))
+        self.assertEqual(lesson.created_by, self.teacher)
+        self.assertEqual(summary_statistics(self.teacher)["total_lessons"], 2)
+        self.assertEqual(verify_summaries(), [])
+
+    def test_admin_action(self):
+        admin_user = User.objects.create_superuser("root", "root@example.com", "pw")
+        self.client.force_login(admin_user)
+        response = self.client.post(
+            "/admin/lessons/week/",
+            {"action": "generate_lessons", "_selected_action": [self.week1.id, self.week2.id]},
+            follow=True,
+        )
+        self.assertContains(response, "created 2 lessons")
+        self.assertEqual(LessonRecord.objects.count(), 4)
+
+
+class UniqueLessonSlotTests(LessonFixturesMixin, TestCase):
+    def test_duplicate_insert_raises_slot_taken(self):
+        self.make_lesson(self.math_tt, self.week1)
+        duplicate = LessonRecord(timetable=self.math_tt, week=self.week1, created_by=self.teacher)
+        with self.assertRaises(SlotTaken):
+            schedule_lesson(duplicate)
+        self.assertEqual(LessonRecord.objects.count(), 1)
+
+    def test_losing_a_race_shows_the_form_error(self):
+        # The form saw a free slot, but another submit won before our insert.
+        self.client.force_login(self.user)
+        self.make_lesson(self.math_tt, self.week1)
+
+        def stale_availability(teacher_id, week_id=None, ignore_lesson_id=None):
+            return Timetable.objects.filter(teacher_id=teacher_id)
+
+        with mock.patch("lessons.forms.available_timetables", stale_availability):
+            response = self.client.post(
+                reverse("add_lesson"), {"week": self.week1.id, "timetable": self.math_tt.id}
+            )
+        self.assertContains(response, "already been scheduled")
+        self.assertEqual(LessonRecord.objects.count(), 1)
+
+    def test_admin_lost_race_is_a_message_not_a_500(self):
+        self.client.force_login(User.objects.create_superuser("root", "root@example.com", "pw"))
+        url = reverse("myadmin:lessons_lessonrecord_add")
+        data = {
+            "week": self.week1.id, "teacher": self.teacher.id, "created_by": self.teacher.id,
+            "timetable": self.math_tt.id, "status": "Pending", "payment_status": "Unpaid", "amount": "400",
+        }
+        with mock.patch("lessons.admin.schedule_lesson", side_effect=SlotTaken(SlotTaken.message)):
+            response = self.client.post(url, data, follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "already been scheduled")
+        self.assertFalse(LessonRecord.objects.exists())
+
+    def test_add_lesson_is_one_read_and_one_insert(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse("add_lesson"), {"week": self.week1.id, "timetable": self.math_tt.id})
+        lesson_sql = [q["sql"] for q in ctx.captured_queries if '"lessons_lessonrecord"' in q["sql"]]
+        inserts = [sql for sql in lesson_sql if sql.startswith("INSERT")]
+        self.assertEqual(len(inserts), 1)
+        # Timetable choice validation is the only lookup of existing lessons.
+        reads = [sql for sql in lesson_sql if sql.startswith("SELECT") and "lessons_timetable" in sql
+                 and "NOT EXISTS" in sql]
+        self.assertEqual(len(reads), 1)
+
+
+class LessonTransitionTests(LessonFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.a = self.make_lesson(self.math_tt, self.week1, "Attended", amount=400)
+        self.b = self.make_lesson(self.english_tt, self.week1, "Attended", amount=300)
+        self.c = self.make_lesson(self.math_tt, self.week2, "Pending", amount=250)
+        self.staff = User.objects.create_superuser("bursar", "bursar@example.com", "pw")
+
+    def test_transition_is_one_update_and_records_batch(self):
+        lessons = LessonRecord.objects.filter(week=self.week1, status="Attended")
+        with CaptureQueriesContext(connection) as ctx:
+            batch = apply_transition(lessons, "payment_status", "Paid", user=self.staff)
+        updates = [q for q in ctx.captured_queries if q["sql"].startswith('UPDATE "lessons_lessonrecord"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual((batch.row_count, batch.total_amount), (2, Decimal("700")))
+        self.assertEqual(batch.created_by, self.staff)
+        self.assertEqual(summary_statistics(self.teacher)["paid"], 2)
+        self.assertEqual(verify_summaries(), [])
+
+        # Running it again changes nothing and says so.
+        self.assertEqual(apply_transition(lessons, "payment_status", "Paid").row_count, 0)
+
+    def test_invalid_value_is_rejected(self):
+        with self.assertRaises(ValueError):
+            apply_transition(LessonRecord.objects.all(), "payment_status", "Refunded")
+        self.assertFalse(PayrollBatch.objects.exists())
+
+    def test_staff_endpoint(self):
+        url = reverse("lesson_transition")
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.post(url, {"field": "status", "value": "Attended"}).status_code, 302)
+
+        self.client.force_login(self.staff)
+        response = self.client.post(url, {
+            "field": "payment_status", "value": "Paid",
+            "week": self.week1.id, "teacher": self.teacher.id, "status": "Attended",
+        })
+        self.assertEqual(response.json()["row_count"], 2)
+        self.assertEqual(response.json()["total_amount"], "700.00")
+        self.assertEqual(PayrollBatch.objects.get().filters["week"], str(self.week1.id))
+        self.c.refresh_from_db()
+        self.assertEqual(self.c.payment_status, "Unpaid")
+
+    def test_staff_endpoint_rejects_missing_or_bad_filters(self):
+        url = reverse("lesson_transition")
+        self.client.force_login(self.staff)
+        for data in ({}, {"week": "abc"}, {"teacher": "1;2"}, {"status": "Attended", "class_group": "x"}):
+            response = self.client.post(url, {"field": "payment_status", "value": "Paid", **data})
+            self.assertEqual(response.status_code, 400, data)
+        self.assertFalse(PayrollBatch.objects.exists())
+        self.assertFalse(LessonRecord.objects.filter(payment_status="Paid").exists())
+
+    def test_admin_action(self):
+        self.client.force_login(self.staff)
+        response = self.client.post(
+            "/admin/lessons/lessonrecord/",
+            {"action": "mark_attended", "_selected_action": [self.c.id]},
+            follow=True,
+        )
+        self.assertContains(response, "1 lessons set to Attended")
+        self.c.refresh_from_db()
+        self.assertEqual(self.c.status, "Attended")
+        self.assertEqual(PayrollBatch.objects.get().filters, {"ids": [self.c.id]})
+
+
+class LessonRecordChangelistTests(LessonFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser("root", "root@example.com", "pw"))
+        self.url = reverse("myadmin:lessons_lessonrecord_changelist")
+
+    def add_teacher_lessons(self, n):
+        weeks = Week.objects.bulk_create(
+            Week(number=100 + i, start_date=datetime.date(2025, 1, 1), end_date=datetime.date(2025, 1, 5))
+            for i in range(n)
+        )
+        for week in weeks:
+            teacher = Teacher.objects.create(user=User.objects.create_user(f"t{week.pk}", first_name="T"))
+            timetable = self.make_timetable(self.math, "Wed", self.form1, teacher=teacher)
+            LessonRecord.objects.create(timetable=timetable, week=week, created_by=teacher)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.add_teacher_lessons(2)
+        self.client.get(self.url)  # warm the week and teacher caches
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.url)
+
+        self.add_teacher_lessons(20)
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(self.url)
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+        self.assertEqual(response.context["cl"].result_count, 22)
+        counts = [q for q in large.captured_queries if q["sql"].startswith('SELECT COUNT(*)')]
+        self.assertEqual(len(counts), 1)  # no full-table count next to the filtered one
+
+    def test_cached_filters(self):
+        other = self.make_lesson(self.english_tt, self.week2)
+        self.make_lesson(self.math_tt, self.week1)
+        response = self.client.get(self.url, {"week": self.week2.id})
+        self.assertEqual(list(response.context["cl"].result_list), [other])
+        response = self.client.get(self.url, {"teacher": self.teacher.id})
+        self.assertEqual(response.context["cl"].result_count, 2)
+
+    def test_bad_filter_values_redirect_like_the_stock_filters(self):
+        for params in ({"week": "abc"}, {"teacher": "x"}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 302, params)
+            self.assertTrue(response["Location"].endswith("?e=1"))
+
+    def test_teacher_renames_refresh_the_cached_filter(self):
+        self.assertNotIn("Renamed", " ".join(map(str, get_teachers())))
+        self.user.first_name = "Renamed"
+        self.user.save()
+        self.assertIn("Renamed", " ".join(map(str, get_teachers())))
+
+
+class AdminAutocompleteTests(LessonFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser("root", "root@example.com", "pw"))
+        for n in range(30):
+            Teacher.objects.create(user=User.objects.create_user(f"bulk{n}", first_name="Bulk", last_name=f"No{n}"))
+
+    def test_change_pages_render_only_selected_rows(self):
+        lesson = self.make_lesson(self.math_tt, self.week1)
+        for url in [
+            reverse("myadmin:lessons_lessonrecord_change", args=[lesson.pk]),
+            reverse("myadmin:lessons_timetable_change", args=[self.math_tt.pk]),
+            reverse("myadmin:lessons_lessonrecord_add"),
+        ]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotContains(response, "Bulk No1")
+        self.assertContains(response, "lessons/js/lessonrecord.js")
+
+    def test_teacher_search_is_a_prefix_match_on_names(self):
+        response = self.client.get(reverse("myadmin:autocomplete"), {
+            "app_label": "lessons", "model_name": "lessonrecord", "field_name": "created_by", "term": "No1",
+        })
+        names = sorted(row["text"] for row in response.json()["results"])
+        self.assertEqual(names[:2], ["Bulk No1", "Bulk No10"])
+        self.assertEqual(len(names), 11)
+
+
+class PayrollCsvTests(LessonFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create_superuser("bursar", "bursar@example.com", "pw")
+        self.other = Teacher.objects.create(
+            user=User.objects.create_user("zed", first_name="Zed", last_name="Zulu")
+        )
+        self.make_lesson(self.math_tt, self.week1, "Attended", "Paid", 400)
+        self.make_lesson(self.english_tt, self.week1, "Attended", "Unpaid", 300)
+        covered = self.make_lesson(self.math_tt, self.week2, "Attended", "Unpaid", 250)
+        covered.created_by = self.other
+        covered.save()
+
+    def csv_rows(self, **params):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("payroll_csv"), params)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        body = b"".join(response.streaming_content).decode()
+        return list(csv.reader(io.StringIO(body)))
+
+    def test_groups_by_recording_teacher(self):
+        header, *rows = self.csv_rows()
+        self.assertEqual(header[0], "Teacher ID")
+        by_user = {row[1]: row for row in rows}
+        self.assertEqual(by_user["teacher"][4:], ["2", "2", "700.00", "1", "400.00", "1", "300.00", "300.00"])
+        self.assertEqual(by_user["zed"][4:7], ["1", "1", "250.00"])
+
+    def test_groups_by_timetable_teacher_and_week_range(self):
+        header, *rows = self.csv_rows(by="teacher", week_from=self.week2.id, week_to=self.week2.id)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][1], "teacher")
+        self.assertEqual(rows[0][-1], "250.00")
+
+    def test_week_range_spans_terms_by_date(self):
+        # Week numbers restart each term: next term's week 1 comes after week 2
+        next_week1 = Week.objects.create(
+            number=1, start_date=datetime.date(2025, 5, 5), end_date=datetime.date(2025, 5, 9)
+        )
+        self.make_lesson(self.english_tt, next_week1, "Attended", "Unpaid", 150)
+        header, *rows = self.csv_rows(by="teacher", week_from=self.week2.id, week_to=next_week1.id)
+        self.assertEqual(rows[0][4], "2")
+        self.assertEqual(rows[0][-1], "400.00")
+
+        Term.objects.create(name="Term 2", start_date=datetime.date(2025, 4, 28), end_date=datetime.date(2025, 7, 25))
+        term = Term.objects.create(
+            name="Term 1", start_date=datetime.date(2025, 1, 6), end_date=datetime.date(2025, 4, 4)
+        )
+        header, *rows = self.csv_rows(by="teacher", term=term.id)
+        self.assertEqual(rows[0][4], "3")
+
+    def test_rejects_bad_term_or_week(self):
+        self.client.force_login(self.staff)
+        for params in ({"week_from": "2a"}, {"term": "999"}, {"week_to": "999"}):
+            self.assertEqual(self.client.get(reverse("payroll_csv"), params).status_code, 400, params)
+
+    def test_rejects_unknown_grouping(self):
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse("payroll_csv"), {"by": "week"}).status_code, 400)
+
+
+@skipUnless(connection.vendor == "sqlite", "asserts on SQLite's EXPLAIN QUERY PLAN output")
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed(teachers=6, weeks=3, students=20, payments=2)
+
+    def test_hot_queries_use_the_composite_indexes(self):
+        report = run_cases(repeat=1)
+
+        def plan(name):
+            return " ".join(line for query in report[name]["queries"] for line in query["plan"])
+
+        self.assertIn("teacher_id=? AND day=?", plan("ajax: teacher timetables by day"))
+        self.assertIn("timetable_id=? AND status=? AND payment_status=?", plan("dashboard: lessons by status"))
+        self.assertIn("created_by_id=? AND status=? AND payment_status=?", plan("payroll: one teacher's unpaid lessons"))
+        # Served by the constraint and FK indexes, with no extra index of their own
+        self.assertIn("unique_teacher_week_summary (teacher_id=? AND week_id=?)", plan("dashboard: summary statistics"))
+        self.assertIn("week_id=?", plan("week: lessons of a week"))
+        self.assertNotIn("TEMP B-TREE", plan("payments: student history"))
+        self.assertNotIn("TEMP B-TREE", plan("payments: admin history page"))
+
+
+@skipUnless(connection.vendor == "sqlite", "the SQLite connection profile")
+class SQLiteTuningTests(SimpleTestCase):
+    """
+    The connection profile, exercised on a real file (the test DB is in
+    memory), with SQLITE_JOURNAL_MODE=WAL as a production install sets it.
+    """
+
+    # Worker threads swap their own "default" connection for the file
+    databases = {"default"}
+    workers = 8
+    writes = 25
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.default_settings = {**connection.settings_dict, "NAME": os.path.join(self.tmp.name, "default.sqlite3")}
+        pragmas = {**settings.SQLITE_PRAGMAS, "journal_mode": "WAL", "synchronous": "NORMAL"}
+        self.settings_dict = {
+            **connection.settings_dict,
+            "NAME": os.path.join(self.tmp.name, "stress.sqlite3"),
+            "OPTIONS": {
+                **connection.settings_dict["OPTIONS"],
+                "init_command": ";".join(f"PRAGMA {name}={value}" for name, value in pragmas.items()),
+            },
+        }
+
+    @contextlib.contextmanager
+    def connect(self, alias="stress", settings_dict=None):
+        # Registered per thread, like a request's own connection
+        connections[alias] = DatabaseWrapper(settings_dict or self.settings_dict, alias)
+        try:
+            yield connections[alias]
+        finally:
+            connections[alias].close()
+            del connections[alias]
+
+    def in_threads(self, target, count=1):
+        """
+        ``[target(0), ..., target(count - 1)]``, each call in its own thread
+        whose default database is the file, so models, signals and
+        transaction.atomic() all write to it as they do in a request.
+        """
+        results, errors = {}, []
+
+        def run(number):
+            try:
+                with self.connect("default"):
+                    results[number] = target(number)
+            except Exception as exc:  # reported below with the worker number
+                errors.append((number, exc))
+
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return [results[n] for n in range(count)]
+
+    def build_school(self, _=None):
+        call_command("migrate", verbosity=0)
+        self.term = Term.objects.create(name="Term 1", is_current=True)
+        form = ClassGroup.objects.create(name="Form 1")
+        self.student = Student.objects.create(
+            first_name="Stress", last_name="Test", admission_number="S-001", class_group=form
+        )
+        teacher = Teacher.objects.create(user=User.objects.create_user("stress"))
+        subject = Subject.objects.create(name="Math")
+        self.weeks = [
+            Week.objects.create(
+                number=n, start_date=datetime.date(2025, 1, 6), end_date=datetime.date(2025, 1, 10)
+            )
+            for n in range(1, self.writes + 1)
+        ]
+        # One slot per worker, all in one class: every lesson of a week
+        # lands on the same TeacherWeekSummary row
+        self.timetables = []
+        for n in range(self.workers):
+            timetable = Timetable.objects.create(
+                subject_fk=subject, teacher=teacher, day="Mon",
+                start_time=datetime.time(8 + n, 0), end_time=datetime.time(9 + n, 0),
+            )
+            timetable.class_groups.set([form])
+            self.timetables.append(timetable)
+
+    def pragmas(self, settings_dict):
+        with self.connect(settings_dict=settings_dict) as db, db.cursor() as cursor:
+            pragmas = {}
+            for name in ("journal_mode", "synchronous", "busy_timeout", "temp_store"):
+                cursor.execute(f"PRAGMA {name}")
+                pragmas[name] = cursor.fetchone()[0]
+            self.assertEqual(db.transaction_mode, "IMMEDIATE")
+        return pragmas
+
+    def test_profile_is_applied_on_connect(self):
+        self.assertEqual(
+            self.pragmas(self.settings_dict),
+            {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 20000, "temp_store": 2},
+        )
+
+    @skipUnless(not settings.SQLITE_JOURNAL_MODE, "SQLITE_JOURNAL_MODE is set")
+    def test_wal_is_opt_in(self):
+        # The default profile leaves the file in rollback-journal mode
+        self.assertEqual(
+            self.pragmas(self.default_settings),
+            {"journal_mode": "delete", "synchronous": 2, "busy_timeout": 20000, "temp_store": 2},
+        )
+        self.assertFalse(os.path.exists(self.default_settings["NAME"] + "-wal"))
+
+    def test_concurrent_payment_and_lesson_writes_all_commit(self):
+        self.in_threads(self.build_school)
+        start = threading.Barrier(self.workers, timeout=10)
+
+        def worker(number):
+            start.wait()
+            timetable = self.timetables[number]
+            for week in self.weeks:
+                # Each save reads and writes the running totals in one
+                # transaction; under deferred transactions the upgrade to a
+                # write lock is what raised "database is locked"
+                if number % 2:
+                    StudentPayment.objects.create(student=self.student, term=self.term, amount=1)
+                else:
+                    LessonRecord.objects.create(
+                        timetable=timetable, week=week, created_by=timetable.teacher,
+                        status="Attended", payment_status="Unpaid", amount=1,
+                    )
+
+        self.in_threads(worker, self.workers)
+
+        def totals(_):
+            return (
+                Student.objects.get(pk=self.student.pk).amount_paid,
+                StudentTermBalance.objects.get(student=self.student, term=self.term).paid,
+                StudentPayment.objects.count(),
+                LessonRecord.objects.count(),
+                verify_summaries(),
+            )
+
+        [(amount_paid, term_paid, payments, lessons, drift)] = self.in_threads(totals)
+        writes = self.workers // 2 * self.writes
+        self.assertEqual((payments, lessons), (writes, writes))
+        # No lost updates: every increment saw the one before it
+        self.assertEqual((amount_paid, term_paid), (writes, writes))
+        self.assertEqual(drift, [])
+
+    def test_readers_are_not_blocked_by_an_open_write(self):
+        self.in_threads(self.build_school)
+        writing = threading.Event()
+        done = threading.Event()
+
+        def writer():
+            with self.connect("default"), transaction.atomic():
+                StudentPayment.objects.create(student=self.student, term=self.term, amount=1)
+                writing.set()
+                done.wait(5)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            self.assertTrue(writing.wait(5))
+            began = time.monotonic()
+            # The uncommitted payment and its balance update are not visible
+            [seen] = self.in_threads(lambda _: (
+                StudentPayment.objects.count(),
+                StudentTermBalance.objects.get(student=self.student, term=self.term).paid,
+            ))
+            self.assertEqual(seen, (0, 0))
+            self.assertLess(time.monotonic() - began, 1)
+        finally:
+            done.set()
+            thread.join()
+
+
+class StudentFixturesMixin(LessonFixturesMixin):
+    """Adds a class teacher for Form 1 and a few students per class."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.form1.class_teacher = cls.teacher
+        cls.form1.save()
+        cls.term1 = Term.objects.create(name="Term 1", is_current=True)
+        cls.term2 = Term.objects.create(name="Term 2")
+        cls.students = [
+            Student.objects.create(
+                first_name=f"Student{n}", last_name="One", admission_number=f"F1-{n:03d}", class_group=cls.form1
+            )
+            for n in range(3)
+        ]
+        cls.outsider = Student.objects.create(
+            first_name="Other", last_name="Two", admission_number="F2-001", class_group=cls.form2
+        )
+
+
+class StudentPaymentRecordingTests(StudentFixturesMixin, TestCase):
+    def post_sheet(self, data):
+        self.client.force_login(self.user)
+        return self.client.post(reverse("student_payments"), data)
+
+    def test_sheet_is_recorded_in_constant_queries(self):
+        data = {f"amount_{s.id}": "500" for s in self.students}
+        self.client.force_login(self.user)
+        get_terms()  # warm the term cache
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse("student_payments"), data)
+        writes = [q for q in ctx.captured_queries if q["sql"].startswith(("INSERT", "UPDATE"))]
+        self.assertEqual(len(writes), 3)  # payments, student totals, term balances
+        self.assertEqual(StudentPayment.objects.count(), 3)
+
+        more = Student.objects.bulk_create([
+            Student(first_name=f"Extra{n}", last_name="One", admission_number=f"X-{n}", class_group=self.form1)
+            for n in range(20)
+        ])
+        open_term_balances(self.term1)  # as the CSV import does after its bulk_create
+        data = {f"amount_{s.id}": "100" for s in self.students + more}
+        with CaptureQueriesContext(connection) as bigger:
+            self.client.post(reverse("student_payments"), data)
+        self.assertEqual(len(bigger.captured_queries), len(ctx.captured_queries))
+
+    def test_payments_add_to_the_running_total(self):
+        student = self.students[0]
+        self.post_sheet({f"amount_{student.id}": "500"})
+        self.post_sheet({f"amount_{student.id}": "250.50"})
+        student.refresh_from_db()
+        self.assertEqual(student.amount_paid, Decimal("750.50"))
+        self.assertEqual(student.payments.count(), 2)
+        self.assertEqual(student.term_balances.get(term=self.term1).paid, Decimal("750.50"))
+
+    def test_nothing_is_recorded_without_a_current_term(self):
+        Term.objects.filter(pk=self.term1.pk).update(is_current=False)
+        cache.clear()
+        response = self.post_sheet({f"amount_{self.students[0].id}": "500"})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(StudentPayment.objects.exists())
+
+    def test_junk_and_other_classes_are_ignored(self):
+        self.post_sheet({
+            f"amount_{self.students[0].id}": "abc",
+            f"amount_{self.students[1].id}": "-5",
+            f"amount_{self.students[2].id}": "Infinity",
+            f"amount_{self.outsider.id}": "100",
+        })
+        self.assertFalse(StudentPayment.objects.exists())
+        self.outsider.refresh_from_db()
+        self.assertEqual(self.outsider.amount_paid, 0)
+
+
+class StudentPaymentStatisticsTests(StudentFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        first, second, third = self.students
+        Student.objects.filter(pk=first.pk).update(amount_paid=1500)
+        Student.objects.filter(pk=second.pk).update(amount_paid=800, term_fee=800)
+        Student.objects.filter(pk=third.pk).update(amount_paid=200, term_fee=2000)
+        for student, fee, paid in [(first, 1500, 1500), (second, 800, 800), (third, 2000, 200)]:
+            StudentTermBalance.objects.filter(student=student, term=self.term1).update(fee=fee, paid=paid)
+
+    def test_statistics_use_each_students_fee(self):
+        with self.assertNumQueries(1):
+            stats = student_fee_statistics(
+                StudentTermBalance.objects.filter(term=self.term1, student__class_group=self.form1)
+            )
+        self.assertEqual(stats["total_students"], 3)
+        self.assertEqual(stats["fully_paid"], 2)
+        self.assertEqual(stats["partial_paid"], 1)
+        self.assertEqual(stats["total_paid"], Decimal("2500"))
+        self.assertEqual(stats["total_unpaid"], Decimal("1800"))
+
+    def test_page_evaluates_balances_once(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("student_payments"))
+        balance_queries = [q for q in ctx.captured_queries if '"lessons_studenttermbalance"."paid"' in q["sql"]]
+        self.assertEqual(len(balance_queries), 2)  # the aggregate and the rendered list
+        self.assertEqual(response.context["fully_paid"], 2)
+        self.assertEqual(response.context["total_unpaid"], Decimal("1800"))
+        self.assertContains(response, "F1-002")
+
+    def test_showing_the_sheet_writes_nothing(self):
+        StudentTermBalance.objects.filter(student=self.students[2]).delete()
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("student_payments"))
+        self.assertFalse([q for q in ctx.captured_queries if q["sql"].startswith(("INSERT", "UPDATE"))])
+        self.assertEqual(response.context["total_students"], 2)
+
+
+class AdminPaymentsTests(StudentFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser("bursar", "bursar@example.com", "pw"))
+        StudentPayment.objects.create(student=self.students[0], amount=Decimal("1500"), term=self.term1)
+        StudentPayment.objects.create(student=self.students[1], amount=Decimal("400"), term=self.term1)
+
+    def get(self, **params):
+        return self.client.get(reverse("admin_payments"), params)
+
+    def test_query_count_does_not_grow_with_students(self):
+        self.get()  # warm the class cache
+        with CaptureQueriesContext(connection) as ctx:
+            self.get()
+        baseline = len(ctx.captured_queries)
+
+        Student.objects.bulk_create(
+            Student(first_name=f"Bulk{n}", last_name="Three", admission_number=f"B-{n:03d}", class_group=self.form2)
+            for n in range(120)
+        )
+        open_term_balances(self.term1)  # as the CSV import does after its bulk_create
+        with self.assertNumQueries(baseline):
+            response = self.get()
+        self.assertEqual(response.context["total_students"], 124)
+        self.assertEqual(len(response.context["balances"]), 50)
+
+    def test_totals_and_class_breakdown(self):
+        response = self.get()
+        self.assertEqual(response.context["fully_paid"], 1)
+        self.assertEqual(response.context["partial"], 1)
+        self.assertEqual(response.context["unpaid"], 2)
+        by_class = {stat.name: stat for stat in response.context["class_stats"]}
+        self.assertEqual(by_class[self.form1.name].total_students, 3)
+        self.assertEqual(by_class[self.form1.name].total_unpaid, Decimal("2600"))
+        self.assertEqual(by_class[self.form2.name].total_unpaid, Decimal("1500"))
+
+    def test_debt_is_judged_per_term(self):
+        # A large payment last term does not settle this term's fee
+        StudentPayment.objects.create(student=self.students[2], amount=Decimal("5000"), term=self.term2)
+        response = self.get()
+        self.assertEqual(response.context["term"], self.term1)
+        self.assertEqual(response.context["unpaid"], 2)
+        self.assertEqual(response.context["total_paid"], Decimal("1900"))
+
+        response = self.get(term=str(self.term2.id))
+        self.assertEqual(response.context["total_students"], 1)
+        self.assertEqual(response.context["total_paid"], Decimal("5000"))
+        by_class = {stat.name: stat for stat in response.context["class_stats"]}
+        self.assertEqual(by_class[self.form2.name].total_students, 0)
+
+    def test_sorting_and_class_filter(self):
+        response = self.get(sort="-balance", **{"class": str(self.form1.id)})
+        self.assertEqual(
+            [row.student for row in response.context["balances"]],
+            [self.students[2], self.students[1], self.students[0]],
+        )
+        self.assertEqual(response.context["total_students"], 3)
+
+        response = self.get(sort="password")
+        self.assertEqual(response.context["sort"], "name")
+
+
+@override_settings(REPORTING_DATABASE="default")  # stands in for the replica alias
+class ReplicaRoutingTests(StudentFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser("bursar", "bursar@example.com", "pw"))
+        self.routed = []
+        original = ReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            alias = original(router, model, **hints)
+            self.routed.append(alias)
+            return alias
+
+        patcher = mock.patch.object(ReplicaRouter, "db_for_read", spy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_payments(self):
+        self.routed.clear()
+        response = self.client.get(reverse("admin_payments"))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_only_reporting_reads_are_routed(self):
+        router = ReplicaRouter()
+        # A fresh context: force_login above wrote the session in this one
+        context = contextvars.Context()
+        self.assertIsNone(context.run(router.db_for_read, Student))
+        self.assertEqual(context.run(lambda: reporting_reads()(router.db_for_read)(Student)), "default")
+
+        response = self.get_payments()
+        self.assertIn("default", self.routed)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_own_write_pins_the_browser_to_the_primary(self):
+        response = self.client.post(
+            reverse("lesson_transition"), {"field": "status", "value": "Attended", "status": "Pending"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        self.get_payments()
+        self.assertTrue(self.routed)
+        self.assertEqual(set(self.routed), {None})
+
+        del self.client.cookies[PIN_COOKIE]  # the pin has expired
+        self.get_payments()
+        self.assertIn("default", self.routed)
+
+    def test_reads_after_a_write_in_the_same_request_stay_on_the_primary(self):
+        def write_then_read():
+            with reporting_reads():
+                Term.objects.filter(pk=self.term2.pk).update(name="Term 2b")
+                return ReplicaRouter().db_for_read(Term)
+
+        self.assertIsNone(contextvars.Context().run(write_then_read))
+
+
+class PaymentsHistoryTests(StudentFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser("bursar", "bursar@example.com", "pw"))
+        for n, student in enumerate(self.students + [self.outsider]):
+            payment = StudentPayment.objects.create(
+                student=student, amount=Decimal("100"), term=self.term1 if n % 2 else self.term2, recorded_by=self.teacher
+            )
+            StudentPayment.objects.filter(pk=payment.pk).update(date_paid=datetime.date(2025, 1, 10 + n))
+
+    def get(self, **params):
+        return self.client.get(reverse("myadmin:admin_payments"), params)
+
+    def test_keyset_pages_cover_history_without_n_plus_one(self):
+        with mock.patch.object(ClassGroupAdmin, "payments_page_size", 3):
+            with CaptureQueriesContext(connection) as ctx:
+                first = self.get()
+            self.assertEqual(  # the totals and the page; terms come from the cache
+                len([q for q in ctx.captured_queries if 'FROM "lessons_studentpayment"' in q["sql"]]), 2
+            )
+            cursor = re.search(r"cursor=([^&\"]+)", first.context["next_query"]).group(1)
+            second = self.get(cursor=cursor.replace("%3A", ":"))
+
+        seen = [p.student for p in first.context["payments"]] + [p.student for p in second.context["payments"]]
+        self.assertEqual(seen, [self.outsider, *reversed(self.students)])
+        self.assertEqual(second.context["next_query"], "")
+        self.assertContains(first, "F2-001")
+
+    def test_filters_by_class_term_and_dates(self):
+        response = self.get(class_group=str(self.form1.id), term=str(self.term2.id), date_from="2025-01-10", date_to="bad")
+        self.assertEqual([p.student for p in response.context["payments"]], [self.students[2], self.students[0]])
+        self.assertEqual(response.context["payment_count"], 2)
+        self.assertEqual(response.context["total_amount"], Decimal("200"))
+        self.assertNotIn("date_to", response.context["filters"])
+
+
+class StudentImportTests(StudentFixturesMixin, TestCase):
+    def upload(self, text, user=None):
+        self.client.force_login(user or self.user)
+        upload = SimpleUploadedFile("intake.csv", text.encode("utf-8"), content_type="text/csv")
+        return self.client.post(reverse("import_students"), {"csv_file": upload})
+
+    def test_large_intake_in_constant_queries(self):
+        rows = "".join(f"N-{n:04d},First{n},Last,{self.form2.name}\n" for n in range(1200))
+        staff = User.objects.create_superuser("bursar", "bursar@example.com", "pw")
+        get_class_groups()  # warm the class cache
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.upload("Admission Number,First Name,Last Name,Class Group\n" + rows, user=staff)
+        self.assertEqual(response.context["created"], 1200)
+        self.assertEqual(Student.objects.filter(class_group=self.form2).count(), 1201)
+        # A few chunked lookups and batched INSERTs (SQLite caps the
+        # parameters per statement), not a query or two per student
+        student_queries = [q for q in ctx.captured_queries if '"lessons_student"' in q["sql"]]
+        self.assertLess(len(student_queries), 15)
+
+    def test_bad_rows_are_reported_and_nothing_is_saved(self):
+        response = self.upload(
+            "admission_number,first_name,last_name,class_group,term_fee\n"
+            "N-1,Ann,Ok,,\n"
+            "F1-000,Dup,Existing,,\n"
+            "N-1,Dup,InFile,,\n"
+            "N-2,,Missing,,abc\n"
+            f"N-3,Wrong,Class,{self.form2.name},\n"
+        )
+        self.assertEqual(response.context["created"], 0)
+        self.assertEqual(response.context["errors"], [
+            (3, "admission number F1-000 already exists"),
+            (4, "admission number N-1 is repeated (first on line 2)"),
+            (5, "first_name is required"),
+            (5, "term_fee 'abc' is not a valid amount"),
+            (6, f"class '{self.form2.name}' is not your class"),
+        ])
+        self.assertFalse(Student.objects.filter(admission_number="N-1").exists())
+
+    def test_class_teacher_rows_go_into_their_class(self):
+        response = self.upload("admission_number,first_name,last_name,term_fee\nN-9,New,Pupil,1200\n")
+        self.assertEqual(response.context["created"], 1)
+        student = Student.objects.get(admission_number="N-9")
+        self.assertEqual((student.class_group, student.term_fee), (self.form1, Decimal("1200")))
+
+    def test_missing_column_is_a_form_error(self):
+        response = self.upload("admission_number,first_name\nN-1,Ann\n")
+        self.assertFormError(response.context["form"], "csv_file", "Missing column(s): last_name.")
+
+
+class StudentLedgerTests(StudentFixturesMixin, TestCase):
+    def paid(self, student):
+        student.refresh_from_db()
+        return student.amount_paid
+
+    def test_payment_writes_move_the_running_total(self):
+        student = self.students[0]
+        payment = StudentPayment.objects.create(student=student, amount=Decimal("400"), term=self.term1)
+        self.assertEqual(self.paid(student), Decimal("400"))
+        self.assertEqual(student.term_balances.get(term=self.term1).balance, Decimal("1100"))
+
+        payment.amount = Decimal("600")
+        payment.save()
+        self.assertEqual(self.paid(student), Decimal("600"))
+
+        payment.student = self.students[1]
+        payment.save()
+        self.assertEqual(self.paid(student), 0)
+        self.assertEqual(self.paid(self.students[1]), Decimal("600"))
+
+        payment.delete()
+        self.assertEqual(self.paid(self.students[1]), 0)
+
+    def test_balance_is_filterable_and_sortable_in_sql(self):
+        StudentPayment.objects.create(student=self.students[0], amount=Decimal("1500"), term=self.term1)
+        StudentPayment.objects.create(student=self.students[1], amount=Decimal("100"), term=self.term1)
+        owing = StudentTermBalance.objects.filter(
+            term=self.term1, student__class_group=self.form1, balance__gt=0
+        ).order_by("-balance")
+        self.assertEqual([row.student for row in owing], [self.students[2], self.students[1]])
+
+    def test_reconcile_repairs_drift_in_bulk(self):
+        StudentPayment.objects.create(student=self.students[0], amount=Decimal("300"), term=self.term1)
+        Student.objects.filter(pk=self.students[0].pk).update(amount_paid=999)
+        Student.objects.filter(pk=self.students[1].pk).update(amount_paid=50)
+
+        with self.assertRaises(CommandError):
+            call_command("reconcile_balances", stdout=io.StringIO())
+        self.assertEqual(
+            reconcile_balances(),
+            [(self.students[0].id, Decimal("999"), Decimal("300")), (self.students[1].id, Decimal("50"), 0)],
+        )
+
+        call_command("reconcile_balances", "--fix", stdout=io.StringIO())
+        self.assertEqual(reconcile_balances(), [])
+        self.assertEqual(self.paid(self.students[0]), Decimal("300"))
+        self.assertEqual(self.paid(self.students[1]), 0)
+
+    def test_students_and_classes_with_payments_can_be_deleted(self):
+        StudentPayment.objects.create(student=self.students[0], amount=Decimal("300"), term=self.term1)
+        StudentPayment.objects.create(student=self.outsider, amount=Decimal("200"), term=self.term2)
+        deleted = [self.students[0].id, self.outsider.id]
+
+        self.students[0].delete()
+        self.form2.delete()
+        connection.check_constraints()  # FK checks are deferred to a commit the test never makes
+        self.assertFalse(StudentPayment.objects.exists())
+        self.assertFalse(StudentTermBalance.objects.filter(student_id__in=deleted).exists())
+
+    def test_payment_and_totals_commit_together(self):
+        student = self.students[0]
+        with mock.patch("lessons.signals.adjust_term_paid", side_effect=DatabaseError("lost")):
+            with self.assertRaises(DatabaseError):
+                StudentPayment.objects.create(student=student, amount=Decimal("400"), term=self.term1)
+        self.assertFalse(StudentPayment.objects.exists())
+        self.assertEqual(self.paid(student), 0)
+
+        payment = StudentPayment.objects.create(student=student, amount=Decimal("400"), term=self.term1)
+        with mock.patch("lessons.signals.adjust_term_paid", side_effect=DatabaseError("lost")):
+            with self.assertRaises(DatabaseError):
+                payment.delete()
+        self.assertTrue(StudentPayment.objects.filter(pk=payment.pk).exists())
+        self.assertEqual(self.paid(student), Decimal("400"))
+
+    def test_migration_reconciles_drifted_totals(self):
+        student = self.students[0]
+        StudentPayment.objects.create(student=student, amount=Decimal("300"), term=self.term1)
+        Student.objects.filter(pk=student.pk).update(amount_paid=999)
+        StudentTermBalance.objects.filter(student=student).delete()
+
+        migration = importlib.import_module("lessons.migrations.0022_reconcile_payment_totals")
+        migration.reconcile_payment_totals(django_apps, None)
+        self.assertEqual(reconcile_balances(), [])
+        self.assertEqual(reconcile_term_balances(), [])
+        self.assertEqual(StudentTermBalance.objects.get(student=student, term=self.term1).paid, Decimal("300"))
+
+    def test_admin_debt_filter(self):
+        StudentPayment.objects.create(student=self.students[0], amount=Decimal("1500"), term=self.term1)
+        # Paid up last term, still owing this one
+        StudentPayment.objects.create(student=self.students[1], amount=Decimal("1500"), term=self.term2)
+        self.client.force_login(User.objects.create_superuser("bursar", "bursar@example.com", "pw"))
+        response = self.client.get("/admin/lessons/student/", {"debt": "owing", "o": "7"})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "F1-000")
+        self.assertContains(response, "F1-001")
+
+    def test_add_student_ajax_reports_balance(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse("add_student_ajax"), {
+            "first_name": "New", "last_name": "Kid", "admission_number": "F1-999", "class_group": self.form1.id,
+        })
+        self.assertEqual(response.json()["balance"], "1500.00")
+
+
+class TermBalanceTests(StudentFixturesMixin, TestCase):
+    def balance(self, student, term):
+        return StudentTermBalance.objects.get(student=student, term=term)
+
+    def test_current_term_balances_are_opened_for_new_students(self):
+        ClassTermFee.objects.create(class_group=self.form1, term=self.term1, amount=Decimal("1800"))
+        student = Student.objects.create(
+            first_name="New", last_name="Pupil", admission_number="F1-100", class_group=self.form1
+        )
+        self.assertEqual(self.balance(student, self.term1).fee, Decimal("1800"))
+        self.assertEqual(self.balance(self.outsider, self.term1).fee, Decimal("1500"))  # no schedule: own fee
+        self.assertFalse(StudentTermBalance.objects.filter(term=self.term2).exists())
+
+    def test_class_fee_opens_and_reprices_a_term(self):
+        fee = ClassTermFee.objects.create(class_group=self.form1, term=self.term2, amount=Decimal("1200"))
+        self.assertEqual(
+            sorted(StudentTermBalance.objects.filter(term=self.term2).values_list("student_id", "fee")),
+            [(student.id, Decimal("1200")) for student in self.students],
+        )
+        fee.amount = Decimal("1300")
+        fee.save()
+        self.assertEqual(self.balance(self.students[0], self.term2).fee, Decimal("1300"))
+        fee.delete()
+        self.assertEqual(self.balance(self.students[0], self.term2).fee, Decimal("1500"))
+
+    def test_editing_a_students_fee_or_class_reprices_the_current_term(self):
+        student = self.students[0]
+        StudentPayment.objects.create(student=student, amount=Decimal("400"), term=self.term2)
+        student.term_fee = Decimal("900")
+        student.save()
+        self.assertEqual(self.balance(student, self.term1).fee, Decimal("900"))
+        self.assertEqual(self.balance(student, self.term2).fee, Decimal("1500"))  # an earlier charge stands
+
+        ClassTermFee.objects.create(class_group=self.form2, term=self.term1, amount=Decimal("2000"))
+        student.class_group = self.form2
+        student.save()
+        self.assertEqual(self.balance(student, self.term1).fee, Decimal("2000"))  # the schedule wins
+
+    def test_payments_use_the_current_term_from_the_database(self):
+        get_terms()  # this worker caches Term 1 as current
+        Term.objects.filter(pk=self.term1.pk).update(is_current=False)
+        Term.objects.filter(pk=self.term2.pk).update(is_current=True)
+        record_class_payments(self.form1, {self.students[0].id: Decimal("100")})
+        self.assertEqual(StudentPayment.objects.get().term, self.term2)
+
+    def test_payment_writes_move_the_term_total(self):
+        student = self.students[0]
+        payment = StudentPayment.objects.create(student=student, amount=Decimal("400"), term=self.term1)
+        self.assertEqual(self.balance(student, self.term1).balance, Decimal("1100"))
+
+        payment.term = self.term2  # no balance row yet for Term 2: opened on demand
+        payment.save()
+        self.assertEqual(self.balance(student, self.term1).paid, 0)
+        self.assertEqual(self.balance(student, self.term2).paid, Decimal("400"))
+
+        payment.delete()
+        self.assertEqual(self.balance(student, self.term2).paid, 0)
+
+    def test_debtors_for_a_term(self):
+        StudentPayment.objects.create(student=self.students[0], amount=Decimal("1500"), term=self.term1)
+        StudentPayment.objects.create(student=self.students[1], amount=Decimal("1000"), term=self.term1)
+        debtors = [row.student for row in term_debtors(self.term1)]
+        self.assertEqual(debtors[-1], self.students[1])
+        self.assertNotIn(self.students[0], debtors)
+        self.assertEqual(len(debtors), 3)
+
+    def test_making_a_term_current_retires_the_previous_one(self):
+        self.term2.is_current = True
+        self.term2.save()
+        self.assertEqual(list(Term.objects.filter(is_current=True)), [self.term2])
+        self.assertEqual(StudentTermBalance.objects.filter(term=self.term2).count(), 4)
+
+    def test_reconcile_repairs_term_drift_and_missing_rows(self):
+        StudentPayment.objects.create(student=self.students[0], amount=Decimal("300"), term=self.term1)
+        StudentPayment.objects.create(student=self.students[1], amount=Decimal("50"), term=self.term2)
+        StudentTermBalance.objects.filter(student=self.students[0]).update(paid=999)
+        StudentTermBalance.objects.filter(term=self.term2).delete()
+
+        self.assertEqual(reconcile_term_balances(), [
+            (self.students[0].id, self.term1.id, Decimal("999"), Decimal("300")),
+            (self.students[1].id, self.term2.id, None, Decimal("50")),
+        ])
+        reconcile_term_balances(fix=True)
+        self.assertEqual(reconcile_term_balances(), [])
+        self.assertEqual(self.balance(self.students[1], self.term2).paid, Decimal("50"))
 
-# Create your tests here.
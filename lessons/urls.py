@@ -16,10 +16,13 @@ urlpatterns = [
     path("ajax/teacher_subjects/", views.ajax_teacher_subjects, name="ajax_teacher_subjects"),
     path("filter_timetables/", views.get_timetables, name="filter_timetables"),
      path('student-payments/', views.student_payments, name='student_payments'),
+    path('students/import/', views.import_students_csv, name='import_students'),
     path('add-student-ajax/', views.add_student_ajax, name='add_student_ajax'),
     path('edit-student-ajax/<int:student_id>/', views.edit_student_ajax, name='edit_student_ajax'),
     path('delete-student-ajax/<int:student_id>/', views.delete_student_ajax, name='delete_student_ajax'),
     path('admin-payments/', views.admin_payments, name='admin_payments'),
+    path('staff/lessons/transition/', views.lesson_transition, name='lesson_transition'),
+    path('staff/payroll.csv', views.payroll_csv, name='payroll_csv'),
 ]
 
 if settings.DEBUG:
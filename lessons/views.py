@@ -2,12 +2,19 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+from django.views.decorators.http import condition, require_POST
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.cache import caches
+from django.core.paginator import Paginator
 from django.conf import settings
+from django.template.loader import render_to_string
 
-from django.db.models import Sum, F, Count, ExpressionWrapper, FloatField
+from django.db.models import Sum, F, Q, Count, ExpressionWrapper, FloatField
 from decimal import Decimal, InvalidOperation
+import contextlib
+import csv
 import os
 
 from .models import (
@@ -19,11 +26,55 @@ from .models import (
     Subject,
     Student,
     StudentPayment,
+    StudentTermBalance,
+    Term,
 )
+from .availability import SlotTaken, available_timetables, schedule_lesson
+from .etags import dashboard_cache_key, own_timetables_etag, timetables_etag
+from .fees import (
+    class_fee_statistics,
+    parse_payment_amounts,
+    record_class_payments,
+    sort_students,
+    student_fee_statistics,
+)
+from .payroll import (
+    LESSON_FILTERS,
+    PAYROLL_COLUMNS,
+    PAYROLL_GROUPINGS,
+    apply_transition,
+    filter_lessons,
+    payroll_rows,
+)
+from .reference import get_class_groups, get_current_term, get_subjects, get_teachers, get_terms, get_weeks
+from .replicas import reporting_reads
+from .students import OPTIONAL_COLUMNS, REQUIRED_COLUMNS, import_students
+from .summaries import lesson_aggregates, summary_statistics
+
+
+LESSONS_PAGE_SIZE = 25
+ADMIN_PAYMENTS_PAGE_SIZE = 50
+# Sortable columns of the admin payments student table (keys of fees.STUDENT_SORTS)
+ADMIN_PAYMENTS_COLUMNS = [
+    ("name", "Name"),
+    ("admission", "Admission No."),
+    ("class", "Class"),
+    ("term_fee", "Fee"),
+    ("paid", "Amount Paid"),
+    ("balance", "Balance"),
+]
+PAYROLL_CHUNK_SIZE = 2000
+
+
+def _optional_id(value):
+    """A query-string id as an int, None when absent; ValueError if not numeric."""
+    if not value:
+        return None
+    if not value.isdigit():
+        raise ValueError(f"{value!r} is not an id")
+    return int(value)
 
 
-TERM_FEE = 1500
-
 def home(request):
     return render(request, "lessons/home.html")
 
@@ -51,35 +102,97 @@ def debug_load_timetables(request):
 # ---------- AJAX: timetables by teacher + week (used in admin JS) ----------
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=timetables_etag)
 def get_timetables(request):
-    teacher_id = request.GET.get("teacher")
-    week_id = request.GET.get("week")
+    try:
+        teacher_id = _optional_id(request.GET.get("teacher"))
+        week_id = _optional_id(request.GET.get("week"))
+    except ValueError:
+        return JsonResponse({"error": "teacher and week must be numeric ids."}, status=400)
 
     qs = Timetable.objects.none()
     if teacher_id:
-        qs = Timetable.objects.filter(teacher_id=teacher_id)
-        if week_id:
-            used_ids = LessonRecord.objects.filter(
-                week_id=week_id,
-                timetable__in=qs
-            ).values_list("timetable_id", flat=True)
-            qs = qs.exclude(id__in=used_ids)
+        qs = available_timetables(teacher_id, week_id).select_related(
+            "subject_fk"
+        ).prefetch_related("class_groups")
 
     data = [
         {
             "id": t.id,
-            "display": f"{t.subject} - {t.day} {t.start_time.strftime('%H:%M')} "
+            "display": f"{t.subject_fk.name if t.subject_fk else 'Unnamed'} - {t.day} {t.start_time.strftime('%H:%M')} "
                        f"({', '.join(c.name for c in t.class_groups.all())})"
         }
         for t in qs
     ]
     return JsonResponse({"timetables": data})
 
+# ---------- Lesson statistics ----------
+def lesson_statistics(lessons):
+    """
+    Return every dashboard counter and amount total for ``lessons``
+    using a single conditional-aggregation query.
+    """
+    stats = lessons.aggregate(**lesson_aggregates())
+    stats["total_paid_amount"] = stats["total_paid_amount"] or 0
+    stats["total_unpaid_amount"] = stats["total_unpaid_amount"] or 0
+    return stats
+
+
+# ---------- Lesson keyset pagination ----------
+def paginate_lessons(lessons, cursor=None, page_size=LESSONS_PAGE_SIZE):
+    """
+    Return ``(page, next_cursor)`` for ``lessons`` ordered newest week first.
+
+    The cursor is ``"<week_id>:<id>"`` of the last row already shown, so each
+    page is a bounded index range scan no matter how deep the teacher pages.
+    """
+    lessons = lessons.select_related(
+        "week", "timetable__subject_fk"
+    ).prefetch_related(
+        "timetable__class_groups"
+    ).order_by("-week_id", "-id")
+
+    if cursor:
+        try:
+            week_id, lesson_id = (int(part) for part in cursor.split(":"))
+        except ValueError:
+            week_id = lesson_id = None
+        if week_id is not None:
+            lessons = lessons.filter(
+                Q(week_id__lt=week_id) | Q(week_id=week_id, id__lt=lesson_id)
+            )
+
+    page = list(lessons[:page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        last = page[-1]
+        next_cursor = f"{last.week_id}:{last.id}"
+    return page, next_cursor
+
+
 # ---------- Teacher dashboard ----------
+def _dashboard_cache():
+    return caches[getattr(settings, "DASHBOARD_CACHE_ALIAS", "default")]
+
+
 @login_required
 def teacher_dashboard(request):
+    # Repeat visits are answered from the cache without touching the
+    # database; the teacher id comes from the cached teacher list
+    cache_key = None
+    if request.headers.get("x-requested-with") != "XMLHttpRequest":
+        teacher_id = next((t.id for t in get_teachers() if t.user_id == request.user.id), None)
+        if teacher_id:
+            cache_key = dashboard_cache_key(request, teacher_id)
+    if cache_key:
+        content = _dashboard_cache().get(cache_key)
+        if content is not None:
+            return HttpResponse(content)
+
     try:
-        teacher = Teacher.objects.get(user=request.user)
+        teacher = Teacher.objects.select_related("user").get(user=request.user)
     except Teacher.DoesNotExist:
         return redirect('home')
 
@@ -99,35 +212,32 @@ def teacher_dashboard(request):
     if selected_class:
         lessons = lessons.filter(timetable__class_groups__id=selected_class)
     if selected_subject:
-        lessons = lessons.filter(timetable__subject__id=selected_subject)
+        lessons = lessons.filter(timetable__subject_fk__id=selected_subject)
 
-    # Statistics
-    total_lessons = lessons.count()
-    attended = lessons.filter(status__iexact="Attended").count()
-    not_attended = lessons.filter(status__iexact="Not Attended").count()
-    pending = lessons.filter(status__iexact="Pending").count()
+    page, next_cursor = paginate_lessons(lessons, request.GET.get("cursor"))
 
-    paid = lessons.filter(payment_status__iexact="Paid").count()
-    unpaid = lessons.filter(payment_status__iexact="Unpaid").count()
+    # "Load more" requests only need the next slice of table rows
+    if request.headers.get("x-requested-with") == "XMLHttpRequest":
+        html = render_to_string("lessons/_lesson_rows.html", {"lessons": page, "append": True}, request=request)
+        return JsonResponse({"html": html, "next_cursor": next_cursor})
 
-    total_paid_amount = lessons.filter(payment_status__iexact="Paid").aggregate(
-        Sum("amount")
-    )["amount__sum"] or 0
+    # Statistics, read from the pre-summed TeacherWeekSummary rollup. A page
+    # that will be cached reads the primary: numbers from a lagging replica
+    # would be stored under the new teacher version and outlive the write.
+    with contextlib.nullcontext() if cache_key else reporting_reads():
+        stats = summary_statistics(teacher, selected_week, selected_class, selected_subject)
 
-    total_unpaid_amount = lessons.filter(payment_status__iexact="Unpaid").aggregate(
-        Sum("amount")
-    )["amount__sum"] or 0
-
-    # Lists for filters
-    weeks = Week.objects.all()
-    classes = ClassGroup.objects.all()
-    subjects = Subject.objects.all()
+    # Lists for filters (served from the reference-data cache)
+    weeks = get_weeks()
+    classes = get_class_groups()
+    subjects = get_subjects()
     timetables = Timetable.objects.filter(teacher=teacher)
     other_teachers = Teacher.objects.exclude(id=teacher.id)
 
     context = {
         "teacher": teacher,
-        "lessons": lessons,
+        "lessons": page,
+        "next_cursor": next_cursor,
         "weeks": weeks,
         "classes": classes,
         "subjects": subjects,
@@ -136,17 +246,13 @@ def teacher_dashboard(request):
         "selected_week": selected_week,
         "selected_class": selected_class,
         "selected_subject": selected_subject,
-        "total_lessons": total_lessons,
-        "attended": attended,
-        "not_attended": not_attended,
-        "pending": pending,
-        "paid": paid,
-        "unpaid": unpaid,
-        "total_paid_amount": total_paid_amount,
-        "total_unpaid_amount": total_unpaid_amount,
+        **stats,
     }
 
-    return render(request, "lessons/teacher_dashboard.html", context)
+    response = render(request, "lessons/teacher_dashboard.html", context)
+    if cache_key:
+        _dashboard_cache().set(cache_key, response.content, getattr(settings, "DASHBOARD_CACHE_TIMEOUT", 3600))
+    return response
 
 # ---------- Update profile picture ----------
 @login_required
@@ -184,7 +290,7 @@ def mark_attended(request, lesson_id):
 
 
 # ---------- Teacher add lesson ----------
-from .forms import TeacherLessonForm
+from .forms import StudentImportForm, TeacherLessonForm
 
 @login_required
 def add_lesson_teacher(request):
@@ -196,14 +302,11 @@ def add_lesson_teacher(request):
             lesson.created_by = teacher
             lesson.status = "Pending"
             lesson.payment_status = "Unpaid"
-            # ❌ remove lesson.amount = 0
-            exists = LessonRecord.objects.filter(
-                timetable=lesson.timetable, week=lesson.week
-            ).exists()
-            if exists:
-                form.add_error(None, "This lesson has already been scheduled for this week.")
+            try:
+                schedule_lesson(lesson)
+            except SlotTaken as exc:
+                form.add_error(None, str(exc))
                 return render(request, "lessons/add_lesson_teacher.html", {"form": form})
-            lesson.save()
             return redirect("teacher_dashboard")
     else:
         form = TeacherLessonForm(teacher=teacher)
@@ -213,13 +316,17 @@ def add_lesson_teacher(request):
 
 # ---------- Teacher AJAX to list own timetables ----------
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=own_timetables_etag)
 def ajax_teacher_subjects(request):
     teacher = get_object_or_404(Teacher, user=request.user)
-    timetables = Timetable.objects.filter(teacher=teacher)
+    timetables = Timetable.objects.filter(teacher=teacher).select_related(
+        'subject_fk'
+    ).prefetch_related('class_groups')
     subjects = [
         {
             'id': t.id,
-            'subject': t.subject,
+            'subject': t.subject_fk.name if t.subject_fk else 'Unnamed',
             'class_groups': ', '.join([c.name for c in t.class_groups.all()])
         }
         for t in timetables
@@ -228,17 +335,36 @@ def ajax_teacher_subjects(request):
  # ---------- AJAX: load timetables (simple dropdown for admin/teacher) ----------
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=timetables_etag)
 def load_timetables(request):
-    teacher_id = request.GET.get("teacher")
-    timetables = Timetable.objects.filter(teacher_id=teacher_id) if teacher_id else []
+    """
+    Free timetables of ``?teacher=`` in ``?week=``, for the lesson forms.
+
+    ``ignore_lesson=<id>`` lists that lesson's own slot as free, for its edit form.
+    """
+    try:
+        teacher_id = _optional_id(request.GET.get("teacher"))
+        week_id = _optional_id(request.GET.get("week"))
+        ignore_lesson_id = _optional_id(request.GET.get("ignore_lesson"))
+    except ValueError:
+        return JsonResponse({"error": "teacher, week and ignore_lesson must be numeric ids."}, status=400)
+    timetables = (
+        available_timetables(teacher_id, week_id, ignore_lesson_id)
+        .select_related("subject_fk")
+        .prefetch_related("class_groups")
+        if teacher_id else []
+    )
 
     data = [
         {
             "id": t.id,
+            "name": str(t),
             "subject": t.subject_fk.name if t.subject_fk else "Unnamed",
             "day": t.get_day_display(),
             "start_time": t.start_time.strftime("%H:%M"),
             "end_time": t.end_time.strftime("%H:%M"),
+            "class_groups": [c.name for c in t.class_groups.all()],
         }
         for t in timetables
     ]
@@ -253,60 +379,42 @@ def student_payments(request):
     if not hasattr(teacher, "main_class") or teacher.main_class is None:
         return redirect('teacher_dashboard')
 
-    students = Student.objects.filter(class_group=teacher.main_class)
-
-    # Compute statistics
-    total_students = students.count()
-    total_fee_per_student = Decimal('1500.00')
-    total_paid = sum(s.amount_paid for s in students)
-    total_unpaid = total_students * total_fee_per_student - total_paid
-    fully_paid = sum(1 for s in students if s.amount_paid >= total_fee_per_student)
-    partial_paid = sum(1 for s in students if 0 < s.amount_paid < total_fee_per_student)
-
-    # Record payments
+    # Record payments: one transaction, a fixed number of queries per sheet.
+    # Payments are taken for the current term, read from the database here
+    # since this worker's cached copy may predate a term change.
     if request.method == "POST":
-        for student in students:
-            amount_str = request.POST.get(f"amount_{student.id}")
-            if amount_str:
-                try:
-                    amount = Decimal(amount_str)
-                    if amount > 0:
-                        StudentPayment.objects.create(
-                            student=student,
-                            amount=amount,
-                            recorded_by=teacher,
-                            term="Term 1"
-                        )
-                        student.amount_paid = amount
-                        student.save()
-                except (InvalidOperation, ValueError):
-                    continue
+        term = Term.current()
+        if term is not None:
+            amounts = parse_payment_amounts(request.POST)
+            record_class_payments(teacher.main_class, amounts, recorded_by=teacher, term=term)
         return redirect(request.path)
 
-    context = {
-        "students": students,
-        "total_students": total_students,
-        "total_paid": total_paid,
-        "total_unpaid": total_unpaid,
-        "fully_paid": fully_paid,
-        "partial_paid": partial_paid,
-        "total_fee_per_student": total_fee_per_student,
-    }
-    return render(request, "lessons/student_payments.html", context)
+    # Without a current term the sheet is read-only. Balances are opened by
+    # the writes that need them, so showing the sheet writes nothing.
+    term = get_current_term()
+    balances = StudentTermBalance.objects.none()
+    if term is not None:
+        balances = StudentTermBalance.objects.filter(
+            term=term, student__class_group=teacher.main_class
+        ).select_related("student").order_by("student__last_name", "student__first_name", "student_id")
+
+    # Statistics in one conditional aggregate against each student's own fee for the term
+    stats = student_fee_statistics(balances)
 
     context = {
-        "class_groups": class_groups,
-        "students": students,
-        "selected_class_id": selected_class_id,
-        # Statistics
-        "total_students": total_students,
-        "total_paid": total_paid,
-        "total_unpaid": total_unpaid,
-        "fully_paid": fully_paid,
-        "partial_paid": partial_paid,
-        "total_fee_per_student": total_fee_per_student,
+        "class_group": teacher.main_class,
+        "term": term,
+        "balances": list(balances),
+        "total_students": stats["total_students"],
+        "total_paid": stats["total_paid"],
+        "total_unpaid": stats["total_unpaid"],
+        "fully_paid": stats["fully_paid"],
+        "partial_paid": stats["partial_paid"],
+        "total_fees": stats["total_fees"],
     }
     return render(request, "lessons/student_payments.html", context)
+
+
 @login_required
 @csrf_exempt
 def add_student_ajax(request):
@@ -324,13 +432,52 @@ def add_student_ajax(request):
             admission_number=admission_number,
             class_group=class_group
         )
+        # The post_save signal has opened the student's current-term balance
+        fee = StudentTermBalance.objects.filter(
+            student=student, term__is_current=True
+        ).values_list("fee", flat=True).first()
+        fee = student.term_fee if fee is None else fee
         return JsonResponse({
             "id": student.id,
             "name": f"{student.first_name} {student.last_name}",
-            "balance": f"{student.balance:.2f}"
+            "balance": f"{fee:.2f}",
+            "term_fee": f"{fee:.2f}",
         })
 
 
+@login_required
+def import_students_csv(request):
+    """
+    Enrol a whole intake from one CSV upload.
+
+    Staff may import into any class (each row names its class); a class
+    teacher's rows all go into their own class.
+    """
+    class_group = None
+    if not request.user.is_staff:
+        teacher = get_object_or_404(Teacher, user=request.user)
+        class_group = getattr(teacher, "main_class", None)
+        if class_group is None:
+            return redirect('teacher_dashboard')
+
+    created, errors = None, []
+    if request.method == "POST":
+        form = StudentImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            created, errors = import_students(form.cleaned_data["rows"], class_group=class_group)
+    else:
+        form = StudentImportForm()
+
+    return render(request, "lessons/import_students.html", {
+        "form": form,
+        "class_group": class_group,
+        "created": created,
+        "errors": errors,
+        "required_columns": REQUIRED_COLUMNS,
+        "optional_columns": OPTIONAL_COLUMNS,
+    })
+
+
 @login_required
 @csrf_exempt
 def edit_student_ajax(request, student_id):
@@ -356,56 +503,139 @@ def delete_student_ajax(request, student_id):
         
 
 @staff_member_required
+@reporting_reads()
 def admin_payments(request):
     selected_class_id = request.GET.get("class")
     selected_class_obj = None
 
-    # All classes
-    class_groups = ClassGroup.objects.all()
+    # All classes and terms (cached; also used to resolve the selected ones)
+    class_groups = get_class_groups()
+    terms = get_terms()
+
+    # Debt is per term: the chosen one, else the current one
+    selected_term_id = request.GET.get("term")
+    term = next((term for term in terms if str(term.id) == selected_term_id), None) or get_current_term()
 
-    # Student queryset (filtered if a class is chosen)
-    students = Student.objects.all()
+    # Balance queryset for the term (filtered if a class is chosen)
+    balances = StudentTermBalance.objects.filter(term=term) if term else StudentTermBalance.objects.none()
     if selected_class_id:
-        try:
-            selected_class_obj = ClassGroup.objects.get(id=selected_class_id)
-            students = students.filter(class_group=selected_class_obj)
-        except ClassGroup.DoesNotExist:
-            selected_class_obj = None  # fallback if invalid ID is passed
-
-    # Global totals
-    total_paid = students.aggregate(total=Sum("amount_paid"))["total"] or 0
-    total_fees = students.aggregate(total=Sum("term_fee"))["total"] or 0
-    total_unpaid = total_fees - total_paid
-
-    # Count statuses
-    total_students = students.count()
-    fully_paid = students.filter(amount_paid__gte=F("term_fee")).count()
-    unpaid = students.filter(amount_paid=0).count()
-    partial = total_students - fully_paid - unpaid
-
-    # Per-class stats (for summary table)
-    class_stats = class_groups.annotate(
-        total_students=Count("students"),
-        total_paid=Sum("students__amount_paid"),
-        total_fees=Sum("students__term_fee"),
-    )
+        selected_class_obj = next(
+            (group for group in class_groups if str(group.id) == selected_class_id), None
+        )
+        if selected_class_obj:
+            balances = balances.filter(student__class_group=selected_class_obj)
+
+    # Global totals and status buckets in one query
+    stats = student_fee_statistics(balances)
+
+    # Student table: sorted and paginated in the database
+    balances, sort = sort_students(balances.select_related("student__class_group"), request.GET.get("sort"))
+    paginator = Paginator(balances, ADMIN_PAYMENTS_PAGE_SIZE)
+    paginator.count = stats["total_students"]  # already counted above
+    page = paginator.get_page(request.GET.get("page"))
 
     context = {
         "class_groups": class_groups,
-        "students": students,
+        "terms": terms,
+        "term": term,
+        "balances": page,
+        "page_obj": page,
+        "sort": sort,
+        "sort_columns": ADMIN_PAYMENTS_COLUMNS,
         "selected_class_id": selected_class_id,
         "selected_class_obj": selected_class_obj,
 
         # global totals
-        "total_students": total_students,
-        "total_paid": total_paid,
-        "total_fees": total_fees,
-        "total_unpaid": total_unpaid,
-        "fully_paid": fully_paid,
-        "unpaid": unpaid,
-        "partial": partial,
+        "total_students": stats["total_students"],
+        "total_paid": stats["total_paid"],
+        "total_fees": stats["total_fees"],
+        "total_unpaid": stats["total_unpaid"],
+        "fully_paid": stats["fully_paid"],
+        "unpaid": stats["unpaid"],
+        "partial": stats["partial_paid"],
 
         # per-class summary
-        "class_stats": class_stats,
+        "class_stats": class_fee_statistics(term) if term else [],
     }
     return render(request, "lessons/admin_payments.html", context)
+
+
+# ---------- Staff: bulk status / payment transitions ----------
+@staff_member_required
+@require_POST
+def lesson_transition(request):
+    """
+    Apply one status or payment transition to every lesson matching the
+    posted filters, e.g. ``field=payment_status&value=Paid&week=12&teacher=3&status=Attended``.
+    At least one filter is required, so a bare POST cannot touch every lesson.
+    """
+    field = request.POST.get("field")
+    value = request.POST.get("value")
+    try:
+        lessons, applied = filter_lessons(request.POST)
+        if not applied:
+            raise ValueError(f"Give at least one of {', '.join(LESSON_FILTERS)}.")
+        batch = apply_transition(lessons, field, value, user=request.user, filters=applied)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+
+    return JsonResponse({
+        "batch": batch.id,
+        "field": batch.field,
+        "value": batch.new_value,
+        "row_count": batch.row_count,
+        "total_amount": f"{batch.total_amount:.2f}",
+    })
+
+
+# ---------- Staff: payroll CSV ----------
+class Echo:
+    """File-like object whose write() just hands the line back to csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+@staff_member_required
+def payroll_csv(request):
+    """
+    Stream the per-teacher payroll as CSV.
+
+    ``?by=teacher`` groups by timetable teacher instead of the recording
+    teacher. ``term`` (a Term id) and ``week_from`` / ``week_to`` (Week ids,
+    inclusive) limit the lessons to that stretch of the calendar.
+    """
+    by = request.GET.get("by", "created_by")
+    if by not in PAYROLL_GROUPINGS:
+        return JsonResponse({"error": f"by must be one of {', '.join(PAYROLL_GROUPINGS)}."}, status=400)
+    try:
+        term_id = _optional_id(request.GET.get("term"))
+        week_from_id = _optional_id(request.GET.get("week_from"))
+        week_to_id = _optional_id(request.GET.get("week_to"))
+    except ValueError:
+        return JsonResponse({"error": "term, week_from and week_to must be numeric ids."}, status=400)
+
+    weeks = {week.id: week for week in get_weeks()}
+    term = next((term for term in get_terms() if term.id == term_id), None)
+    week_from, week_to = weeks.get(week_from_id), weeks.get(week_to_id)
+    if (term_id and term is None) or (week_from_id and week_from is None) or (week_to_id and week_to is None):
+        return JsonResponse({"error": "Unknown term or week."}, status=400)
+
+    # The narrowest of the term's dates and the chosen weeks' start dates
+    date_from = max(filter(None, [term and term.start_date, week_from and week_from.start_date]), default=None)
+    date_to = min(filter(None, [term and term.end_date, week_to and week_to.start_date]), default=None)
+    rows = payroll_rows(by, date_from, date_to)
+
+    writer = csv.writer(Echo())
+    keys = [key for key, _ in PAYROLL_COLUMNS]
+
+    def lines():
+        yield writer.writerow([label for _, label in PAYROLL_COLUMNS])
+        for row in rows.iterator(chunk_size=PAYROLL_CHUNK_SIZE):
+            yield writer.writerow([
+                f"{row[key]:.2f}" if key.endswith("_amount") else row[key] for key in keys
+            ])
+
+    response = StreamingHttpResponse(lines(), content_type="text/csv")
+    response["Content-Disposition"] = 'attachment; filename="payroll.csv"'
+    return response
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -54,6 +56,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'lessons.replicas.ReadYourWritesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,13 +84,130 @@ WSGI_APPLICATION = 'remedial_system.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+# DB_ENGINE picks the backend: "sqlite" (the default, db.sqlite3 next to
+# manage.py) or "postgres", configured by the DB_* variables below. The
+# test suite runs against whichever is selected, e.g.
+#   DB_ENGINE=postgres DB_NAME=remedial DB_USER=remedial python manage.py test
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+# Applied to every new SQLite connection. SQLITE_JOURNAL_MODE=WAL lets
+# teachers read while a payment or lesson is being written. It is opt-in:
+# WAL rewrites the database file's header for good and keeps -wal/-shm
+# files beside it, which a checkout's db.sqlite3 should not pick up.
+# NORMAL sync is only safe under WAL; otherwise SQLite's FULL is kept.
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', '')
+SQLITE_WAL = SQLITE_JOURNAL_MODE.upper() == 'WAL'
+SQLITE_PRAGMAS = {
+    **({'journal_mode': SQLITE_JOURNAL_MODE} if SQLITE_JOURNAL_MODE else {}),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL' if SQLITE_WAL else 'FULL'),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 128 * 1024 * 1024)),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -20000)),  # negative = KiB, so ~20 MB
+    'temp_store': 'MEMORY',
 }
 
+if DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+                # Writers take the lock at BEGIN, so a read-then-write transaction
+                # waits its turn instead of failing with "database is locked".
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20)),  # seconds; sets busy_timeout
+            },
+        }
+    }
+elif DB_ENGINE == 'postgres':
+    # Needs psycopg 3, plus psycopg-pool unless DB_POOL_MAX_SIZE=0.
+    DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'remedial_system'),
+            'USER': os.environ.get('DB_USER', 'remedial_system'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Check a reused connection before the request that picks it up
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if DB_POOL_MAX_SIZE:
+        # Django's pool hands each request a pooled connection, which rules
+        # out CONN_MAX_AGE; the pool keeps min_size connections open itself.
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),  # seconds to wait for a free connection
+        }
+    else:
+        # No pool (e.g. behind PgBouncer): keep each worker's connection open
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+else:
+    raise ImproperlyConfigured(f'DB_ENGINE must be "sqlite" or "postgres", not {DB_ENGINE!r}.')
+
+# Optional read replica for the reporting pages (admin payments, the
+# payments dashboard and teacher statistics); see lessons/replicas.py.
+# Locally, copy db.sqlite3 and point DB_REPLICA_NAME at the copy.
+if os.environ.get('DB_REPLICA_NAME') or os.environ.get('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ.get('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        'HOST': os.environ.get('DB_REPLICA_HOST', DATABASES['default'].get('HOST', '')),
+        'PORT': os.environ.get('DB_REPLICA_PORT', DATABASES['default'].get('PORT', '')),
+        'TEST': {'MIRROR': 'default'},
+    }
+REPORTING_DATABASE = 'replica' if 'replica' in DATABASES else None
+# How long a browser reads only from the primary after one of its own writes
+REPLICA_PIN_SECONDS = int(os.environ.get('DB_REPLICA_PIN_SECONDS', 10))
+DATABASE_ROUTERS = ['lessons.replicas.ReplicaRouter']
+
+
+# Cache
+# Reference data (weeks, classes, subjects) and the version counters that
+# invalidate it are cached here; see lessons/reference.py. A version bump
+# only reaches the processes that share the cache, so any deployment with
+# more than one worker process must set REDIS_URL or MEMCACHED_LOCATION.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+elif os.environ.get('MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.environ['MEMCACHED_LOCATION'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'remedial-system',
+        }
+    }
+# True when every worker sees the same cache. A single-process server on
+# LocMem may set CACHE_SHARED=1 to opt in as well.
+SHARED_CACHE = bool(
+    os.environ.get('REDIS_URL') or os.environ.get('MEMCACHED_LOCATION') or os.environ.get('CACHE_SHARED')
+)
+REFERENCE_CACHE_ALIAS = 'default'
+# With a shared cache rows live until a save/delete bumps the version; a
+# per-process cache never hears other workers' bumps, so rows expire instead
+REFERENCE_CACHE_TIMEOUT = None if SHARED_CACHE else 5 * 60
+# Rendered teacher dashboards, cached only with SHARED_CACHE; keys carry the
+# versions, so the timeout only bounds how long superseded pages take up memory
+DASHBOARD_CACHE_ALIAS = 'default'
+DASHBOARD_CACHE_TIMEOUT = 60 * 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators